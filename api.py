@@ -0,0 +1,255 @@
+import argparse
+import datetime
+import email.utils
+import gzip
+import json
+import logging
+import os
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import bathymetry
+import metrics
+import openmeteo
+import prefetch
+import results
+import shards
+from areas import AREA_OPTIONS
+from forecast import score_days, day_report
+
+logger = logging.getLogger(__name__)
+
+# --- JSON API (Streamlit を通さずに予報を返す) ---
+# 座席チェッカー・魔釣pro などの連携ツール向け. 1エリア1日分は batch の JSON と同じ形
+#   GET /v1/forecast?area=明石海峡&date=2026-10-16
+#   GET /v1/forecast?area=明石海峡&area=鳴門海峡&start=2026-10-16&days=7 (area を省くと全エリア)
+#   GET /v1/areas, /healthz (先読みのエリアごとの状態つき), /metrics
+# ETag は上流データのバージョン. 同じバージョンなら計算・圧縮済みのレスポンスをそのまま返す
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8502
+MAX_AGE = 300
+# これより小さいレスポンスは圧縮しない
+GZIP_MIN_BYTES = 512
+MAX_RESPONSES = 512
+# 計測のラベルにする経路. それ以外 (404 など) は other にまとめる (系列が際限なく増えないように)
+ROUTES = ("/v1/forecast", "/v1/areas", "/healthz", "/metrics")
+
+response_cache = results.ResultCache(MAX_RESPONSES, name="api_response")
+metrics.add_collector(response_cache.samples)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _date(params, name):
+    try:
+        return datetime.date.fromisoformat(params[name][0])
+    except ValueError:
+        raise BadRequest(f"invalid {name}: {params[name][0]}") from None
+
+# クエリ文字列から (エリア辞書, 開始日, 日数). 日付を省くと明日1日分 (batch と同じ)
+def parse_query(query, areas):
+    params = urllib.parse.parse_qs(query)
+    names = list(dict.fromkeys(params.get("area") or areas))
+    unknown = [name for name in names if name not in areas]
+    if unknown:
+        raise BadRequest(f"unknown area: {', '.join(unknown)}")
+
+    if "date" in params:
+        start, days = _date(params, "date"), 1
+    else:
+        start = _date(params, "start") if "start" in params else datetime.date.today() + datetime.timedelta(days=1)
+        if "end" in params:
+            days = (_date(params, "end") - start).days + 1
+        else:
+            try:
+                days = int(params.get("days", ["1"])[0])
+            except ValueError:
+                raise BadRequest(f"invalid days: {params['days'][0]}") from None
+    if not 1 <= days <= openmeteo.MAX_FORECAST_DAYS:
+        raise BadRequest(f"days must be 1-{openmeteo.MAX_FORECAST_DAYS}")
+    return {name: areas[name] for name in names}, start, days
+
+
+# 返す本文 (JSON と gzip) と検証用ヘッダの値を1件にまとめておく
+# last_modified は元データを取得した時刻 (無ければ作った時刻)
+def _render(payload, version, last_modified=None):
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+    return {
+        "etag": f'W/"{version}"',
+        "last_modified": int(last_modified or time.time()),
+        "body": body,
+        "gzip": gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_BYTES else None,
+    }
+
+# 上流データ (日ごとのシャード) を引いてバージョンを決め, 同じバージョンなら計算しない
+def forecast_response(areas, start, days):
+    with metrics.timer("fetch", mode="api"):
+        data = shards.fetch_areas(start, days, areas)
+    version = results.data_version(
+        "forecast", start, days, [(name, loc["depth"]) for name, loc in areas.items()], [data[name] for name in areas],
+    )
+
+    def compute():
+        with metrics.timer("score", mode="api"):
+            reports = [
+                day_report(name, loc["depth"], day)
+                for name, loc in areas.items()
+                for day in score_days(*data[name], start, days, lat=loc["lat"], lon=loc["lon"], depth=loc["depth"])
+            ]
+        # 最後に取り直したシャードの取得時刻. 同じバージョンなら ETag と同じく変わらない
+        fetched = [shards.area_fetched_at(start, days, loc, max) for loc in areas.values()]
+        return _render(reports, version, max(fetched) if None not in fetched else None)
+
+    return response_cache.get(("forecast", version), compute)
+
+def areas_response(areas):
+    payload = [{"area": name, "lat": loc["lat"], "lon": loc["lon"], "depth": loc["depth"]} for name, loc in areas.items()]
+    return response_cache.get(("areas", results.data_version(payload)), lambda: _render(payload, results.data_version(payload)))
+
+
+# If-None-Match (弱い比較) を優先し, 無ければ If-Modified-Since で判定する
+def not_modified(headers, entry):
+    tags = headers.get("If-None-Match")
+    if tags is not None:
+        tags = [t.strip().removeprefix("W/") for t in tags.split(",")]
+        return "*" in tags or entry["etag"].removeprefix("W/") in tags
+    since = headers.get("If-Modified-Since")
+    if since:
+        try:
+            return entry["last_modified"] <= email.utils.parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def accepts_gzip(value):
+    for part in (value or "").split(","):
+        coding, _, param = part.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            param = param.strip()
+            try:
+                return not param.startswith("q=") or float(param[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+
+# 先読みが動いていればエリアごとの最後の成功・失敗 (UNIX 秒とエラー内容)
+def health(warmer):
+    prefetch_status = None
+    if warmer is not None:
+        prefetch_status = {
+            name: {
+                "last_success": s["last_success"],
+                "last_error": s["last_error"][0] if s["last_error"] else None,
+                "error": s["last_error"][1] if s["last_error"] else None,
+            }
+            for name, s in warmer.status().items()
+        }
+    return json.dumps({"status": "ok", "prefetch": prefetch_status}, ensure_ascii=False).encode()
+
+
+def make_handler(areas, warmer=None):
+    class Handler(BaseHTTPRequestHandler):
+        # 連携ツールは同じ接続で続けて叩くので keep-alive にする
+        # (ヘッダと本文を別々に書くので Nagle を切らないと応答ごとに遅延 ACK を待つ)
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self._handle(send_body=False)
+
+        def do_GET(self):
+            self._handle(send_body=True)
+
+        def _handle(self, send_body):
+            started = time.perf_counter()
+            parts = urllib.parse.urlsplit(self.path)
+            try:
+                if parts.path == "/v1/forecast":
+                    status = self._send_entry(forecast_response(*parse_query(parts.query, areas)), send_body)
+                elif parts.path == "/v1/areas":
+                    status = self._send_entry(areas_response(areas), send_body)
+                elif parts.path == "/healthz":
+                    status = self._send(200, "application/json; charset=utf-8", health(warmer), send_body)
+                elif parts.path == "/metrics":
+                    status = self._send(200, "text/plain; version=0.0.4; charset=utf-8", metrics.registry.render().encode(), send_body)
+                else:
+                    status = self._send_error(404, f"not found: {parts.path}", send_body)
+            except BadRequest as e:
+                status = self._send_error(400, str(e), send_body)
+            except Exception:
+                logger.exception("api request failed: %s", self.path)
+                status = self._send_error(500, "internal error", send_body)
+            route = parts.path if parts.path in ROUTES else "other"
+            metrics.inc("api_requests_total", path=route, status=str(status))
+            metrics.observe("api_request_seconds", time.perf_counter() - started, path=route)
+
+        def _send(self, status, ctype, body, send_body, headers=()):
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+            return status
+
+        def _send_error(self, status, message, send_body):
+            body = json.dumps({"error": message}, ensure_ascii=False).encode()
+            return self._send(status, "application/json; charset=utf-8", body, send_body)
+
+        def _send_entry(self, entry, send_body):
+            headers = [
+                ("ETag", entry["etag"]),
+                ("Last-Modified", email.utils.formatdate(entry["last_modified"], usegmt=True)),
+                ("Cache-Control", f"public, max-age={MAX_AGE}"),
+                ("Vary", "Accept-Encoding"),
+            ]
+            if not_modified(self.headers, entry):
+                self.send_response(304)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                return 304
+            body = entry["body"]
+            if entry["gzip"] is not None and accepts_gzip(self.headers.get("Accept-Encoding")):
+                body = entry["gzip"]
+                headers.append(("Content-Encoding", "gzip"))
+            return self._send(200, "application/json; charset=utf-8", body, send_body, headers)
+
+    return Handler
+
+# 海底地形があればエリアの水深を差し替えてから起動する
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, areas=AREA_OPTIONS, warmer=None):
+    server = ThreadingHTTPServer((host, port), make_handler(bathymetry.with_depths(areas), warmer))
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="魔釣 JSON API サーバー")
+    parser.add_argument("--host", default=os.environ.get("MATSURI_API_HOST", DEFAULT_HOST))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("MATSURI_API_PORT", DEFAULT_PORT)))
+    args = parser.parse_args(argv)
+
+    warmer = prefetch.Warmer.from_env(AREA_OPTIONS)
+    if warmer:
+        warmer.start()
+    server = make_server(args.host, args.port, warmer=warmer)
+    print(f"http://{args.host}:{server.server_address[1]}/v1/forecast", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,16 @@
 import streamlit as st
-import pandas as pd
-import json
-import urllib.request
-import urllib.parse
 import datetime
-import math
-import ssl
-import matplotlib.pyplot as plt
+import os
 import warnings
 
-# --- 設定 ---
-warnings.filterwarnings("ignore")
-st.set_page_config(page_title="魔釣 - 瀬戸内タイラバ予報 v7.6", page_icon="🎣")
+from areas import AREA_OPTIONS, get_seasonal_bait
+import metrics
+import startup
+
+# numpy・matplotlib などの重いモジュールは予報を描画するときに読み込む (起動を速くするため)
 
 # --- CSS (表のデザイン) ---
-st.markdown("""
+TABLE_CSS = """
     <style>
     div[data-testid="stDataFrame"] div[role="columnheader"],
     div[data-testid="stDataFrame"] th {
@@ -61,20 +57,11 @@ st.markdown("""
         .col-tac { font-size: 10px; }
     }
     </style>
-""", unsafe_allow_html=True)
-
-# --- エリア・URL定数 ---
-AREA_OPTIONS = {
-    "明石海峡": {"lat": 34.60, "lon": 135.00, "depth": 45},
-    "鳴門海峡": {"lat": 34.23, "lon": 134.65, "depth": 65},
-    "小豆島周辺": {"lat": 34.48, "lon": 134.27, "depth": 20},
-    "瀬戸大橋周辺": {"lat": 34.38, "lon": 133.81, "depth": 25},
-}
+"""
 
-HISTORICAL_TEMPS = {
-    1: 10.5, 2: 9.8, 3: 10.5, 4: 13.0, 5: 17.5, 6: 21.0,
-    7: 25.5, 8: 27.0, 9: 25.5, 10: 22.0, 11: 18.0, 12: 14.0
-}
+# --- 表示設定・URL定数 ---
+# グラフ表示: "image" (matplotlib画像をキャッシュ) / "native" (Streamlitのチャート)
+CHART_MODE = os.environ.get("MATSURI_CHART", "image")
 
 # 🔗 リンク先のURL
 KAIHO_URL = "https://www1.kaiho.mlit.go.jp/KAN5/tyouryuu/stream_akashi.html"
@@ -83,197 +70,306 @@ SEAT_CHECKER_URL = "https://matsuri-akashi-checker-4qw73q6qju7ppzztkyagpu.stream
 MATSURI_PRO_URL = "https://matsuri-pro-iongg68m3cpuaeupetxzpv.streamlit.app/"
 
 # --- 関数群 ---
-@st.cache_data(ttl=3600)
-def make_request(url):
-    req = urllib.request.Request(url)
-    req.add_header('User-Agent', 'Mozilla/5.0 (App; CPU iPhone OS 15_0)')
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-    try:
-        with urllib.request.urlopen(req, context=ctx) as res:
-            return json.loads(res.read().decode())
-    except:
-        return None
-
-def get_moon_age(date):
-    year, month, day = date.year, date.month, date.day
-    if month < 3: year -= 1; month += 12
-    p = math.floor(year / 4)
-    age = (year + p + month * 9 / 25 + day + 11) % 30
-    return int(age)
-
-def get_sinker_weight(moon_age, depth):
-    STANDARD_SINKERS = [30, 45, 60, 80, 100, 120, 150, 180, 200]
-    age_norm = moon_age % 15
-    if age_norm <= 2 or age_norm >= 13:
-        tide_name = "大潮(激)"
-        mult_min, mult_max = 2.0, 2.5
-    elif 3 <= age_norm <= 5 or 10 <= age_norm <= 12:
-        tide_name = "中潮(速)"
-        mult_min, mult_max = 1.5, 2.0
-    else:
-        tide_name = "小潮(緩)"
-        mult_min, mult_max = 1.0, 1.5
-
-    raw_min = depth * mult_min
-    raw_max = depth * mult_max
-
-    def get_closest_sinker(val):
-        return min(STANDARD_SINKERS, key=lambda x: abs(x - val))
-
-    w_min = get_closest_sinker(raw_min)
-    w_max = get_closest_sinker(raw_max)
-    if w_min > w_max: w_min = w_max
-
-    if w_min == w_max:
-        return tide_name, f"{w_min}g"
-    else:
-        return tide_name, f"{w_min}g〜{w_max}g"
-
-def estimate_tide(moon_age, hour):
-    base_high = 8.5; delay = 0.8
-    high_tide = (base_high + (moon_age % 15) * delay) % 12
-    diff = abs(hour - high_tide)
-    if diff > 6: diff = 12 - diff
-    level = math.cos(diff * (math.pi / 6))
-    is_slack = (diff < 1.0 or abs(diff - 6.0) < 1.0)
-    return level, is_slack
-
-def get_seasonal_bait(month):
-    if month in [12, 1, 2]:
-        return "海苔(ノリ)・底生", "黒・緑・濃い茶"
-    elif month in [3, 4, 5]:
-        return "イカナゴ", "ミドキン・緑・オレ金"
-    elif month in [6, 7]:
-        return "イカ・タコ", "グロー・ゼブラ・金"
-    elif month in [8, 9, 10, 11]:
-        return "イワシ・エビ", "オレンジ・赤・金"
-    else:
-        return "混合", "赤オレ"
-
-def suggest_strategy(h, sun_h, sc, t_diff, month, temp, cloud_cover, rain, depth):
-    c1 = "赤オレ" if h % 2 == 0 else "オレンジ"
-    s1 = "極細"
-    speed = "普通"
-    hook = "M"
-
-    is_nori_season = month in [12, 1, 2, 3, 4]
-
-    # --- ネクタイ選定 ---
-    if rain >= 0.5:
-        c1 = "チャート" if h % 2 == 0 else "ソリッドレッド"
-    elif h <= sun_h:
-        c1 = "チャート" if h % 2 == 0 else "赤ゼブラ"
-    elif t_diff <= -0.1:
-        c1 = "コーラ" if h % 2 == 0 else "赤黒"
-    elif month in [3, 4, 5]:
-        c1 = "ミドキン" if h % 2 == 0 else "グリーン"
-    elif is_nori_season and (temp < 13.0 or sc < 45):
-        c1 = "黒/海苔" if h % 2 == 0 else "コーラ"
-    elif cloud_cover > 70:
-        c1 = "チャート" if h % 2 == 0 else "赤ゼブラ"
-    elif depth >= 60: 
-        c1 = "オレンジゼブラ" if h % 2 == 0 else "赤黒"
-    elif depth <= 30: 
-        c1 = "オレ金" if h % 2 == 0 else "グリーン"
-    elif h <= sun_h + 2:
-        c1 = "オレ金" if h % 2 == 0 else "マジョーラゼブラ"
-    
-    # --- 形状選定 ---
-    if rain >= 0.5:
-        s1 = "ワイドカーリー"
-    elif month in [6, 7, 8] and sc >= 40:
-        s1 = "ロングカーリー"
-    elif depth >= 60: 
-        s1 = "強波動" if sc >= 40 else "カーリー"
-    elif depth <= 30: 
-        s1 = "ショート" if sc >= 40 else "極細"
-    elif sc >= 50: 
-        s1 = "強波動"
-    elif sc >= 30: 
-        s1 = "ショート"
-    elif sc >= 20:
-        s1 = "ストレート"
-    else:
-        s1 = "極細"
-    
-    # --- 巻き速度 ---
-    if temp >= 18.0 and sc >= 40:
-        speed = "早巻"
-    elif temp <= 12.0 or sc <= 20:
-        speed = "激遅"
-    elif sc >= 30:
-        speed = "普通"
-    else:
-        speed = "遅め"
-
-    # --- フックサイズ ---
-    if month in [12, 1, 2] and (temp < 10.0 or sc < 30):
-        hook = "3S"
-    elif month in [3, 4]:
-        hook = "SS"
-    elif speed == "激遅" or sc < 40:
-        hook = "S"
-    elif temp >= 22.0 and sc >= 50:
-        hook = "L"
-    else:
-        hook = "M"
-
-    # --- ワーム判定 ---
-    worm_option = ""
-    if sc <= 10: 
-        worm_option = "+ワーム"
-
-    # --- 抑えパターン ---
-    c2 = "グリーン"; s2 = "ショート"
-    if c1 == "チャート": c2 = "オレ金"
-    elif c1 == "ソリッドレッド": c2 = "チャート"
-    elif c1 == "赤ゼブラ": c2 = "オレンジ"
-    elif c1 == "ミドキン": c2 = "オレ金"
-    elif c1 == "オレ金": c2 = "ピンク"
-    elif c1 == "マジョーラゼブラ": c2 = "ピンク"
-    elif c1 == "ピンク": c2 = "赤オレ"
-    elif c1 == "コーラ": c2 = "赤黒"
-    elif c1 == "赤黒": c2 = "コーラ"
-    elif c1 == "黒/海苔": c2 = "コーラ"
-    elif c1 == "赤オレ": c2 = "マジョーラゼブラ"
-    elif c1 == "オレンジ": c2 = "赤オレ"
-    elif c1 == "オレンジゼブラ": c2 = "赤黒"
-    elif c1 == "グリーン": c2 = "ミドキン"
-    
-    if s1 == "ロングカーリー": s2 = "ショート"
-    elif s1 == "ワイドカーリー": s2 = "カーリー"
-    elif s1 == "強波動": s2 = "ショート"
-    elif s1 == "ショート": s2 = "極細"
-    elif s1 == "ストレート": s2 = "ショート"
-    else: s2 = "カーリー"
-    
-    return f"{c1}×{s1}", f"{c2}×{s2}", speed, hook, worm_option
-
-@st.cache_data(ttl=3600)
-def get_weather_data(target_date, lat, lon):
-    bm = "https://marine-api.open-meteo.com/v1/marine"
-    bw = "https://api.open-meteo.com/v1/forecast"
-    d_str = target_date.strftime("%Y-%m-%d")
-    y_str = (target_date - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-    
-    p_temp = {"latitude": lat, "longitude": lon, "hourly": "sea_surface_temperature", "start_date": y_str, "end_date": d_str}
-    
-    p_weather = {
-        "latitude": lat, 
-        "longitude": lon, 
-        "daily": "sunrise", 
-        "hourly": "cloud_cover,wind_speed_10m,rain",
-        "start_date": d_str, 
-        "end_date": d_str, 
-        "timezone": "Asia/Tokyo"
+# 中身は書き換えられない HourlySeries なので, cache_resource で参照を返す (ヒットごとの pickle・コピーをしない)
+# fresh_until (シャードの最も早い期限) をキーに含めるので, シャードを取り直せば次の参照で組み立て直す
+@st.cache_resource(max_entries=32)
+def get_weather_data(start_date, days=1, fresh_until=None):
+    import shards
+    metrics.inc("cache_misses_total", cache="streamlit")
+    return shards.fetch_areas(start_date, days, AREA_OPTIONS)
+
+# st.cache_resource の参照回数と取得時間を記録する (ヒット数 = 参照 - ミス)
+# 手元のシャードが揃っていない・期限切れのときはキャッシュを通さずに取得する (取得・裏での取り直しを起こす)
+def weather_data(start_date, days=1):
+    import shards
+    metrics.inc("cache_lookups_total", cache="streamlit")
+    with metrics.timer("fetch"):
+        fresh_until = shards.areas_fresh_until(start_date, days, AREA_OPTIONS)
+        if fresh_until is None:
+            metrics.inc("cache_misses_total", cache="streamlit")
+            return shards.fetch_areas(start_date, days, AREA_OPTIONS)
+        return get_weather_data(start_date, days, fresh_until)
+
+# 先読みスレッドはプロセスごとに1つだけ起動する
+@st.cache_resource
+def start_prefetch():
+    import prefetch
+    warmer = prefetch.Warmer.from_env(AREA_OPTIONS)
+    return warmer.start() if warmer else None
+
+# MATSURI_METRICS_PORT / MATSURI_METRICS_FILE で計測結果を出す (プロセスごとに1つ)
+@st.cache_resource
+def start_metrics():
+    return metrics.from_env()
+
+WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+
+# 予報の描画に使うモジュールを読み込む (起動プロファイルに読み込み完了を記録する)
+def load_forecast_modules():
+    warnings.filterwarnings("ignore")
+    import forecast, scoring, charts
+    startup.profile.mark("forecast_modules")
+
+# 海底地形データがあればエリア基準地点周りの水深, 無ければ想定平均水深
+def resolve_depth(area):
+    import bathymetry
+    return bathymetry.area_depth(AREA_OPTIONS[area])
+
+# 水深の注記. 海底地形データから取れなかったときだけ想定平均水深と書く
+def depth_caption(area, depth):
+    import bathymetry
+    if bathymetry.has_area_depth(AREA_OPTIONS[area]):
+        return f"※{area}周辺の水深 {depth}m (海底地形データ) でロジックを最適化しています。"
+    return f"※{area}の想定平均水深 {depth}m でロジックを最適化しています。"
+
+# --- 表示した結果の再利用 ---
+# 一度表示した (モード, エリア, 日付...) は, 他の操作で再実行されてもボタン無しで再表示する
+# 計算結果は results.result_cache (プロセス全体の LRU) に (…, 水深, 上流データのバージョン) で置く
+MAX_VIEWED = 16
+
+
+def was_viewed(view):
+    return view in st.session_state.get("viewed", [])
+
+def mark_viewed(view):
+    viewed = [v for v in st.session_state.get("viewed", []) if v != view] + [view]
+    st.session_state["viewed"] = viewed[-MAX_VIEWED:]
+
+def best_days_rows(selected_area, start_date, n_days, sd, wd, depth):
+    from forecast import score_days, rank_days
+    from scoring import get_sinker_weight
+    loc = AREA_OPTIONS[selected_area]
+    with metrics.timer("score", mode="best_days"):
+        ranking = rank_days(score_days(sd, wd, start_date, n_days, lat=loc["lat"], lon=loc["lon"]))
+
+    rows_html = ""
+    for rank, r in enumerate(ranking, 1):
+        d = r["date"]
+        tname, sinker = get_sinker_weight(r["day"]["moon_age"], depth)
+        notes = []
+        if r["day"]["use_historical"]: notes.append("平年値")
+        if r["day"]["day_trend_label"]: notes.append(r["day"]["day_trend_label"])
+        rows_html += (
+            f"<tr><td class='col-time'>{rank}. {d.month}/{d.day}({WEEKDAYS[d.weekday()]})</td>"
+            f"<td class='col-honmei'>{r['start_h']}:00〜{r['end_h'] + 1}:00</td>"
+            f"<td class='col-osae'>{r['window_score']:.0f}点 (最高{r['max_score']})</td>"
+            f"<td class='col-tac'>{tname}<br>{sinker}</td>"
+            f"<td class='col-note'>{' '.join(notes)}</td></tr>"
+        )
+    return rows_html
+
+# 期間のスライダーとボタンはこの中だけ再実行する
+@st.fragment
+def render_best_days(selected_area):
+    import openmeteo
+    n_days = st.slider("📆 探す期間 (日)", 3, openmeteo.MAX_RANGE_DAYS, 14)
+    start_date = datetime.date.today() + datetime.timedelta(days=1)
+
+    view = ("best_days", selected_area, start_date, n_days)
+    if st.button("ベスト日を探す") or was_viewed(view):
+        load_forecast_modules()
+        import results
+        try:
+            depth = resolve_depth(selected_area)
+            with st.spinner(f'{selected_area}の{n_days}日間を解析中...'):
+                sd, wd = weather_data(start_date, n_days)[selected_area]
+                rows_html = results.result_cache.get(
+                    ("best_days", selected_area, start_date, n_days, depth, results.data_version(sd, wd)),
+                    lambda: best_days_rows(selected_area, start_date, n_days, sd, wd, depth),
+                )
+
+            st.success(f"{selected_area}のベスト日ランキング ({start_date} から{n_days}日間)")
+            st.markdown(TABLE_CSS, unsafe_allow_html=True)
+            st.markdown(f"""
+            <table class="matsuri-table">
+                <thead>
+                    <tr>
+                        <th>日付</th>
+                        <th>時合い<br>(3時間)</th>
+                        <th>スコア</th>
+                        <th>潮回り<br>(シンカー)</th>
+                        <th>備考</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {rows_html}
+                </tbody>
+            </table>
+            """, unsafe_allow_html=True)
+            st.caption("※時合いは3時間平均スコアが最も高い時間帯です。日付を指定モードで詳細を確認できます。")
+            mark_viewed(view)
+        except Exception as e:
+            st.error(f"予期せぬエラーが発生しました: {e}")
+            st.warning("期間を短くするか、しばらく時間を置いてから再度お試しください。")
+
+def area_compare_rows(target_date, area_data, depths):
+    from forecast import score_days, rank_days
+    from scoring import get_sinker_weight
+    results = []
+    with metrics.timer("score", mode="compare"):
+        for area, (sd, wd) in area_data.items():
+            loc = AREA_OPTIONS[area]
+            day = score_days(sd, wd, target_date, lat=loc["lat"], lon=loc["lon"])[0]
+            results.append((area, day, rank_days([day])[0]))
+    results.sort(key=lambda x: (-x[2]["window_score"], -x[2]["max_score"]))
+
+    rows_html = ""
+    for area, day, r in results:
+        tname, sinker = get_sinker_weight(day["moon_age"], depths[area])
+        if day["use_historical"]:
+            temp_txt = f"平年値 約{day['min_t']}℃"
+        else:
+            temp_txt = f"{day['min_t']:.1f}〜{day['max_t']:.1f}℃"
+        rows_html += (
+            f"<tr><td class='col-time'>{area}</td>"
+            f"<td class='col-honmei'>{r['start_h']}:00〜{r['end_h'] + 1}:00</td>"
+            f"<td class='col-osae'>{r['window_score']:.0f}点 (最高{r['max_score']})</td>"
+            f"<td class='col-tac'>{tname}<br>{sinker}</td>"
+            f"<td class='col-note'>{' '.join(filter(None, [temp_txt, day['day_trend_label']]))}</td></tr>"
+        )
+    return rows_html
+
+@st.fragment
+def render_area_compare(target_date):
+    view = ("compare", target_date)
+    if st.button("全エリアを比較する") or was_viewed(view):
+        load_forecast_modules()
+        import results
+        try:
+            with st.spinner('全エリアの海況・気象を解析中...'):
+                area_data = weather_data(target_date)
+                depths = {area: resolve_depth(area) for area in area_data}
+                rows_html = results.result_cache.get(
+                    ("compare", target_date, tuple(depths.items()), results.data_version(area_data)),
+                    lambda: area_compare_rows(target_date, area_data, depths),
+                )
+
+            st.success(f"{target_date} の全エリア比較")
+            st.markdown(TABLE_CSS, unsafe_allow_html=True)
+            st.markdown(f"""
+            <table class="matsuri-table">
+                <thead>
+                    <tr>
+                        <th>エリア</th>
+                        <th>時合い<br>(3時間)</th>
+                        <th>スコア</th>
+                        <th>潮回り<br>(シンカー)</th>
+                        <th>水温</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {rows_html}
+                </tbody>
+            </table>
+            """, unsafe_allow_html=True)
+            st.caption("※シンカーは各エリアの水深（海底地形データが無い場合は想定平均水深）での目安です。")
+            mark_viewed(view)
+        except Exception as e:
+            st.error(f"予期せぬエラーが発生しました: {e}")
+            st.warning("日付を変更するか、しばらく時間を置いてから再度お試しください。")
+
+# 格子点の計算結果は grid.tile_cache にあるので, ここでは表示の再利用だけ
+@st.fragment
+def render_grid_map(target_date):
+    from areas import GRID_REGIONS
+    region = st.selectbox("🗺️ 海域を選択", list(GRID_REGIONS.keys()))
+    step = st.select_slider("📐 格子の間隔", options=[0.05, 0.025], value=0.025, format_func=lambda s: f"約{s * 111:.1f}km")
+
+    view = ("grid", region, step, target_date)
+    if st.button("海域マップを表示する") or was_viewed(view):
+        load_forecast_modules()
+        import charts, grid
+        try:
+            with st.spinner(f'{region}の格子点を解析中...'):
+                with metrics.timer("score", mode="grid_map"):
+                    result = grid.score_grid(GRID_REGIONS[region], target_date, step)
+                spots = grid.top_spots(result)
+
+                rows_html = ""
+                for rank, s in enumerate(spots, 1):
+                    rows_html += (
+                        f"<tr><td class='col-time'>{rank}. {s['lat']:.3f}, {s['lon']:.3f}</td>"
+                        f"<td class='col-honmei'>{s['start_h']}:00〜{s['end_h'] + 1}:00</td>"
+                        f"<td class='col-osae'>{s['window_score']:.0f}点 (最高{s['max_score']})</td>"
+                        f"<td class='col-tac'>{s['best_hour']}:00<br>{s['honmei']}</td>"
+                        f"<td class='col-note'>{s['near']}寄り<br>水深{s['depth']}m {s['sinker']}</td></tr>"
+                    )
+
+            n_sea = int(result["sea"].sum())
+            st.success(f"{target_date} {region}の海域マップ ({n_sea}地点)")
+            title_txt = f"{target_date} (Moon:{result['moon_age']})"
+            if CHART_MODE == "native":
+                st.vega_lite_chart(charts.vega_heatmap(result, title_txt), width="stretch")
+            else:
+                chart_key = ("grid", region, step, target_date, charts.data_version(result["best_score"], result["best_hour"]))
+                png = charts.chart_cache.get(chart_key, lambda: charts.render_heatmap_png(result, title_txt, grid.area_pins()))
+                st.image(png, width="stretch")
+            st.markdown(TABLE_CSS, unsafe_allow_html=True)
+            st.markdown(f"""
+            <table class="matsuri-table">
+                <thead>
+                    <tr>
+                        <th>地点<br>(緯度, 経度)</th>
+                        <th>時合い<br>(3時間)</th>
+                        <th>スコア</th>
+                        <th>最高時刻<br>(本命)</th>
+                        <th>最寄り<br>(シンカー)</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {rows_html}
+                </tbody>
+            </table>
+            """, unsafe_allow_html=True)
+            if result["pending"]:
+                st.info(f"⏳ {result['pending']}区画は取得待ちのため平年値で表示しています（空白は陸地とは限りません）。しばらくしてからもう一度表示すると続きを取得します。")
+            elif result["use_historical"][result["sea"]].all():
+                st.info("⚠️ 水温予報の期間外のため、平年値で計算しています。陸地の判定もできないため全地点を表示しています。")
+            st.caption("※▲は各エリアの基準地点です。空白は陸地（水温データなし）です。")
+            mark_viewed(view)
+        except Exception as e:
+            st.error(f"予期せぬエラーが発生しました: {e}")
+            st.warning("格子を粗くするか、しばらく時間を置いてから再度お試しください。")
+
+# 日付指定モードの計算部分 (表示に使う値と表の HTML)
+def day_result(selected_area, target_date, sd, wd, depth):
+    from forecast import score_days, hour_rows, sinker_table
+    from scoring import get_moon_age, get_sinker_weight
+    mage = get_moon_age(target_date)
+    tname, area_sinker = get_sinker_weight(mage, depth)
+    loc = AREA_OPTIONS[selected_area]
+    with metrics.timer("score", mode="day"):
+        day = score_days(sd, wd, target_date, lat=loc["lat"], lon=loc["lon"])[0]
+    with metrics.timer("strategy"):
+        rows = hour_rows(day, depth)
+
+    with metrics.timer("table"):
+        table_html_rows = ""
+
+        for row in rows:
+            time_display = f"{row['hour']}:00<br>{row['weather']} {row['wind_label']}"
+            tac_display = f"{row['speed']}・{row['hook']}"
+            if row["worm"]: tac_display += f"<br>{row['worm']}"
+            tie1, tie2, note_str = row["honmei"], row["osae"], " ".join(row["notes"])
+
+            row_html = f"<tr><td class='col-time'>{time_display}</td><td class='col-honmei'>{tie1}</td><td class='col-osae'>{tie2}</td><td class='col-tac'>{tac_display}</td><td class='col-note'>{note_str}</td></tr>"
+            table_html_rows += row_html
+
+    return {
+        "mage": mage, "tname": tname, "area_sinker": area_sinker, "sinkers": sinker_table(mage),
+        "day": day, "table_html_rows": table_html_rows,
     }
-    
-    return make_request(f"{bm}?{urllib.parse.urlencode(p_temp)}"), make_request(f"{bw}?{urllib.parse.urlencode(p_weather)}")
+
+# MATSURI_PROFILE_STARTUP=1 のときは起動時間の内訳を表示する
+def show_startup_profile():
+    startup.profile.log_once()
+    with st.expander("⏱️ 起動プロファイル"):
+        st.json(startup.profile.report())
 
 # --- メイン画面 ---
-def main():
+def render_page():
+    st.set_page_config(page_title="魔釣 - 瀬戸内タイラバ予報 v7.6", page_icon="🎣")
+
     st.markdown("""
         <h1 style='text-align: center; font-size: 32px; margin-bottom: 5px; font-weight: 800;'>
             <span style='margin-right: 0.5em;'>🌊 魔釣</span><br>
@@ -285,72 +381,61 @@ def main():
         </p>
     """, unsafe_allow_html=True)
 
+    mode = st.radio("🔎 予報モード", ["日付を指定", "ベスト日を探す", "全エリア比較", "海域マップ"], horizontal=True)
+    if mode in ("全エリア比較", "海域マップ"):
+        target_date = st.date_input("📅 釣行日を選択", datetime.date.today() + datetime.timedelta(days=1))
+        startup.profile.mark("first_paint")
+        start_prefetch()
+        start_metrics()
+        if mode == "海域マップ":
+            render_grid_map(target_date)
+        else:
+            render_area_compare(target_date)
+        return
+
     selected_area = st.selectbox("🎣 釣行エリアを選択", list(AREA_OPTIONS.keys()))
-    lat = AREA_OPTIONS[selected_area]["lat"]
-    lon = AREA_OPTIONS[selected_area]["lon"]
-    depth = AREA_OPTIONS[selected_area]["depth"]
+    startup.profile.mark("first_paint")
+    start_prefetch()
+    start_metrics()
+    depth = resolve_depth(selected_area)
     
+    if mode == "ベスト日を探す":
+        st.caption(depth_caption(selected_area, depth))
+        render_best_days(selected_area)
+        return
+    render_day_forecast(selected_area, depth)
+
+# 日付・ボタンの操作ではこの中だけ再実行する (エリアを変えたときは全体)
+@st.fragment
+def render_day_forecast(selected_area, depth):
     target_date = st.date_input("📅 釣行日を選択", datetime.date.today() + datetime.timedelta(days=1))
     
     bait_name, bait_colors = get_seasonal_bait(target_date.month)
     st.info(f"🐟 **現在のシーズナルパターン: {bait_name}**\n\n有効カラー目安: {bait_colors}")
-    st.caption(f"※{selected_area}の想定平均水深 {depth}m でロジックを最適化しています。")
-
-    if st.button("魔釣予報を開始する"):
+    st.caption(depth_caption(selected_area, depth))
+    # 先読み (または前の表示) で手元にあるデータを上流から取った時刻
+    import shards
+    updated = shards.area_fetched_at(target_date, 1, AREA_OPTIONS[selected_area])
+    if updated:
+        st.caption(f"※予報データ更新: {datetime.datetime.fromtimestamp(updated):%m/%d %H:%M}")
+
+    view = ("day", selected_area, target_date)
+    if st.button("魔釣予報を開始する") or was_viewed(view):
+        load_forecast_modules()
+        import charts, results
         try:
             with st.spinner(f'{selected_area}の海況・気象・水深パターンを解析中...'):
-                mage = get_moon_age(target_date)
-                
-                tname, s15 = get_sinker_weight(mage, 15)
-                _, s30 = get_sinker_weight(mage, 30)
-                _, s45 = get_sinker_weight(mage, 45)
-                _, s60 = get_sinker_weight(mage, 60)
-                _, s80 = get_sinker_weight(mage, 80)
-                
-                sd, wd = get_weather_data(target_date, lat, lon)
-                sun_h = int(wd["daily"]["sunrise"][0].split('T')[1].split(':')[0]) if wd else 7
-                
-                r_temps = sd["hourly"]["sea_surface_temperature"] if sd else []
-                r_clouds = wd["hourly"]["cloud_cover"] if (wd and "cloud_cover" in wd["hourly"]) else []
-                r_winds = wd["hourly"]["wind_speed_10m"] if (wd and "wind_speed_10m" in wd["hourly"]) else []
-                r_rains = wd["hourly"]["rain"] if (wd and "rain" in wd["hourly"]) else []
-                
-                OFF = 15
-                use_historical = False
-                valid_data_list = [t for t in r_temps if t is not None and t > 0]
-                
-                day_trend_score = 0
-                day_trend_label = ""
-
-                if not valid_data_list:
-                    use_historical = True
-                    avg_temp = HISTORICAL_TEMPS.get(target_date.month, 15.0)
-                    r_temps = [avg_temp] * 48
-                else:
-                    if len(r_temps) >= 48:
-                        temps_yesterday = [t for t in r_temps[0:24] if t is not None]
-                        temps_today = [t for t in r_temps[24:48] if t is not None]
-
-                        if temps_yesterday and temps_today:
-                            avg_yesterday = sum(temps_yesterday) / len(temps_yesterday)
-                            avg_today = sum(temps_today) / len(temps_today)
-                            diff_day = avg_today - avg_yesterday
-                            
-                            if diff_day <= -0.5:
-                                day_trend_score = -20
-                                day_trend_label = f"⚠️前日比{diff_day:+.1f}℃"
-                            elif diff_day >= 0.5:
-                                day_trend_score = 10
-                                day_trend_label = f"前日比{diff_day:+.1f}℃"
-
-                day_temps = []
-                for h in range(5, 16):
-                    idx = OFF + h
-                    if idx < len(r_temps) and r_temps[idx] is not None:
-                         day_temps.append(r_temps[idx])
-                
-                min_t = min(day_temps) if day_temps else 0
-                max_t = max(day_temps) if day_temps else 0
+                sd, wd = weather_data(target_date)[selected_area]
+                result = results.result_cache.get(
+                    ("day", selected_area, target_date, depth, results.data_version(sd, wd)),
+                    lambda: day_result(selected_area, target_date, sd, wd, depth),
+                )
+                mage, tname, area_sinker, sinkers = result["mage"], result["tname"], result["area_sinker"], result["sinkers"]
+                day, table_html_rows = result["day"], result["table_html_rows"]
+                sun_h = day["sun_h"]
+                use_historical = day["use_historical"]
+                day_trend_label = day["day_trend_label"]
+                min_t, max_t = day["min_t"], day["max_t"]
 
                 st.success(f"{selected_area}の解析が完了しました！")
                 
@@ -360,11 +445,12 @@ def main():
                 with col2:
                     st.markdown(f"""
                     **推奨シンカー (目安)**
-                    - **水深15m**: {s15}
-                    - **水深30m**: {s30}
-                    - **水深45m**: {s45}
-                    - **水深60m**: {s60}
-                    - **水深80m**: {s80}
+                    - **{selected_area} (水深{depth}m)**: {area_sinker}
+                    - **水深15m**: {sinkers[15]}
+                    - **水深30m**: {sinkers[30]}
+                    - **水深45m**: {sinkers[45]}
+                    - **水深60m**: {sinkers[60]}
+                    - **水深80m**: {sinkers[80]}
                     """, unsafe_allow_html=True)
                     st.caption("※船長・エリアの指示がある場合はそちらに従ってください。")
                 
@@ -377,121 +463,15 @@ def main():
                     elif "前日比" in day_trend_label:
                          st.info(f"📈 {day_trend_label} : 前日より水温が上昇傾向です。活性アップに期待できます。")
 
-                hl, sl, tl, tll = [], [], [], []
-                table_html_rows = ""
-                
-                for h in range(5, 16):
-                    idx = OFF + h
-                    ct = r_temps[idx] if (idx < len(r_temps) and r_temps[idx] is not None) else (day_temps[0] if day_temps else 15.0)
-                    pt = ct
-                    if idx > 0 and r_temps[idx-1] is not None:
-                        pt = r_temps[idx-1]
-                    
-                    tdiff = ct - pt
-                    if use_historical: tdiff = 0
-                    
-                    cloud = r_clouds[h] if (h < len(r_clouds) and r_clouds[h] is not None) else 0
-                    wind = r_winds[h] if (h < len(r_winds) and r_winds[h] is not None) else 0
-                    rain = r_rains[h] if (h < len(r_rains) and r_rains[h] is not None) else 0
-                    
-                    tlev, slack = estimate_tide(mage, h)
-                    
-                    sc = 0
-                    if h == sun_h: sc += 40
-                    elif abs(h - sun_h) == 1: sc += 20
-                    if slack: sc += 50
-                    elif h>5 and abs(tlev - tll[-1]) > 0.3: sc += 30
-                    
-                    if not use_historical:
-                        if tdiff >= 0.1: sc += 20
-                        elif tdiff <= -0.1: sc -= 20
-                    
-                    sc += day_trend_score
-                    
-                    w_icon = ""
-                    if rain >= 0.5:
-                        sc += 10; w_icon = "☔"
-                    elif cloud >= 60: 
-                        sc += 10; w_icon = "☁️"
-                    elif cloud <= 20:
-                        sc -= 5; w_icon = "☀️"
-                    else:
-                        w_icon = "⛅"
-                    
-                    wind_text = ""
-                    if wind >= 10.0:
-                        sc = 0; wind_text = "爆風"
-                    elif wind >= 7.0:
-                        sc -= 10; wind_text = "強風"
-                    elif wind >= 5.0:
-                        sc += 5; wind_text = "やや強"
-                    elif wind >= 2.0:
-                        sc += 20; wind_text = "最適"
-                    else:
-                        sc -= 20; wind_text = "静穏"
-                    
-                    low_temp_alert = ""
-                    if ct <= 10.0:
-                        sc = int(sc * 0.2); low_temp_alert = "激渋"
-                    elif ct <= 12.0:
-                        sc = int(sc * 0.5); low_temp_alert = "低水温"
-                    
-                    if sc < 0: sc = 0
-                    if sc > 100: sc = 100
-                    
-                    tie1, tie2, spd, hk, worm = suggest_strategy(h, sun_h, sc, tdiff, target_date.month, ct, cloud, rain, depth)
-                    
-                    time_display = f"{h}:00<br>{w_icon} {wind_text}"
-                    tac_display = f"{spd}・{hk}"
-                    if worm: tac_display += f"<br>{worm}"
-
-                    notes = []
-                    if slack: notes.append("★転流")
-                    if low_temp_alert: notes.append(f"⚠️{low_temp_alert}")
-                    if rain >= 0.5: notes.append("濁り")
-                    if day_trend_label and not low_temp_alert: notes.append(day_trend_label)
-                    note_str = " ".join(notes)
-                    
-                    hl.append(h); sl.append(sc); tl.append(ct); tll.append(tlev)
-                    
-                    row_html = f"<tr><td class='col-time'>{time_display}</td><td class='col-honmei'>{tie1}</td><td class='col-osae'>{tie2}</td><td class='col-tac'>{tac_display}</td><td class='col-note'>{note_str}</td></tr>"
-                    table_html_rows += row_html
+                hl, sl, tl, tll = day["hours"].tolist(), day["score"].tolist(), day["temp"].tolist(), day["tide"].tolist()
 
                 # --- グラフ描画 ---
-                TITLE_SIZE = 16; LABEL_SIZE = 12; TICK_SIZE = 10; LINE_WIDTH = 2.0; MARKER_SIZE = 6
-
                 title_txt = f"{target_date} {selected_area} (Moon:{mage:.1f})"
-                fig, ax1 = plt.subplots(figsize=(10, 5))
-                
-                color = 'tab:blue'
-                ax1.set_xlabel('Time', fontsize=LABEL_SIZE)
-                ax1.set_ylabel('Score', color=color, fontsize=LABEL_SIZE)
-                ax1.bar(hl, sl, color=color, alpha=0.4)
-                ax1.set_ylim(0, 100)
-                ax1.tick_params(axis='x', labelsize=TICK_SIZE)
-                ax1.tick_params(axis='y', labelcolor=color, labelsize=TICK_SIZE)
-                
-                ax2 = ax1.twinx()
-                color = 'tab:red'
-                ax2.set_ylabel('Temp (C)', color=color, fontsize=LABEL_SIZE)
-                ax2.plot(hl, tl, color=color, marker='o', linewidth=LINE_WIDTH, markersize=MARKER_SIZE)
-                vt = [t for t in tl if t > 0]
-                if vt:
-                     margin = 1.0 if max(vt) == min(vt) else 0.5
-                     ax2.set_ylim(min(vt)-margin, max(vt)+margin)
-                ax2.tick_params(axis='y', labelcolor=color, labelsize=TICK_SIZE)
-                
-                ax3 = ax1.twinx()
-                ax3.spines["right"].set_position(("axes", 1.15))
-                color = 'tab:green'
-                ax3.set_ylabel('Tide (Est)', color=color, fontsize=LABEL_SIZE)
-                ax3.plot(hl, tll, color=color, linestyle='--', marker='x', linewidth=LINE_WIDTH, markersize=MARKER_SIZE)
-                ax3.set_ylim(-1.5, 1.5)
-                ax3.set_yticks([])
-                
-                plt.title(title_txt, fontsize=TITLE_SIZE)
-                plt.grid(axis='x', linestyle='--', alpha=0.5)
-                st.pyplot(fig)
+                if CHART_MODE == "native":
+                    st.vega_lite_chart(charts.vega_spec(hl, sl, tl, tll, title_txt), width="stretch")
+                else:
+                    chart_key = (selected_area, target_date, charts.data_version(hl, sl, tl, tll))
+                    st.image(charts.chart_cache.get_png(chart_key, hl, sl, tl, tll, title_txt), width="stretch")
 
                 st.markdown("### 📝 戦略ネクタイ<br>(本命 / 抑え / 戦術)", unsafe_allow_html=True)
                 
@@ -511,6 +491,7 @@ def main():
                     </tbody>
                 </table>
                 """
+                st.markdown(TABLE_CSS, unsafe_allow_html=True)
                 st.markdown(full_table_html, unsafe_allow_html=True)
                 
                 st.caption("※時間の「★」は転流（潮止まり）の目安です。")
@@ -566,10 +547,18 @@ def main():
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
+            mark_viewed(view)
                 
         except Exception as e:
             st.error(f"予期せぬエラーが発生しました: {e}")
             st.warning("日付を変更するか、しばらく時間を置いてから再度お試しください。")
 
+def main():
+    startup.profile.start_run()
+    render_page()
+    startup.profile.mark("script_end")
+    if startup.ENABLED:
+        show_startup_profile()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,27 @@
+# --- 釣行エリア (起動直後の画面で使うので重い依存を持たせない) ---
+AREA_OPTIONS = {
+    "明石海峡": {"lat": 34.60, "lon": 135.00, "depth": 45},
+    "鳴門海峡": {"lat": 34.23, "lon": 134.65, "depth": 65},
+    "小豆島周辺": {"lat": 34.48, "lon": 134.27, "depth": 20},
+    "瀬戸大橋周辺": {"lat": 34.38, "lon": 133.81, "depth": 25},
+}
+
+# --- 海域マップの範囲 (南端, 北端, 西端, 東端) ---
+GRID_REGIONS = {
+    "明石〜鳴門": (34.15, 34.70, 134.55, 135.10),
+    "播磨灘": (34.25, 34.75, 134.20, 134.85),
+    "備讃瀬戸": (34.25, 34.55, 133.60, 134.30),
+}
+
+# --- 季節のベイト (予報を出す前の画面で使う) ---
+def get_seasonal_bait(month):
+    if month in [12, 1, 2]:
+        return "海苔(ノリ)・底生", "黒・緑・濃い茶"
+    elif month in [3, 4, 5]:
+        return "イカナゴ", "ミドキン・緑・オレ金"
+    elif month in [6, 7]:
+        return "イカ・タコ", "グロー・ゼブラ・金"
+    elif month in [8, 9, 10, 11]:
+        return "イワシ・エビ", "オレンジ・赤・金"
+    else:
+        return "混合", "赤オレ"
@@ -0,0 +1,165 @@
+import datetime
+import logging
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- 天文計算 (日の出・月齢をネットワーク無しで求める) ---
+# 日の出は NOAA の太陽位置式, 新月は Meeus の近似式 (誤差は数分程度)
+TABLE_START = datetime.date(2000, 1, 1)
+TABLE_END = datetime.date(2101, 1, 1)
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "matsuri", "astronomy-2000-2100.npy")
+JST = 9.0
+SYNODIC_MONTH = 29.530588861
+# 表の列: 正午(日本時間)の月齢, 太陽の赤緯 (度), 均時差 (分)
+MOON_AGE, DECLINATION, EQ_TIME = range(3)
+
+
+def _ordinals(start_date, n_days):
+    return start_date.toordinal() + np.arange(n_days)
+
+# 日付 (proleptic グレゴリオ暦の序数) の 0時 UT のユリウス日
+def julian_day(ordinals):
+    return np.asarray(ordinals, dtype=float) + 1721424.5
+
+# k 番目の新月 (2000年1月6日が k=0) のユリウス日
+def new_moon(k):
+    k = np.asarray(k, dtype=float)
+    t = k / 1236.85
+    jde = 2451550.09766 + SYNODIC_MONTH * k + 0.00015437 * t**2 - 0.00000015 * t**3 + 0.00000000073 * t**4
+    e = 1 - 0.002516 * t - 0.0000074 * t**2
+    m = np.radians(2.5534 + 29.1053567 * k - 0.0000014 * t**2 - 0.00000011 * t**3)
+    mp = np.radians(201.5643 + 385.81693528 * k + 0.0107582 * t**2 + 0.00001238 * t**3 - 0.000000058 * t**4)
+    f = np.radians(160.7108 + 390.67050284 * k - 0.0016118 * t**2 - 0.00000227 * t**3 + 0.000000011 * t**4)
+    om = np.radians(124.7746 - 1.56375588 * k + 0.0020672 * t**2 + 0.00000215 * t**3)
+    jde += (
+        -0.4072 * np.sin(mp) + 0.17241 * e * np.sin(m) + 0.01608 * np.sin(2 * mp) + 0.01039 * np.sin(2 * f)
+        + 0.00739 * e * np.sin(mp - m) - 0.00514 * e * np.sin(mp + m) + 0.00208 * e**2 * np.sin(2 * m)
+        - 0.00111 * np.sin(mp - 2 * f) - 0.00057 * np.sin(mp + 2 * f) + 0.00056 * e * np.sin(2 * mp + m)
+        - 0.00042 * np.sin(3 * mp) + 0.00042 * e * np.sin(m + 2 * f) + 0.00038 * e * np.sin(m - 2 * f)
+        - 0.00024 * e * np.sin(2 * mp - m) - 0.00017 * np.sin(om)
+    )
+    # 力学時 → 世界時 (ΔT は約70秒で固定)
+    return jde - 70.0 / 86400
+
+# 直前の新月からの経過日数
+def moon_age_at(jd):
+    jd = np.asarray(jd, dtype=float)
+    k = np.floor((jd - 2451550.09766) / SYNODIC_MONTH)
+    # 補正項は1日未満なので前後1回分を見れば足りる
+    cands = new_moon(k[..., None] + np.array([-1, 0, 1]))
+    age = jd[..., None] - cands
+    return np.where(age >= 0, age, np.inf).min(axis=-1)
+
+# 太陽の赤緯 (度) と均時差 (分)
+def solar_terms(jd):
+    jc = (np.asarray(jd, dtype=float) - 2451545.0) / 36525
+    l0 = np.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360)
+    m = np.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+    ecc = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    center = (
+        np.sin(m) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+        + np.sin(2 * m) * (0.019993 - 0.000101 * jc) + np.sin(3 * m) * 0.000289
+    )
+    omega = np.radians(125.04 - 1934.136 * jc)
+    app_long = np.radians(np.degrees(l0) + center - 0.00569 - 0.00478 * np.sin(omega))
+    obliq = np.radians(
+        23 + (26 + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60) / 60 + 0.00256 * np.cos(omega)
+    )
+    decl = np.arcsin(np.sin(obliq) * np.sin(app_long))
+    y = np.tan(obliq / 2) ** 2
+    eq_time = 4 * np.degrees(
+        y * np.sin(2 * l0) - 2 * ecc * np.sin(m) + 4 * ecc * y * np.sin(m) * np.cos(2 * l0)
+        - 0.5 * y**2 * np.sin(4 * l0) - 1.25 * ecc**2 * np.sin(2 * m)
+    )
+    return np.degrees(decl), eq_time
+
+# 日付ごとの表の行 (正午 JST 時点で計算する)
+def compute_rows(ordinals):
+    jd = julian_day(ordinals) + (12 - JST) / 24
+    decl, eq_time = solar_terms(jd)
+    return np.stack([moon_age_at(jd), decl, eq_time], axis=-1).astype(np.float32)
+
+# 日の出の時刻 (その日の0時からの分, tz 時間帯)
+def sunrise_minutes(lat, lon, rows, tz=JST):
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    if lat.ndim:
+        lat, lon = lat[..., None], lon[..., None]
+    lat = np.radians(lat)
+    decl = np.radians(rows[..., DECLINATION].astype(float))
+    cos_ha = np.cos(np.radians(90.833)) / (np.cos(lat) * np.cos(decl)) - np.tan(lat) * np.tan(decl)
+    # 白夜・極夜は南中時刻 / 真夜中に寄せる
+    ha = np.degrees(np.arccos(np.clip(cos_ha, -1.0, 1.0)))
+    return 720 - 4 * lon - rows[..., EQ_TIME] + tz * 60 - 4 * ha
+
+
+class AstroTable:
+    # 表は .npy で保存し, 読み込みは memory-map (複数プロセスで共有できる)
+    def __init__(self, path=DEFAULT_PATH, start=TABLE_START, end=TABLE_END):
+        self.path = path
+        self.start = start
+        self.n_days = (end - start).days
+        self.rows = self._load()
+
+    def _load(self):
+        if self.path:
+            try:
+                rows = np.load(self.path, mmap_mode="r")
+                if rows.shape == (self.n_days, 3):
+                    return rows
+            except (OSError, ValueError):
+                pass
+        rows = compute_rows(_ordinals(self.start, self.n_days))
+        if self.path:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as fp:
+                    np.save(fp, rows)
+                os.replace(tmp, self.path)
+                return np.load(self.path, mmap_mode="r")
+            except OSError as e:
+                logger.warning("astronomy table not saved to %s: %s", self.path, e)
+        return rows
+
+    # start_date から n_days 日分の行. 表の範囲内ならコピーせずに返す
+    def lookup(self, start_date, n_days=1):
+        i = start_date.toordinal() - self.start.toordinal()
+        if 0 <= i and i + n_days <= self.n_days:
+            return self.rows[i:i + n_days]
+        return compute_rows(_ordinals(start_date, n_days))
+
+    def moon_ages(self, start_date, n_days=1):
+        return np.asarray(self.lookup(start_date, n_days)[:, MOON_AGE], dtype=float)
+
+    # 地点 (スカラーまたは配列) × 日付の日の出の「時」. 最後の軸が日付
+    def sunrise_hours(self, lat, lon, start_date, n_days=1, tz=JST):
+        minutes = sunrise_minutes(lat, lon, self.lookup(start_date, n_days), tz)
+        return (minutes // 60).astype(int)
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+# MATSURI_ASTRO_PATH で保存先を変えられる (空なら保存せずメモリ上に作る)
+def get_table():
+    global _table
+    with _table_lock:
+        if _table is None:
+            _table = AstroTable(os.environ.get("MATSURI_ASTRO_PATH", DEFAULT_PATH))
+    return _table
+
+def moon_age(date):
+    return float(get_table().moon_ages(date)[0])
+
+def sunrise_hour(lat, lon, date):
+    return int(get_table().sunrise_hours(lat, lon, date)[0])
+
+if __name__ == "__main__":
+    table = get_table()
+    print(f"{table.path}: {table.start} から {table.n_days} 日分")
@@ -0,0 +1,260 @@
+import argparse
+import calendar
+import csv
+import datetime
+import json
+import logging
+import os
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import bathymetry
+import openmeteo
+import series
+from areas import AREA_OPTIONS
+from forecast import score_days, hour_rows
+
+logger = logging.getLogger(__name__)
+
+# --- バックテスト (過去の時系列を予報ロジックに流して時間ごとのスコアを出す) ---
+# 保存は 1エリア1か月 = 1ファイルのカラムナ形式 (pyarrow があれば Parquet, 無ければ .npz)
+DEFAULT_ROOT = os.environ.get("MATSURI_ARCHIVE_DIR", os.path.join(tempfile.gettempdir(), "matsuri", "archive"))
+COLUMNS = ["sst", "cloud", "wind", "rain"]
+OUTPUT_FIELDS = [
+    "area", "date", "hour", "score", "slack", "tide", "temp", "tdiff", "cloud", "wind", "rain",
+    "moon_age", "sunrise_hour", "use_historical", "honmei", "osae", "speed", "hook",
+]
+
+
+def has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def month_range(start, end):
+    months = []
+    y, m = start.year, start.month
+    while (y, m) <= (end.year, end.month):
+        months.append((y, m))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return months
+
+def month_bounds(year, month):
+    return datetime.date(year, month, 1), datetime.date(year, month, calendar.monthrange(year, month)[1])
+
+def _shift_month(year, month, k):
+    n = year * 12 + month - 1 + k
+    return n // 12, n % 12 + 1
+
+
+class ArchiveStore:
+    # 各列は日本時間で月初0時から1時間刻みの float32. 欠測は NaN
+    def __init__(self, root=DEFAULT_ROOT, backend=None):
+        self.root = root
+        self.backend = backend or ("parquet" if has_pyarrow() else "npz")
+
+    def path(self, area, year, month):
+        return os.path.join(self.root, area, f"{year:04d}-{month:02d}.{self.backend}")
+
+    def has(self, area, year, month):
+        return os.path.exists(self.path(area, year, month))
+
+    def write(self, area, year, month, columns):
+        path = self.path(area, year, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        arrays = {name: np.asarray(columns[name], dtype=np.float32) for name in COLUMNS}
+        if self.backend == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.table(arrays), tmp)
+        else:
+            with open(tmp, "wb") as fp:
+                np.savez(fp, **arrays)
+        os.replace(tmp, path)
+
+    def read(self, area, year, month, columns=COLUMNS):
+        path = self.path(area, year, month)
+        if not os.path.exists(path):
+            return None
+        if self.backend == "parquet":
+            import pyarrow.parquet as pq
+            table = pq.read_table(path, columns=list(columns))
+            return {name: table.column(name).to_numpy().astype(np.float32) for name in columns}
+        with np.load(path) as z:
+            return {name: z[name] for name in columns}
+
+
+# --- 取り込み (Open-Meteo の過去データを月単位で保存する) ---
+# 1か月ごとに全エリアを marine / archive 各1リクエストで取る. 取得に失敗した月は書かずに飛ばす
+def ingest(store, areas, start, end, overwrite=False):
+    names = list(areas)
+    lats = [areas[a]["lat"] for a in names]
+    lons = [areas[a]["lon"] for a in names]
+    done = []
+    for year, month in month_range(start, end):
+        if not overwrite and all(store.has(a, year, month) for a in names):
+            continue
+        first, last = month_bounds(year, month)
+        n = ((last - first).days + 1) * 24
+        try:
+            marine = openmeteo.fetch_json(openmeteo.marine_url(first, last, lats, lons))
+            weather = openmeteo.fetch_json(openmeteo.archive_url(first, last, lats, lons))
+            pairs = [
+                (series.from_openmeteo(sd), series.from_openmeteo(wd))
+                for sd, wd in zip(openmeteo.split_locations(marine, len(names)), openmeteo.split_locations(weather, len(names)))
+            ]
+        except (openmeteo.FetchError, ValueError) as e:
+            logger.warning("ingest skipped %04d-%02d: %s", year, month, e)
+            continue
+        # 保存は月初0時 (日本時間) から. 水温 (GMT) も時刻で揃えて切り出す
+        start = series.local_midnight(first)
+        for name, (sd, wd) in zip(names, pairs):
+            store.write(name, year, month, {
+                "sst": sd.window("sea_surface_temperature", start, n),
+                "cloud": wd.window("cloud_cover", start, n),
+                "wind": wd.window("wind_speed_10m", start, n),
+                "rain": wd.window("rain", start, n),
+            })
+        done.append((year, month))
+        logger.info("ingested %04d-%02d", year, month)
+    return done
+
+
+# --- スコア計算 (1エリア1か月を1タスクとしてプロセスプールに流す) ---
+# 保存した列から (sd, wd) の HourlySeries を組み立てる
+# 水温は前日比・前の時刻を見るので前後の月の24時間も付ける (無い月は NaN). 日の出は天文計算で補う
+def load_window(store, area, year, month):
+    cur = store.read(area, year, month)
+    if cur is None:
+        return None
+    prev = store.read(area, *_shift_month(year, month, -1), columns=["sst"])
+    nxt = store.read(area, *_shift_month(year, month, 1), columns=["sst"])
+    pad = np.full(24, np.nan, dtype=np.float32)
+    head = prev["sst"][-24:] if prev is not None else pad
+    tail = nxt["sst"][:24] if nxt is not None else pad
+    start = series.local_midnight(month_bounds(year, month)[0])
+    sd = series.HourlySeries(start - 24 * series.HOUR, {"sea_surface_temperature": np.concatenate([head, cur["sst"], tail])})
+    wd = series.HourlySeries(start, {"cloud_cover": cur["cloud"], "wind_speed_10m": cur["wind"], "rain": cur["rain"]})
+    return sd, wd
+
+def score_month(task):
+    root, backend, area, loc, year, month, date_from, date_to = task
+    out = {name: [] for name in OUTPUT_FIELDS}
+    window = load_window(ArchiveStore(root, backend), area, year, month)
+    if window is None:
+        return out
+    first, last = month_bounds(year, month)
+    days = score_days(*window, first, (last - first).days + 1, lat=loc["lat"], lon=loc["lon"], depth=loc["depth"])
+    for day in days:
+        if not date_from <= day["date"] <= date_to:
+            continue
+        for row in hour_rows(day, loc["depth"]):
+            for name in ("hour", "score", "slack", "tide", "temp", "tdiff", "cloud", "wind", "rain", "honmei", "osae", "speed", "hook"):
+                out[name].append(row[name])
+            out["area"].append(area)
+            out["date"].append(day["date"].isoformat())
+            out["moon_age"].append(day["moon_age"])
+            out["sunrise_hour"].append(day["sun_h"])
+            out["use_historical"].append(day["use_historical"])
+    return out
+
+# 月ごとの結果 (列の dict) を順番に返す. 同時に抱えるタスクは window 件までに抑える
+def run_backtest(store, areas, start, end, workers=None, window=None):
+    areas = bathymetry.with_depths(areas)
+    tasks = [
+        (store.root, store.backend, area, loc, year, month, start, end)
+        for area, loc in areas.items() for year, month in month_range(start, end)
+    ]
+    if workers == 1:
+        yield from map(score_month, tasks)
+        return
+    window = window or 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        pending = deque()
+        for task in tasks:
+            pending.append(ex.submit(score_month, task))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# --- 出力 (1か月分ずつ書き出す) ---
+def _rows(chunk):
+    return zip(*(chunk[name] for name in OUTPUT_FIELDS))
+
+def write_csv(chunks, fp):
+    writer = csv.writer(fp)
+    writer.writerow(OUTPUT_FIELDS)
+    for chunk in chunks:
+        writer.writerows(_rows(chunk))
+
+def write_jsonl(chunks, fp):
+    for chunk in chunks:
+        for row in _rows(chunk):
+            fp.write(json.dumps(dict(zip(OUTPUT_FIELDS, row)), ensure_ascii=False) + "\n")
+
+def write_parquet(chunks, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    try:
+        for chunk in chunks:
+            if not chunk["area"]:
+                continue
+            table = pa.table({name: chunk[name] for name in OUTPUT_FIELDS})
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="魔釣 バックテスト")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("ingest", "過去データを取り込む"), ("run", "時間ごとのスコアを出力する")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--start", type=datetime.date.fromisoformat, required=True, help="開始日 YYYY-MM-DD")
+        p.add_argument("--end", type=datetime.date.fromisoformat, required=True, help="終了日 YYYY-MM-DD")
+        p.add_argument("--area", action="append", choices=list(AREA_OPTIONS), help="対象エリア (複数可, 省略時は全エリア)")
+        p.add_argument("--root", default=DEFAULT_ROOT, help="保存先ディレクトリ")
+        p.add_argument("--backend", choices=["parquet", "npz"], help="保存形式 (省略時は pyarrow があれば parquet)")
+    ingest_p = sub.choices["ingest"]
+    ingest_p.add_argument("--overwrite", action="store_true", help="保存済みの月も取り直す")
+    run_p = sub.choices["run"]
+    run_p.add_argument("--format", choices=["csv", "jsonl", "parquet"], default="csv")
+    run_p.add_argument("--output", "-o", help="出力先 (parquet では必須, それ以外は省略時に標準出力)")
+    run_p.add_argument("--workers", type=int, help="プロセス数")
+    args = parser.parse_args(argv)
+
+    store = ArchiveStore(args.root, args.backend)
+    areas = {name: AREA_OPTIONS[name] for name in (args.area or AREA_OPTIONS)}
+    if args.command == "ingest":
+        done = ingest(store, areas, args.start, args.end, args.overwrite)
+        print(f"{len(done)} months ingested into {store.root} ({store.backend})")
+        return
+
+    chunks = run_backtest(store, areas, args.start, args.end, args.workers)
+    if args.format == "parquet":
+        if not args.output:
+            parser.error("--format parquet には --output が必要です")
+        write_parquet(chunks, args.output)
+        return
+    write = write_jsonl if args.format == "jsonl" else write_csv
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as fp:
+            write(chunks, fp)
+    else:
+        write(chunks, sys.stdout)
+
+if __name__ == "__main__":
+    main()
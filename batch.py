@@ -0,0 +1,116 @@
+import argparse
+import csv
+import datetime
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import bathymetry
+import metrics
+import openmeteo
+import shards
+from areas import AREA_OPTIONS
+from forecast import score_days, day_report
+
+# --- ヘッドレス一括予報 (Streamlit 不要) ---
+CSV_FIELDS = [
+    "area", "date", "hour", "score", "slack", "tide", "temp", "tdiff", "cloud", "wind", "rain",
+    "weather", "wind_label", "honmei", "osae", "speed", "hook", "worm", "notes",
+    "moon_age", "tide_name", "sinker", "use_historical",
+]
+
+
+# 日付を予報APIの上限日数以内の連続区間 (開始日, 日数) にまとめる
+def date_runs(dates, max_days=openmeteo.MAX_FORECAST_DAYS):
+    runs = []
+    for d in sorted(set(dates)):
+        if runs and d == runs[-1][0] + datetime.timedelta(days=runs[-1][1]) and runs[-1][1] < max_days:
+            runs[-1][1] += 1
+        else:
+            runs.append([d, 1])
+    return [tuple(r) for r in runs]
+
+def _score_task(task):
+    area, loc, start_date, n_days, sd, wd, wanted = task
+    days = score_days(sd, wd, start_date, n_days, lat=loc["lat"], lon=loc["lon"], depth=loc["depth"])
+    return [day_report(area, loc["depth"], day) for day in days if day["date"] in wanted]
+
+# (エリア, 日付) の組を予報する. 取得は区間ごとに全エリア1回ずつ, 計算はプロセスプールに分散
+def run_batch(pairs, areas=AREA_OPTIONS, workers=None):
+    wanted = {}
+    for area, date in pairs:
+        if area not in areas:
+            raise KeyError(f"unknown area: {area}")
+        wanted.setdefault(area, set()).add(date)
+    # 海底地形データがあればエリアの水深を差し替える (子プロセスには解決済みの値を渡す)
+    areas = bathymetry.with_depths(areas)
+
+    tasks = []
+    for start_date, n_days in date_runs(d for dates in wanted.values() for d in dates):
+        run_dates = {start_date + datetime.timedelta(days=k) for k in range(n_days)}
+        with metrics.timer("fetch"):
+            data = shards.fetch_areas(start_date, n_days, areas)
+        for area, dates in wanted.items():
+            if dates & run_dates:
+                sd, wd = data[area]
+                tasks.append((area, areas[area], start_date, n_days, sd, wd, dates & run_dates))
+
+    with metrics.timer("score"):
+        if workers == 1 or len(tasks) <= 1:
+            results = list(map(_score_task, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                results = list(ex.map(_score_task, tasks))
+
+    order = {name: i for i, name in enumerate(areas)}
+    reports = [r for chunk in results for r in chunk]
+    reports.sort(key=lambda r: (order[r["area"]], r["date"]))
+    return reports
+
+def write_json(reports, fp):
+    json.dump(reports, fp, ensure_ascii=False, indent=2)
+    fp.write("\n")
+
+def write_csv(reports, fp):
+    writer = csv.DictWriter(fp, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for r in reports:
+        for row in r["hours"]:
+            writer.writerow({
+                **row,
+                "notes": " ".join(row["notes"]),
+                "area": r["area"], "date": r["date"], "moon_age": r["moon_age"],
+                "tide_name": r["tide_name"], "sinker": r["sinker"], "use_historical": r["use_historical"],
+            })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="魔釣 一括予報 (JSON / CSV 出力)")
+    parser.add_argument("--area", action="append", choices=list(AREA_OPTIONS), help="対象エリア (複数可, 省略時は全エリア)")
+    parser.add_argument("--date", action="append", type=datetime.date.fromisoformat, help="対象日 YYYY-MM-DD (複数可)")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, help="開始日 (省略時は明日)")
+    parser.add_argument("--days", type=int, default=1, help="開始日からの日数")
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("--output", "-o", help="出力先 (省略時は標準出力)")
+    parser.add_argument("--workers", type=int, help="プロセス数")
+    parser.add_argument("--metrics", help="計測結果を Prometheus テキスト形式で書き出すファイル")
+    args = parser.parse_args(argv)
+
+    dates = list(args.date or [])
+    if not dates or args.start:
+        start = args.start or datetime.date.today() + datetime.timedelta(days=1)
+        dates += [start + datetime.timedelta(days=k) for k in range(args.days)]
+    pairs = [(area, d) for area in (args.area or AREA_OPTIONS) for d in dates]
+
+    reports = run_batch(pairs, workers=args.workers)
+    write = write_csv if args.format == "csv" else write_json
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as fp:
+            write(reports, fp)
+    else:
+        write(reports, sys.stdout)
+    if args.metrics:
+        metrics.write_textfile(args.metrics)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- 海底地形 (水深の格子を memory-map して地点ごとに引く) ---
+# 水深は m (正の値) の int16. 陸地・データ無しは NODATA
+# 格子の範囲・間隔は同名の .json に置く (south / west は南西端のセル中心)
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "matsuri", "bathymetry.npy")
+NODATA = -32768
+# エリアの水深は基準地点の周り AREA_RADIUS 度の中央値 (ピンが岸寄りでも代表値になるように)
+AREA_RADIUS = 0.02
+
+
+def _meta_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+class Bathymetry:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        with open(_meta_path(path), encoding="utf-8") as fp:
+            meta = json.load(fp)
+        self.south = meta["south"]
+        self.west = meta["west"]
+        self.step = meta["step"]
+        self.depths = np.load(path, mmap_mode="r")
+
+    @property
+    def shape(self):
+        return self.depths.shape
+
+    def _index(self, lat, lon):
+        i = np.rint((np.asarray(lat, dtype=float) - self.south) / self.step).astype(np.intp)
+        j = np.rint((np.asarray(lon, dtype=float) - self.west) / self.step).astype(np.intp)
+        ok = (i >= 0) & (i < self.shape[0]) & (j >= 0) & (j < self.shape[1])
+        return np.where(ok, i, 0), np.where(ok, j, 0), ok
+
+    # 最寄りのセルの水深 (スカラーまたは配列). 陸地・範囲外は NaN
+    # 引いたセルのページだけが読み込まれるので, 格子全体はメモリに載せない
+    def depth_at(self, lat, lon):
+        i, j, ok = self._index(lat, lon)
+        raw = self.depths[i, j]
+        return np.where(ok & (raw != NODATA), raw, np.nan)
+
+    # 地点の周り radius 度の海上セルの水深の中央値. 海上セルが無ければ NaN
+    def median_depth(self, lat, lon, radius=AREA_RADIUS):
+        n = int(round(radius / self.step))
+        i, j, ok = self._index(lat, lon)
+        if not ok:
+            return np.nan
+        i, j = int(i), int(j)
+        window = np.asarray(self.depths[max(i - n, 0):i + n + 1, max(j - n, 0):j + n + 1])
+        sea = window[window != NODATA]
+        return float(np.median(sea)) if sea.size else np.nan
+
+
+_bathymetry = None
+_bathymetry_lock = threading.Lock()
+
+
+# MATSURI_BATHYMETRY_PATH で場所を変えられる. ファイルが無ければ None (エリアの想定水深を使う)
+def get_bathymetry():
+    global _bathymetry
+    with _bathymetry_lock:
+        if _bathymetry is None:
+            path = os.environ.get("MATSURI_BATHYMETRY_PATH", DEFAULT_PATH)
+            try:
+                _bathymetry = Bathymetry(path) if path else False
+            except (OSError, ValueError, KeyError) as e:
+                logger.info("bathymetry not available (%s): %s", path, e)
+                _bathymetry = False
+    return _bathymetry or None
+
+# 地点ごとの水深 (m, 整数). 格子が無い・陸地と判定された地点は fallback
+def depth_for(lat, lon, fallback):
+    bathy = get_bathymetry()
+    depth = bathy.depth_at(lat, lon) if bathy is not None else np.full(np.shape(lat), np.nan)
+    return np.rint(np.where(np.isnan(depth), fallback, depth)).astype(int)
+
+# エリアの水深. 格子があれば基準地点周りの中央値, 無ければ areas.py の想定水深
+def area_depth(loc):
+    bathy = get_bathymetry()
+    depth = bathy.median_depth(loc["lat"], loc["lon"]) if bathy is not None else np.nan
+    return loc["depth"] if np.isnan(depth) else int(round(depth))
+
+# エリアの水深を格子から取れるか (取れなければ area_depth は想定水深を返す)
+def has_area_depth(loc):
+    bathy = get_bathymetry()
+    return bathy is not None and not np.isnan(bathy.median_depth(loc["lat"], loc["lon"]))
+
+def with_depths(areas):
+    return {name: {**loc, "depth": area_depth(loc)} for name, loc in areas.items()}
+
+
+# --- 取り込み (GEBCO などの Esri ASCII グリッドから作る) ---
+# 標高 (海は負) のグリッドを1行ずつ読み, 水深の .npy (memory-map 書き込み) と .json にする
+def import_ascii_grid(src, path=DEFAULT_PATH):
+    with open(src, encoding="ascii") as fp:
+        # ヘッダは ncols / nrows / xll* / yll* / cellsize と省略可能な NODATA_value
+        header = {}
+        line = fp.readline().split()
+        while line and line[0][0].isalpha():
+            header[line[0].lower()] = float(line[1])
+            line = fp.readline().split()
+        nrows, ncols, step = int(header["nrows"]), int(header["ncols"]), header["cellsize"]
+        # corner 指定ならセル中心に直す
+        west = header["xllcenter"] if "xllcenter" in header else header["xllcorner"] + step / 2
+        south = header["yllcenter"] if "yllcenter" in header else header["yllcorner"] + step / 2
+        nodata = header.get("nodata_value")
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.int16, shape=(nrows, ncols))
+        # ファイルは北の行から並んでいるので, 南を 0 行目にして書く
+        for r in range(nrows):
+            elev = np.array(line if r == 0 else fp.readline().split(), dtype=float)
+            if elev.size != ncols:
+                raise ValueError(f"row {r}: expected {ncols} values, got {elev.size}")
+            sea = elev < 0
+            if nodata is not None:
+                sea &= elev != nodata
+            out[nrows - 1 - r] = np.where(sea, np.clip(np.rint(-elev), 0, np.iinfo(np.int16).max), NODATA)
+        out.flush()
+        del out
+
+    meta_tmp = f"{_meta_path(path)}.{os.getpid()}.tmp"
+    with open(meta_tmp, "w", encoding="utf-8") as fp:
+        json.dump({"south": south, "west": west, "step": step, "source": os.path.basename(src)}, fp)
+    os.replace(tmp, path)
+    os.replace(meta_tmp, _meta_path(path))
+    return Bathymetry(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="魔釣 海底地形 (水深格子の作成と参照)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="Esri ASCII グリッド (標高) から水深格子を作る")
+    imp.add_argument("source")
+    imp.add_argument("--output", "-o", default=os.environ.get("MATSURI_BATHYMETRY_PATH", DEFAULT_PATH))
+    look = sub.add_parser("lookup", help="地点の水深を表示する")
+    look.add_argument("lat", type=float)
+    look.add_argument("lon", type=float)
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        bathy = import_ascii_grid(args.source, args.output)
+        print(f"{bathy.path}: {bathy.shape[0]}x{bathy.shape[1]} (間隔 {bathy.step}°)")
+        return
+    bathy = get_bathymetry()
+    if bathy is None:
+        parser.error("水深格子がありません (bathymetry.py import で作成してください)")
+    depth = float(bathy.depth_at(args.lat, args.lon))
+    print("陸地またはデータ範囲外" if np.isnan(depth) else f"{depth:.0f}m")
+
+if __name__ == "__main__":
+    main()
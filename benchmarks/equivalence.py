@@ -0,0 +1,415 @@
+import argparse
+import datetime
+import itertools
+import math
+import random
+import sys
+
+import numpy as np
+
+from forecast import HISTORICAL_TEMPS, hour_rows, score_days
+from scoring import STANDARD_SINKERS, TIDE_CLASSES, sinker_weights, suggest_strategies
+
+# --- 等価性の確認 (一括計算が元の1時間ずつのループと同じ結果を返すか) ---
+# 元の main() のループと suggest_strategy / get_sinker_weight をそのまま写しておき, ランダムな入力で突き合わせる
+# 決定表 (suggest_strategies / sinker_weights) は区分の境界をすべて含む格子で総当たりする
+# 月齢と日の出は計算方法を変えたので (天文計算), 一括計算側の値を元のループにも渡して比べる
+START = datetime.date(2020, 1, 1)
+# 潮位は np.cos と math.cos の差 (最下位桁) だけ許す
+TIDE_TOLERANCE = 1e-12
+# 決定表の格子. 水温は各境界ちょうどとその少し下, スコアは 0〜100 の全部, 水深は境界の両側
+GRID_TEMPS = [5.0, 9.9, 10.0, 12.0, 12.1, 12.9, 13.0, 17.9, 18.0, 21.9, 22.0, 30.0]
+GRID_SCORES = range(101)
+GRID_DEPTHS = [30, 30.5, 59.5, 60]
+# 時刻と日の出: 日の出前・ちょうど・日の出後2時間以内・その境目・それ以降 (偶数と奇数の時刻)
+GRID_SUN = [(h, h + d) for h in (10, 11) for d in (2, 0, -1, -2, -3)]
+GRID_RAINS = [0.49, 0.5]
+GRID_TDIFFS = [-0.1, -0.09]
+GRID_CLOUDS = [70, 71]
+
+
+# --- 元の実装 (baseline の app.py から) ---
+def ref_estimate_tide(moon_age, hour):
+    base_high = 8.5; delay = 0.8
+    high_tide = (base_high + (moon_age % 15) * delay) % 12
+    diff = abs(hour - high_tide)
+    if diff > 6: diff = 12 - diff
+    level = math.cos(diff * (math.pi / 6))
+    is_slack = (diff < 1.0 or abs(diff - 6.0) < 1.0)
+    return level, is_slack
+
+def ref_get_sinker_weight(moon_age, depth):
+    STANDARD_SINKERS = [30, 45, 60, 80, 100, 120, 150, 180, 200]
+    age_norm = moon_age % 15
+    if age_norm <= 2 or age_norm >= 13:
+        tide_name = "大潮(激)"
+        mult_min, mult_max = 2.0, 2.5
+    elif 3 <= age_norm <= 5 or 10 <= age_norm <= 12:
+        tide_name = "中潮(速)"
+        mult_min, mult_max = 1.5, 2.0
+    else:
+        tide_name = "小潮(緩)"
+        mult_min, mult_max = 1.0, 1.5
+
+    raw_min = depth * mult_min
+    raw_max = depth * mult_max
+
+    def get_closest_sinker(val):
+        return min(STANDARD_SINKERS, key=lambda x: abs(x - val))
+
+    w_min = get_closest_sinker(raw_min)
+    w_max = get_closest_sinker(raw_max)
+    if w_min > w_max: w_min = w_max
+
+    if w_min == w_max:
+        return tide_name, f"{w_min}g"
+    else:
+        return tide_name, f"{w_min}g〜{w_max}g"
+
+
+def ref_suggest_strategy(h, sun_h, sc, t_diff, month, temp, cloud_cover, rain, depth):
+    c1 = "赤オレ" if h % 2 == 0 else "オレンジ"
+    s1 = "極細"
+    speed = "普通"
+    hook = "M"
+
+    is_nori_season = month in [12, 1, 2, 3, 4]
+
+    # --- ネクタイ選定 ---
+    if rain >= 0.5:
+        c1 = "チャート" if h % 2 == 0 else "ソリッドレッド"
+    elif h <= sun_h:
+        c1 = "チャート" if h % 2 == 0 else "赤ゼブラ"
+    elif t_diff <= -0.1:
+        c1 = "コーラ" if h % 2 == 0 else "赤黒"
+    elif month in [3, 4, 5]:
+        c1 = "ミドキン" if h % 2 == 0 else "グリーン"
+    elif is_nori_season and (temp < 13.0 or sc < 45):
+        c1 = "黒/海苔" if h % 2 == 0 else "コーラ"
+    elif cloud_cover > 70:
+        c1 = "チャート" if h % 2 == 0 else "赤ゼブラ"
+    elif depth >= 60:
+        c1 = "オレンジゼブラ" if h % 2 == 0 else "赤黒"
+    elif depth <= 30:
+        c1 = "オレ金" if h % 2 == 0 else "グリーン"
+    elif h <= sun_h + 2:
+        c1 = "オレ金" if h % 2 == 0 else "マジョーラゼブラ"
+
+    # --- 形状選定 ---
+    if rain >= 0.5:
+        s1 = "ワイドカーリー"
+    elif month in [6, 7, 8] and sc >= 40:
+        s1 = "ロングカーリー"
+    elif depth >= 60:
+        s1 = "強波動" if sc >= 40 else "カーリー"
+    elif depth <= 30:
+        s1 = "ショート" if sc >= 40 else "極細"
+    elif sc >= 50:
+        s1 = "強波動"
+    elif sc >= 30:
+        s1 = "ショート"
+    elif sc >= 20:
+        s1 = "ストレート"
+    else:
+        s1 = "極細"
+
+    # --- 巻き速度 ---
+    if temp >= 18.0 and sc >= 40:
+        speed = "早巻"
+    elif temp <= 12.0 or sc <= 20:
+        speed = "激遅"
+    elif sc >= 30:
+        speed = "普通"
+    else:
+        speed = "遅め"
+
+    # --- フックサイズ ---
+    if month in [12, 1, 2] and (temp < 10.0 or sc < 30):
+        hook = "3S"
+    elif month in [3, 4]:
+        hook = "SS"
+    elif speed == "激遅" or sc < 40:
+        hook = "S"
+    elif temp >= 22.0 and sc >= 50:
+        hook = "L"
+    else:
+        hook = "M"
+
+    # --- ワーム判定 ---
+    worm_option = ""
+    if sc <= 10:
+        worm_option = "+ワーム"
+
+    # --- 抑えパターン ---
+    c2 = "グリーン"; s2 = "ショート"
+    if c1 == "チャート": c2 = "オレ金"
+    elif c1 == "ソリッドレッド": c2 = "チャート"
+    elif c1 == "赤ゼブラ": c2 = "オレンジ"
+    elif c1 == "ミドキン": c2 = "オレ金"
+    elif c1 == "オレ金": c2 = "ピンク"
+    elif c1 == "マジョーラゼブラ": c2 = "ピンク"
+    elif c1 == "ピンク": c2 = "赤オレ"
+    elif c1 == "コーラ": c2 = "赤黒"
+    elif c1 == "赤黒": c2 = "コーラ"
+    elif c1 == "黒/海苔": c2 = "コーラ"
+    elif c1 == "赤オレ": c2 = "マジョーラゼブラ"
+    elif c1 == "オレンジ": c2 = "赤オレ"
+    elif c1 == "オレンジゼブラ": c2 = "赤黒"
+    elif c1 == "グリーン": c2 = "ミドキン"
+
+    if s1 == "ロングカーリー": s2 = "ショート"
+    elif s1 == "ワイドカーリー": s2 = "カーリー"
+    elif s1 == "強波動": s2 = "ショート"
+    elif s1 == "ショート": s2 = "極細"
+    elif s1 == "ストレート": s2 = "ショート"
+    else: s2 = "カーリー"
+
+    return f"{c1}×{s1}", f"{c2}×{s2}", speed, hook, worm_option
+
+# main() の「魔釣予報を開始する」の中身 (表示を除く). 1日分の (日ごとの値, 時間ごとの値) を返す
+def ref_day(sd, wd, target_date, depth, mage, sun_h):
+
+    r_temps = sd["hourly"]["sea_surface_temperature"] if sd else []
+    r_clouds = wd["hourly"]["cloud_cover"] if (wd and "cloud_cover" in wd["hourly"]) else []
+    r_winds = wd["hourly"]["wind_speed_10m"] if (wd and "wind_speed_10m" in wd["hourly"]) else []
+    r_rains = wd["hourly"]["rain"] if (wd and "rain" in wd["hourly"]) else []
+
+    OFF = 15
+    use_historical = False
+    valid_data_list = [t for t in r_temps if t is not None and t > 0]
+
+    day_trend_score = 0
+    day_trend_label = ""
+
+    if not valid_data_list:
+        use_historical = True
+        avg_temp = HISTORICAL_TEMPS.get(target_date.month, 15.0)
+        r_temps = [avg_temp] * 48
+    else:
+        if len(r_temps) >= 48:
+            temps_yesterday = [t for t in r_temps[0:24] if t is not None]
+            temps_today = [t for t in r_temps[24:48] if t is not None]
+
+            if temps_yesterday and temps_today:
+                avg_yesterday = sum(temps_yesterday) / len(temps_yesterday)
+                avg_today = sum(temps_today) / len(temps_today)
+                diff_day = avg_today - avg_yesterday
+
+                if diff_day <= -0.5:
+                    day_trend_score = -20
+                    day_trend_label = f"⚠️前日比{diff_day:+.1f}℃"
+                elif diff_day >= 0.5:
+                    day_trend_score = 10
+                    day_trend_label = f"前日比{diff_day:+.1f}℃"
+
+    day_temps = []
+    for h in range(5, 16):
+        idx = OFF + h
+        if idx < len(r_temps) and r_temps[idx] is not None:
+            day_temps.append(r_temps[idx])
+
+    min_t = min(day_temps) if day_temps else 0
+    max_t = max(day_temps) if day_temps else 0
+
+    rows = []
+    tll = []
+    for h in range(5, 16):
+        idx = OFF + h
+        ct = r_temps[idx] if (idx < len(r_temps) and r_temps[idx] is not None) else (day_temps[0] if day_temps else 15.0)
+        pt = ct
+        if idx > 0 and r_temps[idx-1] is not None:
+            pt = r_temps[idx-1]
+
+        tdiff = ct - pt
+        if use_historical: tdiff = 0
+
+        cloud = r_clouds[h] if (h < len(r_clouds) and r_clouds[h] is not None) else 0
+        wind = r_winds[h] if (h < len(r_winds) and r_winds[h] is not None) else 0
+        rain = r_rains[h] if (h < len(r_rains) and r_rains[h] is not None) else 0
+
+        tlev, slack = ref_estimate_tide(mage, h)
+
+        sc = 0
+        if h == sun_h: sc += 40
+        elif abs(h - sun_h) == 1: sc += 20
+        if slack: sc += 50
+        elif h>5 and abs(tlev - tll[-1]) > 0.3: sc += 30
+
+        if not use_historical:
+            if tdiff >= 0.1: sc += 20
+            elif tdiff <= -0.1: sc -= 20
+
+        sc += day_trend_score
+
+        w_icon = ""
+        if rain >= 0.5:
+            sc += 10; w_icon = "☔"
+        elif cloud >= 60:
+            sc += 10; w_icon = "☁️"
+        elif cloud <= 20:
+            sc -= 5; w_icon = "☀️"
+        else:
+            w_icon = "⛅"
+
+        wind_text = ""
+        if wind >= 10.0:
+            sc = 0; wind_text = "爆風"
+        elif wind >= 7.0:
+            sc -= 10; wind_text = "強風"
+        elif wind >= 5.0:
+            sc += 5; wind_text = "やや強"
+        elif wind >= 2.0:
+            sc += 20; wind_text = "最適"
+        else:
+            sc -= 20; wind_text = "静穏"
+
+        low_temp_alert = ""
+        if ct <= 10.0:
+            sc = int(sc * 0.2); low_temp_alert = "激渋"
+        elif ct <= 12.0:
+            sc = int(sc * 0.5); low_temp_alert = "低水温"
+
+        if sc < 0: sc = 0
+        if sc > 100: sc = 100
+
+        tie1, tie2, spd, hk, worm = ref_suggest_strategy(h, sun_h, sc, tdiff, target_date.month, ct, cloud, rain, depth)
+
+        notes = []
+        if slack: notes.append("★転流")
+        if low_temp_alert: notes.append(f"⚠️{low_temp_alert}")
+        if rain >= 0.5: notes.append("濁り")
+        if day_trend_label and not low_temp_alert: notes.append(day_trend_label)
+
+        tll.append(tlev)
+        rows.append({
+            "hour": h, "score": sc, "temp": ct, "tdiff": tdiff, "tide": tlev, "slack": slack,
+            "weather": w_icon, "wind_label": wind_text, "low_temp_alert": low_temp_alert, "notes": notes,
+            "honmei": tie1, "osae": tie2, "speed": spd, "hook": hk, "worm": worm,
+        })
+    day = {"sun_h": sun_h, "use_historical": use_historical, "day_trend_label": day_trend_label, "min_t": min_t, "max_t": max_t}
+    return day, rows
+
+
+# --- ランダムな入力 (Open-Meteo のレスポンスと同じ形) ---
+def _value(rng, lo, hi, p_none):
+    if rng.random() < p_none:
+        return None
+    return round(rng.uniform(lo, hi), rng.choice([0, 1, 2]))
+
+# 水温: 欠測の多い日・全欠測 (平年値)・0 (無効値)・前日分が途中で切れた応答を混ぜる
+def random_marine(rng, date):
+    if rng.random() < 0.1:
+        return None
+    p_none = rng.choice([0.0, 0.0, 0.1, 0.5, 1.0])
+    lo = rng.choice([6.0, 9.0, 11.5, 17.0, 21.0])
+    # 当日 15時 (日本時間) の1時間前までは入っていないと元のループは動かない
+    n = 48 if rng.random() < 0.8 else rng.randrange(31, 48)
+    temps = [_value(rng, lo, lo + 3, p_none) for _ in range(n)]
+    if rng.random() < 0.05:
+        temps = [0.0 if t is not None else None for t in temps]
+    t0 = datetime.datetime.combine(date - datetime.timedelta(days=1), datetime.time())
+    return {
+        "utc_offset_seconds": 0,
+        "hourly": {
+            "time": [(t0 + datetime.timedelta(hours=k)).strftime("%Y-%m-%dT%H:%M") for k in range(n)],
+            "sea_surface_temperature": temps,
+        },
+    }
+
+# 天気: 項目の欠けた応答も混ぜる
+def random_forecast(rng, date):
+    if rng.random() < 0.1:
+        return None
+    p_none = rng.choice([0.0, 0.0, 0.2])
+    hourly = {"time": [f"{date.isoformat()}T{k:02d}:00" for k in range(24)]}
+    for name, lo, hi in (("cloud_cover", 0, 100), ("wind_speed_10m", 0, 12), ("rain", 0, 2)):
+        if rng.random() < 0.95:
+            hourly[name] = [_value(rng, lo, hi, p_none) for _ in range(24)]
+    return {"utc_offset_seconds": 32400, "timezone": "Asia/Tokyo", "hourly": hourly}
+
+# 地点: 半分は瀬戸内, 半分は日の出 (日本時間) が 5〜15時の窓の端と外 (3〜17時頃) に来る経度
+def random_location(rng):
+    if rng.random() < 0.5:
+        return rng.uniform(33.5, 35.0), rng.uniform(133.0, 136.0)
+    return rng.uniform(-50.0, 50.0), rng.uniform(-30.0, 180.0)
+
+
+def _same(a, b, name):
+    if name == "tide":
+        return abs(a - b) <= TIDE_TOLERANCE
+    return a == b
+
+# 一括計算 (score_days → hour_rows) と元のループを cases 件突き合わせ, 食い違いを返す
+def check_engine(cases=500, seed=0):
+    rng = random.Random(seed)
+    mismatches = []
+    for case in range(cases):
+        date = START + datetime.timedelta(days=rng.randrange(3650))
+        depth = rng.choice([15, 20, 25, 30, 31, 45, 59, 60, 65, 80, rng.randrange(5, 120)])
+        sd, wd = random_marine(rng, date), random_forecast(rng, date)
+        lat, lon = random_location(rng)
+
+        day = score_days(sd, wd, date, lat=lat, lon=lon)[0]
+        rows = hour_rows(day, depth)
+        ref, ref_rows = ref_day(sd, wd, date, depth, day["moon_age"], day["sun_h"])
+
+        for key, value in ref.items():
+            if day[key] != value:
+                mismatches.append(f"case {case} {date} {key}: {day[key]!r} != {value!r}")
+        for row, ref_row in zip(rows, ref_rows):
+            for key, value in ref_row.items():
+                if not _same(row[key], value, key):
+                    mismatches.append(f"case {case} {date} {row['hour']}h {key}: {row[key]!r} != {value!r}")
+    return mismatches
+
+
+# 戦略の決定表を 月 (1〜12) × 水温 × スコア × 水深 × その他の分岐の格子で総当たりし, 食い違いを返す
+def check_strategy_table():
+    grid = [(h, sun_h, sc, t_diff, month, temp, cloud, rain, depth)
+            for (h, sun_h), rain, t_diff, cloud, month, temp, sc, depth in itertools.product(
+                GRID_SUN, GRID_RAINS, GRID_TDIFFS, GRID_CLOUDS, range(1, 13), GRID_TEMPS, GRID_SCORES, GRID_DEPTHS)]
+    got = suggest_strategies(*(np.array(c) for c in zip(*grid)))
+    mismatches = []
+    for i, args in enumerate(grid):
+        ref = ref_suggest_strategy(*args)
+        res = tuple(col[i] for col in got)
+        if res != ref:
+            mismatches.append(f"strategy {args}: {res!r} != {ref!r}")
+    return len(grid), mismatches
+
+# オモリ表を 月齢 (0〜59) × 水深 (0.25 刻みと, 倍率を掛けてちょうど標準オモリの中間になる水深) で総当たりする
+def check_sinker_table():
+    mids = [(a + b) / 2 for a, b in zip(STANDARD_SINKERS, STANDARD_SINKERS[1:])]
+    mults = sorted({m for c in TIDE_CLASSES for m in c[1:]})
+    depths = sorted({k / 4 for k in range(1, 1001)} | {mid / m for mid in mids for m in mults})
+    ages, depth = np.meshgrid(np.arange(60), np.array(depths), indexing="ij")
+    names, labels = sinker_weights(ages, depth)
+    mismatches = []
+    for i, j in np.ndindex(ages.shape):
+        ref = ref_get_sinker_weight(int(ages[i, j]), float(depth[i, j]))
+        if (names[i, j], labels[i, j]) != ref:
+            mismatches.append(f"sinker age={ages[i, j]} depth={depth[i, j]}: "
+                              f"{(names[i, j], labels[i, j])!r} != {ref!r}")
+    return ages.size, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="魔釣 一括計算と元の実装の等価性チェック")
+    parser.add_argument("--cases", type=int, default=2000, help="ランダムな入力の件数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for name, (cases, mismatches) in (
+        ("engine", (args.cases, check_engine(args.cases, args.seed))),
+        ("strategy table", check_strategy_table()),
+        ("sinker table", check_sinker_table()),
+    ):
+        for line in mismatches[:20]:
+            sys.stderr.write(f"MISMATCH {line}\n")
+        print(f"{name}: {cases} cases, {len(mismatches)} mismatches")
+        failed = failed or bool(mismatches)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import warnings
+
+import numpy as np
+
+import cache
+import openmeteo
+from areas import AREA_OPTIONS
+from benchmarks.stub_server import StubServer
+
+# --- 負荷試験 (同時に使う N 人を模擬して, 1レプリカで捌ける量を測る) ---
+# 各ユーザーはエリアと日付を選んで「予報を開始」を押すのを繰り返す. 対象 (target) は
+#   headless: 日付指定の予報をこのプロセス内で計算する (取得・計算・グラフ. Streamlit なし)
+#   api:      api.py を別プロセスで起動して HTTP で叩く (CPU/RSS はサーバープロセスを測る)
+#   app:      Streamlit の AppTest で1ユーザー1セッションを作り, ボタンを押してスクリプトを再実行する
+# 上流はローカルのスタブ (遅延・揺らぎ・失敗率を指定できる). 上流への呼び出し回数はスタブで数える
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_INTERVAL = 1.0
+
+
+# --- CPU / RSS (Linux は /proc から任意のプロセス, それ以外は自プロセスのみ) ---
+def proc_usage(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as fp:
+            fields = fp.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as fp:
+            pages = int(fp.read().split()[1])
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK"), pages * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        if pid != os.getpid():
+            return None, None
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        # /proc が無い環境は最大 RSS で代用する (macOS はバイト, それ以外は KB)
+        return usage.ru_utime + usage.ru_stime, usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+# interval 秒ごとに (経過秒, CPU%, RSS MB, 完了リクエスト数) を記録する. CPU% はコア数分まで超える
+class Sampler:
+    def __init__(self, pid, completed, interval=SAMPLE_INTERVAL):
+        self.pid = pid
+        self.completed = completed
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="load-sampler", daemon=True)
+
+    def _run(self):
+        started = time.perf_counter()
+        last_t, (last_cpu, _) = started, proc_usage(self.pid)
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            cpu, rss = proc_usage(self.pid)
+            if cpu is None:
+                continue
+            self.samples.append({
+                "t": round(now - started, 2),
+                "cpu_percent": round(100 * (cpu - last_cpu) / (now - last_t), 1),
+                "rss_mb": round(rss / 2 ** 20, 1),
+                "completed": self.completed(),
+            })
+            last_t, last_cpu = now, cpu
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+
+# --- 対象ごとの「1ユーザー」 (open() でセッションを作り, request(area, date) で1回押す) ---
+class HeadlessUser:
+    def __init__(self, areas, chart=True):
+        import bathymetry
+        self.areas = bathymetry.with_depths(areas)
+        self.chart = chart
+
+    def open(self):
+        return self
+
+    # app の日付指定モードと同じ流れ (全エリアの取得 → メモ化した計算 → グラフ)
+    def request(self, area, date):
+        import charts
+        import results
+        import shards
+        from forecast import score_days, hour_rows
+
+        loc = self.areas[area]
+        sd, wd = shards.fetch_areas(date, 1, AREA_OPTIONS)[area]
+
+        def compute():
+            day = score_days(sd, wd, date, lat=loc["lat"], lon=loc["lon"])[0]
+            return day, hour_rows(day, loc["depth"])
+
+        day, _ = results.result_cache.get(("day", area, date, loc["depth"], results.data_version(sd, wd)), compute)
+        if self.chart:
+            hl, sl, tl, tll = day["hours"].tolist(), day["score"].tolist(), day["temp"].tolist(), day["tide"].tolist()
+            key = (area, date, charts.data_version(hl, sl, tl, tll))
+            charts.chart_cache.get_png(key, hl, sl, tl, tll, f"{date} {area}")
+        return True
+
+class ApiUser:
+    def __init__(self, base_url):
+        self.base = urllib.parse.urlsplit(base_url)
+        self.conn = None
+
+    def open(self):
+        user = ApiUser(self.base.geturl())
+        user.conn = http.client.HTTPConnection(self.base.netloc, timeout=60)
+        return user
+
+    def request(self, area, date):
+        query = urllib.parse.urlencode({"area": area, "date": date.isoformat()})
+        self.conn.request("GET", f"/v1/forecast?{query}", headers={"Accept-Encoding": "gzip"})
+        res = self.conn.getresponse()
+        res.read()
+        return res.status == 200
+
+class AppUser:
+    def __init__(self, path=os.path.join(ROOT, "app.py")):
+        self.path = path
+        self.at = None
+
+    def open(self):
+        from streamlit.testing.v1 import AppTest
+        user = AppUser(self.path)
+        user.at = AppTest.from_file(self.path, default_timeout=120)
+        user.at.run()
+        return user
+
+    def request(self, area, date):
+        at = self.at
+        at.selectbox[0].set_value(area)
+        at.date_input[0].set_value(date)
+        at.button[0].click().run()
+        return not at.exception and not at.error
+
+
+# --- 実行 ---
+def percentiles_ms(latencies):
+    if not latencies:
+        return {}
+    p50, p90, p95, p99 = np.percentile(latencies, [50, 90, 95, 99]) * 1000
+    return {"p50_ms": p50, "p90_ms": p90, "p95_ms": p95, "p99_ms": p99, "max_ms": max(latencies) * 1000}
+
+# users 人が duration 秒のあいだ押し続ける. think はユーザーが次に押すまでの平均待ち時間 (指数分布)
+def run_level(target, users, duration, stub, pid, days=7, think=0.0, seed=0, interval=SAMPLE_INTERVAL):
+    today = datetime.date.today()
+    areas = list(AREA_OPTIONS)
+    latencies, errors = [], []
+    lock = threading.Lock()
+    sessions = [target.open() for _ in range(users)]
+    stub.reset()
+    sampler = Sampler(pid, lambda: len(latencies) + len(errors), interval).start()
+    started = time.perf_counter()
+    deadline = started + duration
+
+    def user(k):
+        rng = random.Random(seed * 1000 + k)
+        session = sessions[k]
+        while time.perf_counter() < deadline:
+            area, date = rng.choice(areas), today + datetime.timedelta(days=rng.randrange(days))
+            t0 = time.perf_counter()
+            try:
+                ok = session.request(area, date)
+            except Exception as e:
+                ok = False
+                error = repr(e)
+            else:
+                error = "failed response"
+            elapsed = time.perf_counter() - t0
+            with lock:
+                (latencies if ok else errors).append(elapsed if ok else error)
+            if think:
+                time.sleep(rng.expovariate(1 / think))
+
+    threads = [threading.Thread(target=user, args=(k,), name=f"load-user-{k}") for k in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    timeline = sampler.stop()
+
+    completed = len(latencies)
+    upstream = stub.counts["requests"]
+    cpu = [s["cpu_percent"] for s in timeline]
+    rss = [s["rss_mb"] for s in timeline]
+    return {
+        "users": users,
+        "seconds": round(elapsed, 2),
+        "requests": completed,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:3],
+        "throughput_rps": completed / elapsed if elapsed else 0.0,
+        **percentiles_ms(latencies),
+        "upstream_calls": upstream,
+        "upstream_per_request": upstream / completed if completed else None,
+        "cpu_avg_percent": float(np.mean(cpu)) if cpu else None,
+        "cpu_peak_percent": max(cpu) if cpu else None,
+        "rss_peak_mb": max(rss) if rss else None,
+        "timeline": timeline,
+    }
+
+
+# api.py を別プロセスで起動する (上流はスタブ). 待ち受け URL は起動時の1行目
+def start_api(stub, disk_path):
+    env = {
+        **os.environ,
+        "MATSURI_MARINE_URL": f"{stub.base_url}/v1/marine",
+        "MATSURI_FORECAST_URL": f"{stub.base_url}/v1/forecast",
+        "MATSURI_CACHE_PATH": disk_path or "",
+        "MATSURI_PREFETCH": "0",
+    }
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "api.py"), "--port", "0"], env=env, cwd=ROOT, stdout=subprocess.PIPE, text=True,
+    )
+    line = proc.stdout.readline().strip()
+    if not line:
+        proc.kill()
+        raise RuntimeError("api server did not start")
+    parts = urllib.parse.urlsplit(line)
+    return proc, f"{parts.scheme}://{parts.netloc}"
+
+# headless / app はこのプロセス内のキャッシュ (シャード・計算結果・グラフ) を持たせない
+def disable_caches():
+    import charts
+    import results
+    import shards
+    shards.shard_cache.max_entries = 0
+    results.result_cache.max_entries = 0
+    charts.chart_cache.max_entries = 0
+
+
+def print_report(target, levels, fp=sys.stdout):
+    fp.write(f"target: {target}\n")
+    fp.write(f"{'users':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+             f"{'errors':>8}{'upstream':>10}{'cpu avg%':>10}{'cpu peak%':>10}{'rss MB':>9}\n")
+    fmt = lambda v, spec: format(v, spec) if v is not None else "-"
+    for r in levels:
+        fp.write(
+            f"{r['users']:>6}{r['throughput_rps']:>10.1f}{fmt(r.get('p50_ms'), '>10.1f')}{fmt(r.get('p95_ms'), '>10.1f')}"
+            f"{fmt(r.get('p99_ms'), '>10.1f')}{fmt(r.get('max_ms'), '>10.1f')}{r['errors']:>8}{r['upstream_calls']:>10}"
+            f"{fmt(r['cpu_avg_percent'], '>10.0f')}{fmt(r['cpu_peak_percent'], '>10.0f')}{fmt(r['rss_peak_mb'], '>9.0f')}\n"
+        )
+        for sample in r["error_samples"]:
+            fp.write(f"{'':>6}error: {sample}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="魔釣 負荷試験 (同時ユーザー数ごとのスループット・レイテンシ・CPU/RSS)")
+    parser.add_argument("--target", choices=["headless", "api", "app"], default="headless")
+    parser.add_argument("--users", default="1,4,16", help="同時ユーザー数 (カンマ区切りで順に試す)")
+    parser.add_argument("--duration", type=float, default=20.0, help="ユーザー数ごとの計測秒数")
+    parser.add_argument("--think", type=float, default=0.0, help="ユーザーが次に押すまでの平均待ち秒数")
+    parser.add_argument("--days", type=int, default=7, help="今日から何日先までの日付を選ぶか")
+    parser.add_argument("--latency", type=float, default=0.2, help="スタブの応答遅延 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="スタブの遅延の揺らぎ (秒)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="スタブで失敗させる割合 (0〜1)")
+    parser.add_argument("--no-cache", action="store_true", help="プロセス内のキャッシュを使わない (headless / app)")
+    parser.add_argument("--disk-cache", action="store_true", help="永続キャッシュ (一時ファイル) を使う")
+    parser.add_argument("--no-chart", action="store_true", help="グラフを描かない (headless)")
+    parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL, help="CPU/RSS の記録間隔 (秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="結果 (時系列を含む) を JSON で書き出す")
+    args = parser.parse_args(argv)
+    if args.no_cache and args.target == "api":
+        parser.error("--no-cache は headless / app のみ")
+    users = [int(n) for n in args.users.split(",")]
+    # 日本語フォントが無い環境のグラフ警告は計測の邪魔になるので出さない
+    warnings.filterwarnings("ignore", message="Glyph .* missing from font")
+
+    stub = StubServer(latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate, seed=args.seed).start()
+    tmp = tempfile.TemporaryDirectory()
+    disk_path = os.path.join(tmp.name, "load.sqlite3") if args.disk_cache else None
+    proc = None
+    try:
+        if args.target == "api":
+            proc, base_url = start_api(stub, disk_path)
+            target, pid = ApiUser(base_url), proc.pid
+        else:
+            os.environ.update({"MATSURI_PREFETCH": "0", "MATSURI_CACHE_PATH": disk_path or ""})
+            stub.patch(openmeteo)
+            openmeteo.set_disk_cache(cache.DiskCache(disk_path) if disk_path else None)
+            if args.no_cache:
+                disable_caches()
+            if args.target == "app":
+                import streamlit.logger
+                streamlit.logger.set_log_level("error")
+                target = AppUser()
+            else:
+                target = HeadlessUser(AREA_OPTIONS, chart=not args.no_chart)
+            pid = os.getpid()
+
+        levels = []
+        for n in users:
+            levels.append(run_level(target, n, args.duration, stub, pid, args.days, args.think, args.seed, args.interval))
+            print_report(args.target, levels[-1:], sys.stderr)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        stub.stop()
+        tmp.cleanup()
+
+    print_report(args.target, levels)
+    if args.json:
+        config = {k: v for k, v in vars(args).items() if k != "json"}
+        with open(args.json, "w", encoding="utf-8") as fp:
+            json.dump({"config": config, "levels": levels}, fp, ensure_ascii=False, indent=2, default=float)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import cache
+import openmeteo
+import shards
+from areas import AREA_OPTIONS
+from batch import run_batch
+from scoring import (
+    get_moon_age, get_sinker_weight, sinker_weights, estimate_tide, suggest_strategy, suggest_strategies, score_hours,
+)
+from benchmarks.stub_server import StubServer
+
+# --- ベンチマーク (スループットとレイテンシ分位) ---
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+TOLERANCE = 0.25
+START = datetime.date(2026, 10, 15)
+
+
+def percentiles(samples):
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50_us": p50 * 1e6, "p95_us": p95 * 1e6, "p99_us": p99 * 1e6}
+
+# fn(batch) を repeat 回計測する. 1回あたり batch 件を処理するので 1件あたりの時間に直す
+def measure(fn, batch, repeat, warmup=2):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) / batch)
+    return {"ops_per_s": 1.0 / float(np.mean(samples)), "batch": batch, "repeat": repeat, **percentiles(samples)}
+
+# --- 判定ロジック単体 ---
+def bench_rules(repeat, seed=0):
+    rng = random.Random(seed)
+    n = 1000
+    dates = [START + datetime.timedelta(days=rng.randrange(-3650, 3650)) for _ in range(n)]
+    ages = [rng.randrange(30) for _ in range(n)]
+    depths = [rng.choice([15, 20, 25, 30, 45, 60, 65, 80]) for _ in range(n)]
+    hours = [rng.randrange(24) for _ in range(n)]
+    args = [
+        (rng.randrange(5, 16), rng.randrange(5, 8), rng.randrange(101), round(rng.uniform(-0.5, 0.5), 2),
+         rng.randrange(1, 13), round(rng.uniform(8, 28), 1), rng.randrange(101), rng.choice([0.0, 0.2, 1.0]),
+         rng.choice(depths))
+        for _ in range(n)
+    ]
+
+    cols = [np.array(c) for c in zip(*args)]
+
+    m = 200
+    shape = (m, len(range(5, 16)))
+    arr = {
+        "temps": np.array([[rng.uniform(8, 28) for _ in range(shape[1])] for _ in range(m)]),
+        "tdiffs": np.array([[rng.uniform(-0.5, 0.5) for _ in range(shape[1])] for _ in range(m)]),
+        "clouds": np.array([[rng.randrange(101) for _ in range(shape[1])] for _ in range(m)], dtype=float),
+        "winds": np.array([[rng.uniform(0, 15) for _ in range(shape[1])] for _ in range(m)]),
+        "rains": np.array([[rng.choice([0.0, 0.2, 1.0]) for _ in range(shape[1])] for _ in range(m)]),
+    }
+    moon = np.array([rng.randrange(30) for _ in range(m)])
+    sun = np.array([rng.randrange(5, 8) for _ in range(m)])
+
+    return {
+        "get_moon_age": measure(lambda: [get_moon_age(d) for d in dates], n, repeat),
+        "get_sinker_weight": measure(lambda: [get_sinker_weight(a, d) for a, d in zip(ages, depths)], n, repeat),
+        "estimate_tide": measure(lambda: [estimate_tide(a, h) for a, h in zip(ages, hours)], n, repeat),
+        "sinker_weights": measure(lambda: sinker_weights(np.array(ages), np.array(depths)), n, repeat),
+        "suggest_strategy": measure(lambda: [suggest_strategy(*a) for a in args], n, repeat),
+        "suggest_strategies": measure(lambda: suggest_strategies(*cols), n, repeat),
+        "score_hours": measure(
+            lambda: score_hours(np.arange(5, 16), arr["temps"], arr["tdiffs"], arr["clouds"], arr["winds"],
+                                arr["rains"], moon, sun),
+            m * shape[1], repeat,
+        ),
+    }
+
+# --- 取得から予報までの一括処理 (スタブ相手) ---
+def bench_pipeline(stub, repeat, days=7):
+    pairs = [(area, START + datetime.timedelta(days=k)) for area in AREA_OPTIONS for k in range(days)]
+    results = {}
+
+    # cold は毎回シャードを捨てて上流から取る
+    def cold():
+        shards.shard_cache.clear()
+        return run_batch(pairs, workers=1)
+
+    openmeteo.set_disk_cache(None)
+    stub.reset()
+    results["pipeline_cold"] = measure(cold, len(pairs), repeat, warmup=1)
+    results["pipeline_cold"]["upstream_calls"] = stub.counts["requests"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        openmeteo.set_disk_cache(cache.DiskCache(os.path.join(tmp, "bench.sqlite3")))
+        shards.shard_cache.clear()
+        stub.reset()
+        results["pipeline_warm"] = measure(lambda: run_batch(pairs, workers=1), len(pairs), repeat, warmup=1)
+        results["pipeline_warm"]["upstream_calls"] = stub.counts["requests"]
+        openmeteo.set_disk_cache(None)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if cur["ops_per_s"] < base["ops_per_s"] * (1 - tolerance):
+            regressions.append(f"{name}: {cur['ops_per_s']:.0f} ops/s < baseline {base['ops_per_s']:.0f} ops/s")
+        if cur["p95_us"] > base["p95_us"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {cur['p95_us']:.1f}us > baseline {base['p95_us']:.1f}us")
+    return regressions
+
+def print_table(results, baseline=None, fp=sys.stdout):
+    fp.write(f"{'benchmark':<20}{'ops/s':>14}{'p50 us':>12}{'p95 us':>12}{'p99 us':>12}{'vs base':>10}\n")
+    for name, r in results.items():
+        base = (baseline or {}).get(name)
+        delta = f"{r['ops_per_s'] / base['ops_per_s'] - 1:+.0%}" if base else ""
+        fp.write(f"{name:<20}{r['ops_per_s']:>14,.0f}{r['p50_us']:>12.2f}{r['p95_us']:>12.2f}{r['p99_us']:>12.2f}{delta:>10}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="魔釣 ベンチマーク")
+    parser.add_argument("--only", choices=["rules", "pipeline"], help="一部だけ実行する")
+    parser.add_argument("--repeat", type=int, default=30, help="計測回数")
+    parser.add_argument("--latency", type=float, default=0.0, help="スタブの応答遅延 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="スタブの遅延の揺らぎ (秒)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="スタブで失敗させる割合 (0〜1)")
+    parser.add_argument("--baseline", default=BASELINE, help="比較するベースライン JSON")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果をベースラインとして保存")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="許容する劣化率")
+    parser.add_argument("--json", help="結果を JSON で書き出す")
+    args = parser.parse_args(argv)
+
+    results = {}
+    if args.only in (None, "rules"):
+        results.update(bench_rules(args.repeat))
+    if args.only in (None, "pipeline"):
+        stub = StubServer(latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate, seed=0).start()
+        try:
+            with stub.patched(openmeteo):
+                results.update(bench_pipeline(stub, max(args.repeat // 5, 3)))
+        finally:
+            stub.stop()
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as fp:
+            baseline = json.load(fp)["results"]
+    print_table(results, baseline)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fp:
+            json.dump({"results": results}, fp, indent=2)
+    if args.save_baseline:
+        meta = {"python": platform.python_version(), "machine": platform.machine(), "numpy": np.__version__,
+                "created": datetime.datetime.now().isoformat(timespec="seconds")}
+        with open(args.baseline, "w", encoding="utf-8") as fp:
+            json.dump({"meta": meta, "results": results}, fp, indent=2)
+            fp.write("\n")
+        return 0
+
+    regressions = compare(results, baseline or {}, args.tolerance)
+    for line in regressions:
+        sys.stderr.write(f"REGRESSION {line}\n")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
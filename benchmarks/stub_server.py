@@ -0,0 +1,210 @@
+import argparse
+import contextlib
+import datetime
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Open-Meteo スタブ (記録済みレスポンスを再生する) ---
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+ENDPOINTS = {"/v1/marine": "marine", "/v1/forecast": "forecast", "/v1/archive": "forecast"}
+
+
+def load_fixtures(path=FIXTURES):
+    fixtures = {}
+    for name in set(ENDPOINTS.values()):
+        with open(os.path.join(path, f"{name}.json"), encoding="utf-8") as fp:
+            data = json.load(fp)
+        fixtures[name] = data if isinstance(data, list) else [data]
+    return fixtures
+
+# 記録した時系列を要求された期間・地点数に合わせて並べ直す (足りない分は繰り返す)
+def replay(recorded, params):
+    start = datetime.date.fromisoformat(params["start_date"])
+    end = datetime.date.fromisoformat(params["end_date"])
+    n_days = (end - start).days + 1
+    lats = params["latitude"].split(",")
+    lons = params["longitude"].split(",")
+
+    out = []
+    for i, (lat, lon) in enumerate(zip(lats, lons)):
+        rec = recorded[i % len(recorded)]
+        loc = {k: v for k, v in rec.items() if k not in ("hourly", "daily")}
+        loc.update({"latitude": float(lat), "longitude": float(lon)})
+        if len(lats) > 1:
+            loc["location_id"] = i
+
+        hourly = {}
+        rec_hours = len(rec["hourly"]["time"])
+        offset = (start.toordinal() * 24) % rec_hours
+        for key, series in rec["hourly"].items():
+            if key == "time":
+                t0 = datetime.datetime.combine(start, datetime.time())
+                hourly[key] = [(t0 + datetime.timedelta(hours=k)).strftime("%Y-%m-%dT%H:%M") for k in range(n_days * 24)]
+            else:
+                hourly[key] = [series[(offset + k) % rec_hours] for k in range(n_days * 24)]
+        loc["hourly"] = hourly
+
+        if "daily" in rec and "daily" in params:
+            rec_days = len(rec["daily"]["time"])
+            daily = {"time": [(start + datetime.timedelta(days=k)).isoformat() for k in range(n_days)]}
+            for key, series in rec["daily"].items():
+                if key == "time":
+                    continue
+                daily[key] = [
+                    f"{daily['time'][k]}T{series[(start.toordinal() + k) % rec_days].split('T')[1]}"
+                    if isinstance(series[0], str) else series[(start.toordinal() + k) % rec_days]
+                    for k in range(n_days)
+                ]
+            loc["daily"] = daily
+        out.append(loc)
+    return out[0] if len(out) == 1 else out
+
+
+class StubServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, fail_rate=0.0, fail_status=503,
+                 seed=None, fixtures=FIXTURES):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.fixtures = load_fixtures(fixtures)
+        self.counts = {"requests": 0, "failures": 0, "marine": 0, "forecast": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload, separators=(",", ":")).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = urllib.parse.urlsplit(self.path)
+                if parts.path == "/stats":
+                    with stub._lock:
+                        return self._send(200, dict(stub.counts))
+                if parts.path == "/reset":
+                    stub.reset()
+                    return self._send(200, {"ok": True})
+                name = ENDPOINTS.get(parts.path)
+                if name is None:
+                    return self._send(404, {"error": True, "reason": f"unknown path {parts.path}"})
+
+                with stub._lock:
+                    stub.counts["requests"] += 1
+                    stub.counts[name] += 1
+                    delay = stub.latency + stub._rng.uniform(0, stub.jitter)
+                    fail = stub._rng.random() < stub.fail_rate
+                    if fail:
+                        stub.counts["failures"] += 1
+                if delay:
+                    time.sleep(delay)
+                if fail:
+                    return self._send(stub.fail_status, {"error": True, "reason": "injected failure"})
+                try:
+                    params = dict(urllib.parse.parse_qsl(parts.query))
+                    self._send(200, replay(stub.fixtures[name], params))
+                except (KeyError, ValueError) as e:
+                    self._send(400, {"error": True, "reason": str(e)})
+
+        return Handler
+
+    def reset(self):
+        with self._lock:
+            for key in self.counts:
+                self.counts[key] = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="openmeteo-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    # openmeteo のエンドポイントをこのスタブに向ける
+    def patch(self, openmeteo):
+        openmeteo.MARINE_URL = f"{self.base_url}/v1/marine"
+        openmeteo.FORECAST_URL = f"{self.base_url}/v1/forecast"
+        openmeteo.ARCHIVE_URL = f"{self.base_url}/v1/archive"
+
+    # with の間だけスタブに向け, 抜けたら3つのエンドポイントを元に戻す
+    @contextlib.contextmanager
+    def patched(self, openmeteo):
+        saved = openmeteo.MARINE_URL, openmeteo.FORECAST_URL, openmeteo.ARCHIVE_URL
+        self.patch(openmeteo)
+        try:
+            yield self
+        finally:
+            openmeteo.MARINE_URL, openmeteo.FORECAST_URL, openmeteo.ARCHIVE_URL = saved
+
+
+# 本物の Open-Meteo から全エリア分のレスポンスを記録し直す
+def record(path=FIXTURES, days=16):
+    import openmeteo
+    from areas import AREA_OPTIONS
+
+    start = datetime.date.today()
+    for name, url in zip(("marine", "forecast"), openmeteo.window_urls(start, days, AREA_OPTIONS)):
+        req = urllib.request.Request(url, headers={"User-Agent": openmeteo.USER_AGENT})
+        with urllib.request.urlopen(req, timeout=30) as res:
+            data = json.loads(res.read().decode())
+        with open(os.path.join(path, f"{name}.json"), "w", encoding="utf-8") as fp:
+            json.dump(data, fp, separators=(",", ":"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open-Meteo スタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="応答遅延 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延に加える 0〜jitter 秒の揺らぎ")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="失敗させる割合 (0〜1)")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--record", action="store_true", help="本物のAPIからフィクスチャを記録して終了")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record()
+        return
+    stub = StubServer(args.host, args.port, args.latency, args.jitter, args.fail_rate, args.fail_status, args.seed)
+    print(f"Open-Meteo stub on {stub.base_url} (MATSURI_MARINE_URL={stub.base_url}/v1/marine "
+          f"MATSURI_FORECAST_URL={stub.base_url}/v1/forecast)")
+    try:
+        stub._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+# --- 永続キャッシュ (SQLite, 同一ホストの全プロセスで共有) ---
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "matsuri", "forecast.sqlite3")
+FRESH_TTL = 3600
+STALE_TTL = 24 * 3600
+MAX_AGE = 7 * 24 * 3600
+MAX_BYTES = 64 * 1024 * 1024
+EVICT_EVERY = 50
+
+FRESH, STALE, MISS = "fresh", "stale", "miss"
+
+
+def _has_column(conn, name):
+    return name in [row[1] for row in conn.execute("PRAGMA table_info(entries)")]
+
+
+class DiskCache:
+    def __init__(self, path=DEFAULT_PATH, fresh_ttl=FRESH_TTL, stale_ttl=STALE_TTL, max_age=MAX_AGE, max_bytes=MAX_BYTES):
+        self.path = path
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.counts = {"hits": 0, "stale_hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " fetched_at REAL NOT NULL, accessed_at REAL NOT NULL, expires_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+            # 以前の版で作ったファイルには期限の列が無い
+            if not _has_column(conn, "expires_at"):
+                try:
+                    conn.execute("ALTER TABLE entries ADD COLUMN expires_at REAL")
+                except sqlite3.OperationalError:
+                    # 同時に起動した別プロセスが先に足した (duplicate column) なら問題ない
+                    if not _has_column(conn, "expires_at"):
+                        raise
+
+    # sqlite3 の接続はスレッドをまたげないのでスレッドごとに持つ
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counts[name] += n
+
+    # (値, 状態) を返す. 状態は FRESH / STALE / MISS
+    # 書くときに期限を渡した値はその時刻まで, 渡さなければ取得から fresh_ttl 秒まで新鮮
+    def get(self, key, now=None):
+        now = now or time.time()
+        row = self._conn().execute("SELECT value, fetched_at, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._count("misses")
+            return None, MISS
+        over = now - (row[2] if row[2] is not None else row[1] + self.fresh_ttl)
+        if over > self.stale_ttl:
+            self._count("misses")
+            return None, MISS
+        self._conn().execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        value = json.loads(zlib.decompress(row[0]))
+        if over <= 0:
+            self._count("hits")
+            return value, FRESH
+        self._count("stale_hits")
+        return value, STALE
+
+    # 期限を無視して (値, 経過秒数) を返す. 上流障害時のフォールバック用
+    def peek(self, key, now=None):
+        row = self._conn().execute("SELECT value, fetched_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(zlib.decompress(row[0])), (now or time.time()) - row[1]
+
+    # 取得からの経過秒数, 無ければ None (カウンタは増やさない)
+    def age(self, key, now=None):
+        row = self._conn().execute("SELECT fetched_at FROM entries WHERE key = ?", (key,)).fetchone()
+        return None if row is None else (now or time.time()) - row[0]
+
+    def set(self, key, value, now=None, expires_at=None):
+        self.set_many([(key, value, expires_at)], now)
+
+    # 複数件を1トランザクションで書く (日ごとのシャードなど小さい値をまとめて保存する)
+    # items は (キー, 値) か (キー, 値, 新鮮な期限) の並び
+    def set_many(self, items, now=None):
+        now = now or time.time()
+        rows = []
+        for key, value, *expires_at in items:
+            blob = zlib.compress(json.dumps(value, separators=(",", ":")).encode())
+            rows.append((key, blob, len(blob), now, now, expires_at[0] if expires_at else None))
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, fetched_at, accessed_at, expires_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)", rows,
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            before = self.counts["sets"]
+            self.counts["sets"] += len(rows)
+            after = self.counts["sets"]
+        if before // EVICT_EVERY != after // EVICT_EVERY:
+            self.evict(now)
+
+    # 期限切れを消し, 合計サイズが上限を超えていれば古いアクセス順に消す
+    def evict(self, now=None):
+        now = now or time.time()
+        conn = self._conn()
+        # 予報範囲外の日など, 期限が max_age より先の値は期限まで残す
+        removed = conn.execute(
+            "DELETE FROM entries WHERE fetched_at < ? AND COALESCE(expires_at, 0) < ?", (now - self.max_age, now),
+        ).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            over = total - self.max_bytes
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                removed += 1
+                over -= size
+                if over <= 0:
+                    break
+        if removed:
+            self._count("evictions", removed)
+        return removed
+
+    def stats(self):
+        entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        with self._lock:
+            counts = dict(self.counts)
+        lookups = counts["hits"] + counts["stale_hits"] + counts["misses"]
+        counts.update({
+            "entries": entries,
+            "bytes": size,
+            "hit_rate": (counts["hits"] + counts["stale_hits"]) / lookups if lookups else 0.0,
+        })
+        return counts
+
+
+# MATSURI_CACHE_PATH を空にすると永続キャッシュを使わない
+def from_env():
+    path = os.environ.get("MATSURI_CACHE_PATH", DEFAULT_PATH)
+    return DiskCache(path) if path else None
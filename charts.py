@@ -0,0 +1,202 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+# --- グラフ描画 (pyplot を使わず, 描画結果をメモ化する) ---
+TITLE_SIZE = 16; LABEL_SIZE = 12; TICK_SIZE = 10; LINE_WIDTH = 2.0; MARKER_SIZE = 6
+DPI = 200
+MAX_ENTRIES = 64
+
+
+# 入力データから描画結果のキーに使うバージョン文字列を作る
+def data_version(*arrays):
+    h = hashlib.sha1()
+    for a in arrays:
+        h.update(np.ascontiguousarray(a, dtype=float).tobytes())
+    return h.hexdigest()[:16]
+
+def render_png(hours, scores, temps, tides, title):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 5))
+    FigureCanvasAgg(fig)
+    try:
+        ax1 = fig.subplots()
+
+        color = 'tab:blue'
+        ax1.set_xlabel('Time', fontsize=LABEL_SIZE)
+        ax1.set_ylabel('Score', color=color, fontsize=LABEL_SIZE)
+        ax1.bar(hours, scores, color=color, alpha=0.4)
+        ax1.set_ylim(0, 100)
+        ax1.tick_params(axis='x', labelsize=TICK_SIZE)
+        ax1.tick_params(axis='y', labelcolor=color, labelsize=TICK_SIZE)
+
+        ax2 = ax1.twinx()
+        color = 'tab:red'
+        ax2.set_ylabel('Temp (C)', color=color, fontsize=LABEL_SIZE)
+        ax2.plot(hours, temps, color=color, marker='o', linewidth=LINE_WIDTH, markersize=MARKER_SIZE)
+        vt = [t for t in temps if t > 0]
+        if vt:
+            margin = 1.0 if max(vt) == min(vt) else 0.5
+            ax2.set_ylim(min(vt) - margin, max(vt) + margin)
+        ax2.tick_params(axis='y', labelcolor=color, labelsize=TICK_SIZE)
+
+        ax3 = ax1.twinx()
+        ax3.spines["right"].set_position(("axes", 1.15))
+        color = 'tab:green'
+        ax3.set_ylabel('Tide (Est)', color=color, fontsize=LABEL_SIZE)
+        ax3.plot(hours, tides, color=color, linestyle='--', marker='x', linewidth=LINE_WIDTH, markersize=MARKER_SIZE)
+        ax3.set_ylim(-1.5, 1.5)
+        ax3.set_yticks([])
+
+        ax3.set_title(title, fontsize=TITLE_SIZE)
+        ax3.grid(axis='x', linestyle='--', alpha=0.5)
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=DPI, bbox_inches="tight")
+        return buf.getvalue()
+    finally:
+        fig.clear()
+
+# Streamlit ネイティブ表示用 (Vega-Lite, 画像を作らない)
+def vega_spec(hours, scores, temps, tides, title):
+    rows = [
+        {"hour": int(h), "score": int(s), "temp": float(t), "tide": float(td)}
+        for h, s, t, td in zip(hours, scores, temps, tides)
+    ]
+    vt = [t for t in temps if t > 0]
+    margin = 1.0 if vt and max(vt) == min(vt) else 0.5
+    temp_domain = [min(vt) - margin, max(vt) + margin] if vt else None
+    x = {"field": "hour", "type": "quantitative", "title": "Time", "axis": {"tickMinStep": 1}}
+    return {
+        "title": title,
+        "data": {"values": rows},
+        "layer": [
+            {
+                "mark": {"type": "bar", "color": "#1f77b4", "opacity": 0.4},
+                "encoding": {"x": x, "y": {"field": "score", "type": "quantitative", "title": "Score", "scale": {"domain": [0, 100]}}},
+            },
+            {
+                "mark": {"type": "line", "color": "#d62728", "point": True},
+                "encoding": {"x": x, "y": {"field": "temp", "type": "quantitative", "title": "Temp (C)",
+                                          "scale": {"domain": temp_domain, "zero": False} if temp_domain else {"zero": False}}},
+            },
+            {
+                "mark": {"type": "line", "color": "#2ca02c", "strokeDash": [6, 4], "point": {"shape": "cross"}},
+                "encoding": {"x": x, "y": {"field": "tide", "type": "quantitative", "axis": None, "scale": {"domain": [-1.5, 1.5]}}},
+            },
+        ],
+        "resolve": {"scale": {"y": "independent"}},
+    }
+
+
+# 海域マップ (ベストスコアと最高スコアの時刻を左右に並べる). 陸地 (NaN) は塗らない
+def render_heatmap_png(grid, title, pins=None):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(12, 5.5))
+    FigureCanvasAgg(fig)
+    try:
+        axes = fig.subplots(1, 2, sharey=True)
+        aspect = 1 / np.cos(np.radians(float(np.mean(grid["lats"]))))
+        panels = [
+            (grid["best_score"], "Best score", "RdYlGn", 0, 100),
+            (grid["best_hour"], "Best hour", "viridis", int(grid["hours"][0]), int(grid["hours"][-1])),
+        ]
+        for ax, (values, label, cmap, vmin, vmax) in zip(axes, panels):
+            mesh = ax.pcolormesh(
+                grid["lons"], grid["lats"], np.ma.masked_invalid(values),
+                cmap=cmap, vmin=vmin, vmax=vmax, shading="nearest",
+            )
+            fig.colorbar(mesh, ax=ax, shrink=0.8).set_label(label, fontsize=LABEL_SIZE)
+            for lat, lon in (pins or []):
+                ax.plot(lon, lat, marker="^", color="black", markersize=MARKER_SIZE)
+            half = grid["step"] / 2
+            ax.set_xlim(grid["lons"][0] - half, grid["lons"][-1] + half)
+            ax.set_ylim(grid["lats"][0] - half, grid["lats"][-1] + half)
+            ax.set_aspect(aspect)
+            ax.set_xlabel("Lon", fontsize=LABEL_SIZE)
+            ax.tick_params(labelsize=TICK_SIZE)
+            ax.set_title(label, fontsize=LABEL_SIZE)
+        axes[0].set_ylabel("Lat", fontsize=LABEL_SIZE)
+        fig.suptitle(title, fontsize=TITLE_SIZE)
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=DPI // 2, bbox_inches="tight")
+        return buf.getvalue()
+    finally:
+        fig.clear()
+
+def vega_heatmap(grid, title):
+    rows = [
+        {"lat": float(lat), "lon": float(lon), "score": float(sc), "hour": int(h)}
+        for i, lat in enumerate(grid["lats"]) for j, lon in enumerate(grid["lons"])
+        for sc, h in [(grid["best_score"][i, j], grid["best_hour"][i, j])] if sc == sc
+    ]
+    x = {"field": "lon", "type": "quantitative", "title": "Lon", "scale": {"zero": False}}
+    y = {"field": "lat", "type": "quantitative", "title": "Lat", "scale": {"zero": False}}
+    mark = {"type": "square", "size": 60, "opacity": 1}
+    return {
+        "title": title,
+        "data": {"values": rows},
+        "hconcat": [
+            {"mark": mark, "encoding": {"x": x, "y": y, "color": {
+                "field": "score", "type": "quantitative", "title": "Best score",
+                "scale": {"scheme": "redyellowgreen", "domain": [0, 100]}}}},
+            {"mark": mark, "encoding": {"x": x, "y": y, "color": {
+                "field": "hour", "type": "ordinal", "title": "Best hour", "scale": {"scheme": "viridis"}}}},
+        ],
+    }
+
+
+class ChartCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # key は (エリア, 日付, データバージョン)
+    def get_png(self, key, hours, scores, temps, tides, title):
+        return self.get(key, lambda: render_png(hours, scores, temps, tides, title))
+
+    # キャッシュに無ければ render() で描いて保存する
+    def get(self, key, render):
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return png
+            self.misses += 1
+        with metrics.timer("chart_render"):
+            png = render()
+        with self._lock:
+            self._entries[key] = png
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return png
+
+    def samples(self):
+        labels = {"cache": "chart"}
+        with self._lock:
+            return [
+                ("cache_hits_total", "counter", labels, self.hits),
+                ("cache_misses_total", "counter", labels, self.misses),
+                ("cache_evictions_total", "counter", labels, self.evictions),
+                ("cache_entries", "gauge", labels, len(self._entries)),
+            ]
+
+
+chart_cache = ChartCache()
+metrics.add_collector(chart_cache.samples)
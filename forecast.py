@@ -0,0 +1,204 @@
+import datetime
+
+import numpy as np
+
+import astronomy
+from series import JST, HOUR, as_series, local_midnight, restore, utc_midnight
+from scoring import (
+    get_sinker_weight, suggest_strategies,
+    weather_label, wind_label, low_temp_label, take_hours, sst_at_hours, score_hours,
+)
+
+# --- 予報の組み立て (Streamlit 非依存) ---
+HISTORICAL_TEMPS = {
+    1: 10.5, 2: 9.8, 3: 10.5, 4: 13.0, 5: 17.5, 6: 21.0,
+    7: 25.5, 8: 27.0, 9: 25.5, 10: 22.0, 11: 18.0, 12: 14.0
+}
+
+# 水温は GMT の日で区切った48時間 (前日0時〜当日24時 GMT) の窓で見る
+# 窓の先頭から当日0時 (日本時間) までの時間数. 当日 h 時は窓の OFF + h 時間目
+OFF = 24 - JST.utcoffset(None) // HOUR
+DAY_HOURS = np.arange(5, 16)
+
+
+# 前日比の水温トレンド (スコア補正, 表示ラベル)
+# r_temps は欠測が NaN の配列 (None 混じりの list も可)
+def day_trend(r_temps):
+    r_temps = np.asarray(r_temps, dtype=float)
+    if len(r_temps) < 48: return 0, ""
+    temps_yesterday = r_temps[0:24][~np.isnan(r_temps[0:24])]
+    temps_today = r_temps[24:48][~np.isnan(r_temps[24:48])]
+    if not (len(temps_yesterday) and len(temps_today)): return 0, ""
+
+    avg_yesterday = sum(temps_yesterday) / len(temps_yesterday)
+    avg_today = sum(temps_today) / len(temps_today)
+    diff_day = avg_today - avg_yesterday
+    if diff_day <= -0.5:
+        return -20, f"⚠️前日比{diff_day:+.1f}℃"
+    elif diff_day >= 0.5:
+        return 10, f"前日比{diff_day:+.1f}℃"
+    return 0, ""
+
+# start_date から n_days 日分を1回のベクトル計算でスコア化する
+# sd / wd は HourlySeries (またはレスポンスの dict). 時刻で揃えるので取得期間の始まりは問わない
+# 日の出は lat/lon から天文計算で求める (渡さなければ 7時)
+# depth を渡すと時間ごとの戦略も全日分まとめて求めておく (hour_rows で使う)
+def score_days(sd, wd, start_date, n_days=1, hours=DAY_HOURS, lat=None, lon=None, depth=None):
+    sd, wd = as_series(sd), as_series(wd)
+    sst_start = utc_midnight(start_date - datetime.timedelta(days=1))
+    n_sst = 24 * n_days + 24
+    all_temps = restore(sd.window("sea_surface_temperature", sst_start, n_sst)) if sd is not None else np.full(n_sst, np.nan)
+    # 前日比は48時間の窓が丸ごと取得範囲に入っている日だけ出す
+    sst_hours = len(sd) - sd.offset(sst_start) if sd is not None and sd.offset(sst_start) >= 0 else 0
+
+    table = astronomy.get_table()
+    moon_ages = table.moon_ages(start_date, n_days).astype(int)
+    sunrises = table.sunrise_hours(lat, lon, start_date, n_days) if lat is not None else [7] * n_days
+
+    days = []
+    ct_rows, tdiff_rows = [], []
+    for k in range(n_days):
+        date = start_date + datetime.timedelta(days=k)
+        r_temps = all_temps[24 * k:24 * k + 48]
+
+        use_historical = not (r_temps > 0).any()
+        trend_score, trend_label = 0, ""
+        if use_historical:
+            r_temps = np.full(48, HISTORICAL_TEMPS.get(date.month, 15.0))
+        elif 24 * k + 48 <= sst_hours:
+            trend_score, trend_label = day_trend(r_temps)
+
+        cur_t = take_hours(r_temps, OFF + hours)
+        day_temps = cur_t[~np.isnan(cur_t)].tolist()
+        ct, pt = sst_at_hours(r_temps, OFF + hours)
+        ct_rows.append(ct)
+        tdiff_rows.append(np.zeros_like(ct) if use_historical else ct - pt)
+
+        days.append({
+            "date": date,
+            "moon_age": int(moon_ages[k]),
+            "sun_h": int(sunrises[k]),
+            "use_historical": use_historical,
+            "day_trend_score": trend_score,
+            "day_trend_label": trend_label,
+            "min_t": min(day_temps) if day_temps else 0,
+            "max_t": max(day_temps) if day_temps else 0,
+        })
+
+    day_idx = 24 * np.arange(n_days)[:, None] + hours
+    temps = np.array(ct_rows).reshape(n_days, len(hours))
+    tdiffs = np.array(tdiff_rows).reshape(n_days, len(hours))
+    # 天気は当日0時 (日本時間) からの時刻で引く
+    weather = lambda name: (
+        np.nan_to_num(wd.take(name, local_midnight(start_date), day_idx)) if wd is not None else np.zeros(day_idx.shape)
+    )
+    clouds, winds, rains = weather("cloud_cover"), weather("wind_speed_10m"), weather("rain")
+
+    scores, slacks, tides = score_hours(
+        hours, temps, tdiffs, clouds, winds, rains,
+        np.array([d["moon_age"] for d in days]),
+        np.array([d["sun_h"] for d in days]),
+        np.array([d["day_trend_score"] for d in days]),
+        np.array([d["use_historical"] for d in days]),
+    )
+
+    if depth is not None:
+        strategies = suggest_strategies(
+            hours, np.array([d["sun_h"] for d in days])[:, None], scores, tdiffs,
+            np.array([d["date"].month for d in days])[:, None], temps, clouds, rains, depth,
+        )
+
+    for k, day in enumerate(days):
+        day.update({
+            "hours": hours, "score": scores[k], "slack": slacks[k], "tide": tides[k],
+            "temp": temps[k], "tdiff": tdiffs[k], "cloud": clouds[k], "wind": winds[k], "rain": rains[k],
+        })
+        if depth is not None:
+            day["strategy"] = (depth, tuple(s[k] for s in strategies))
+    return days
+
+# --- 時間ごとの戦略 ---
+SINKER_DEPTHS = [15, 30, 45, 60, 80]
+
+
+def hour_rows(day, depth):
+    cached = day.get("strategy")
+    if cached and cached[0] == depth:
+        strategies = cached[1]
+    else:
+        strategies = suggest_strategies(
+            day["hours"], day["sun_h"], day["score"], day["tdiff"], day["date"].month, day["temp"], day["cloud"], day["rain"], depth,
+        )
+    rows = []
+    for h, sc, ct, tdiff, cloud, wind, rain, slack, tide, tie1, tie2, spd, hk, worm in zip(
+        day["hours"].tolist(), day["score"].tolist(), day["temp"].tolist(), day["tdiff"].tolist(),
+        day["cloud"].tolist(), day["wind"].tolist(), day["rain"].tolist(), day["slack"].tolist(), day["tide"].tolist(),
+        *(s.tolist() for s in strategies),
+    ):
+        low_temp_alert = low_temp_label(ct)
+
+        notes = []
+        if slack: notes.append("★転流")
+        if low_temp_alert: notes.append(f"⚠️{low_temp_alert}")
+        if rain >= 0.5: notes.append("濁り")
+        if day["day_trend_label"] and not low_temp_alert: notes.append(day["day_trend_label"])
+
+        rows.append({
+            "hour": h, "score": sc, "slack": slack, "tide": tide, "temp": ct, "tdiff": tdiff,
+            "cloud": cloud, "wind": wind, "rain": rain,
+            "weather": weather_label(rain, cloud), "wind_label": wind_label(wind), "low_temp_alert": low_temp_alert,
+            "honmei": tie1, "osae": tie2, "speed": spd, "hook": hk, "worm": worm, "notes": notes,
+        })
+    return rows
+
+def sinker_table(moon_age, depths=SINKER_DEPTHS):
+    return {d: get_sinker_weight(moon_age, d)[1] for d in depths}
+
+# 1エリア1日分の予報を JSON にできる形でまとめる
+def day_report(area, depth, day):
+    tide_name, area_sinker = get_sinker_weight(day["moon_age"], depth)
+    return {
+        "area": area,
+        "date": day["date"].isoformat(),
+        "depth": depth,
+        "moon_age": day["moon_age"],
+        "tide_name": tide_name,
+        "sunrise_hour": day["sun_h"],
+        "use_historical": day["use_historical"],
+        "day_trend_label": day["day_trend_label"],
+        "temp_min": day["min_t"],
+        "temp_max": day["max_t"],
+        "sinker": area_sinker,
+        "sinkers": {f"{d}m": w for d, w in sinker_table(day["moon_age"]).items()},
+        "hours": hour_rows(day, depth),
+    }
+
+# --- ベスト日ランキング ---
+# width 時間連続の平均スコアが最大になる時間帯を日ごとに求める
+def best_windows(scores, width=3):
+    scores = np.atleast_2d(scores).astype(float)
+    width = min(width, scores.shape[-1])
+    csum = np.concatenate([np.zeros((scores.shape[0], 1)), np.cumsum(scores, axis=-1)], axis=-1)
+    means = (csum[:, width:] - csum[:, :-width]) / width
+    start = means.argmax(axis=-1)
+    return start, means[np.arange(len(start)), start]
+
+def rank_days(days, width=3, top=None):
+    if not days: return []
+    hours = days[0]["hours"]
+    scores = np.stack([d["score"] for d in days])
+    start, window_score = best_windows(scores, width)
+    width = min(width, len(hours))
+
+    ranking = []
+    for k, day in enumerate(days):
+        ranking.append({
+            "date": day["date"],
+            "start_h": int(hours[start[k]]),
+            "end_h": int(hours[start[k] + width - 1]),
+            "window_score": float(window_score[k]),
+            "max_score": int(scores[k].max()),
+            "day": day,
+        })
+    ranking.sort(key=lambda r: (-r["window_score"], -r["max_score"], r["date"]))
+    return ranking[:top] if top else ranking
@@ -0,0 +1,347 @@
+import argparse
+import datetime
+import json
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import astronomy
+import bathymetry
+import metrics
+import shards
+from areas import AREA_OPTIONS, GRID_REGIONS
+from forecast import HISTORICAL_TEMPS, OFF, DAY_HOURS, best_windows
+from series import as_series, local_midnight, restore, utc_midnight
+from scoring import (
+    TIDE_CLASSES, tide_class, get_sinker_weight, suggest_strategies, take_hours, sst_at_hours, score_hours,
+)
+
+# --- 海域マップ (範囲内の格子点をまとめてスコア化する) ---
+# 格子は緯度経度 0° を原点に step 度刻みで固定し, TILE_POINTS 四方をタイルとして取得・計算・キャッシュする
+# (範囲をずらしても同じタイルは再利用できる)
+DEFAULT_STEP = 0.025
+TILE_POINTS = 10
+MAX_TILES = 256
+# 1回の表示で上流から取るタイルの数 (1タイル = 100地点 x 2リクエスト で予算の約200回分)
+# 残りは平年値で埋めておき, 次の表示で続きを取る
+MAX_COLD_TILES = 2
+
+
+# --- 格子とタイル ---
+def _index_range(lo, hi, step):
+    return math.ceil(lo / step - 1e-9), math.floor(hi / step + 1e-9)
+
+def _coord(i, step):
+    return round(i * step, 6)
+
+# 範囲 (南端, 北端, 西端, 東端) に掛かるタイル番号の一覧
+def tiles_for(bbox, step=DEFAULT_STEP):
+    i0, i1 = _index_range(bbox[0], bbox[1], step)
+    j0, j1 = _index_range(bbox[2], bbox[3], step)
+    return [
+        (ti, tj)
+        for ti in range(i0 // TILE_POINTS, i1 // TILE_POINTS + 1)
+        for tj in range(j0 // TILE_POINTS, j1 // TILE_POINTS + 1)
+    ]
+
+# タイル内の地点 (緯度優先の順で TILE_POINTS**2 個)
+def tile_points(tile, step=DEFAULT_STEP):
+    ti, tj = tile
+    lats = [_coord(ti * TILE_POINTS + a, step) for a in range(TILE_POINTS)]
+    lons = [_coord(tj * TILE_POINTS + b, step) for b in range(TILE_POINTS)]
+    return [lat for lat in lats for _ in lons], [lon for _ in lats for lon in lons]
+
+# 1タイル = marine / forecast 各1リクエスト (100地点をカンマ区切りでまとめる)
+# 日ごとのシャードに分けて持つので, 日付を進めても前日の水温は取り直さない
+def tile_queries(tile, date, step=DEFAULT_STEP):
+    lats, lons = tile_points(tile, step)
+    return shards.window_queries(date, 1, lats, lons)
+
+
+class TileCache:
+    # key は (日付, 格子間隔, タイル番号). 元にしたシャードの最も早い期限 (次のモデルの公開) まで持つ
+    def __init__(self, max_tiles=MAX_TILES):
+        self.max_tiles = max_tiles
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, now=None):
+        now = now or time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now <= entry[0]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_tiles:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def samples(self):
+        labels = {"cache": "grid_tile"}
+        with self._lock:
+            return [
+                ("cache_hits_total", "counter", labels, self.hits),
+                ("cache_misses_total", "counter", labels, self.misses),
+                ("cache_evictions_total", "counter", labels, self.evictions),
+                ("cache_entries", "gauge", labels, len(self._entries)),
+            ]
+
+
+tile_cache = TileCache()
+metrics.add_collector(tile_cache.samples)
+
+
+# --- スコア計算 (地点×時間の2次元で一括) ---
+def _nearest_area(lat, lon, areas=AREA_OPTIONS):
+    return min(areas, key=lambda a: (areas[a]["lat"] - lat) ** 2 + ((areas[a]["lon"] - lon) * math.cos(math.radians(lat))) ** 2)
+
+# 地点ごとの HourlySeries から start 以降 n 時間を (地点, 時間) の配列にする. 取得失敗の地点は NaN
+def _hourly(locs, key, start, n):
+    out = np.full((len(locs), n), np.nan, dtype=np.float32)
+    for p, loc in enumerate(locs):
+        if loc is not None:
+            out[p] = loc.window(key, start, n)
+    return restore(out)
+
+# 前日比の水温トレンド (forecast.day_trend と同じ判定を地点ごとに)
+def _trend_scores(sst):
+    yesterday, today = sst[:, :24], sst[:, 24:48]
+    n_y, n_t = (~np.isnan(yesterday)).sum(axis=-1), (~np.isnan(today)).sum(axis=-1)
+    ok = (n_y > 0) & (n_t > 0)
+    diff = np.nansum(today, axis=-1) / np.maximum(n_t, 1) - np.nansum(yesterday, axis=-1) / np.maximum(n_y, 1)
+    return np.where(ok & (diff <= -0.5), -20, np.where(ok & (diff >= 0.5), 10, 0))
+
+# score_days (1日分) と同じ計算を地点の軸に広げたもの
+# sds / wds は地点ごとの marine / forecast (レスポンスの dict または HourlySeries, 取得失敗は None)
+def score_points(sds, wds, date, lats, lons, hours=DAY_HOURS):
+    sds, wds = [as_series(sd) for sd in sds], [as_series(wd) for wd in wds]
+    sst = _hourly(sds, "sea_surface_temperature", utc_midnight(date - datetime.timedelta(days=1)), 48)
+    has_sst = (sst > 0).any(axis=-1)
+    use_historical = ~has_sst
+    trend = np.where(use_historical, 0, _trend_scores(sst))
+
+    r_temps = np.where(use_historical[:, None], HISTORICAL_TEMPS.get(date.month, 15.0), sst)
+    temps, prev = sst_at_hours(r_temps, OFF + hours)
+    tdiffs = np.where(use_historical[:, None], 0.0, temps - prev)
+    day_start = local_midnight(date)
+    clouds = np.nan_to_num(take_hours(_hourly(wds, "cloud_cover", day_start, 24), hours))
+    winds = np.nan_to_num(take_hours(_hourly(wds, "wind_speed_10m", day_start, 24), hours))
+    rains = np.nan_to_num(take_hours(_hourly(wds, "rain", day_start, 24), hours))
+
+    table = astronomy.get_table()
+    moon_age = int(table.moon_ages(date)[0])
+    sun_h = table.sunrise_hours(lats, lons, date)[:, 0].astype(int)
+
+    scores, _, _ = score_hours(hours, temps, tdiffs, clouds, winds, rains, moon_age, sun_h, trend, use_historical)
+
+    # 水深は地点ごとに海底地形から引く (無ければ最寄りエリアの水深). ネクタイは最高スコアの時刻のもの
+    fallback = [AREA_OPTIONS[_nearest_area(lat, lon)]["depth"] for lat, lon in zip(lats, lons)]
+    depths = bathymetry.depth_for(lats, lons, fallback)
+    best = scores.argmax(axis=-1)[:, None]
+    pick = lambda a: np.take_along_axis(a, best, axis=-1)[:, 0]
+    honmei = suggest_strategies(
+        hours[best[:, 0]], sun_h, pick(scores), pick(tdiffs), date.month, pick(temps), pick(clouds), pick(rains), depths,
+    )[0]
+    return {
+        "score": scores.astype(np.int16), "has_sst": has_sst, "use_historical": use_historical,
+        "depth": depths.astype(np.int16), "honmei": honmei,
+    }
+
+# キャッシュに無いタイルを全部まとめて取得し, 1回のベクトル計算でスコア化する
+# background=True なら裏の取得と同じ予算の枠で取る (利用者の予報の分を使い切らない). fetch=False なら取得せず平年値で埋める
+def _compute_tiles(tiles, date, step, fetch=True, background=True):
+    queries = [q for tile in tiles for q in tile_queries(tile, date, step)]
+    if fetch:
+        with metrics.timer("fetch", mode="grid"):
+            results = shards.fetch(queries, background=background)
+    else:
+        results = [([None] * len(q[3]), False) for q in queries]
+
+    sds, wds, lats, lons = [], [], [], []
+    for k, tile in enumerate(tiles):
+        sds += results[2 * k][0]
+        wds += results[2 * k + 1][0]
+        t_lats, t_lons = tile_points(tile, step)
+        lats += t_lats
+        lons += t_lons
+
+    with metrics.timer("score", mode="grid"):
+        scored = score_points(sds, wds, date, lats, lons)
+    n = TILE_POINTS * TILE_POINTS
+    shape = (TILE_POINTS, TILE_POINTS)
+    # 全シャードが揃って新鮮なタイルだけ期限を付ける (古いシャードは裏で取り直し中)
+    expires = lambda k: (
+        shards.fresh_until(queries[2 * k:2 * k + 2]) if results[2 * k][1] and results[2 * k + 1][1] else None
+    )
+    return {
+        tile: (
+            {name: value[k * n:(k + 1) * n].reshape(shape + value.shape[1:]) for name, value in scored.items()},
+            expires(k),
+        )
+        for k, tile in enumerate(tiles)
+    }
+
+# 範囲内の格子点のスコア. 結果の配列は (緯度, 経度[, 時間]) の順で, 緯度は南から
+# 陸地 (水温が取れない地点) は sea=False. 範囲全体で水温が無いとき (予報期間外・取得失敗) は平年値で全点を出す
+# 上流から取るタイルは cold_tiles まで (None なら全部), 取得は background なら予算の裏の枠で行う
+# pending は取得待ち (上限・予算で後回し, 取得失敗) で平年値などで埋めたタイルの数
+def score_grid(bbox, date, step=DEFAULT_STEP, width=3, cold_tiles=MAX_COLD_TILES, background=True):
+    tiles = tiles_for(bbox, step)
+    found = {tile: tile_cache.get((date, step, tile)) for tile in tiles}
+    missing = [tile for tile, value in found.items() if value is None]
+    pending = 0
+    if missing:
+        # 取得に失敗した・古いシャードを使ったタイルはキャッシュしない
+        computed = _compute_tiles(missing[:cold_tiles], date, step, background=background)
+        if cold_tiles is not None and missing[cold_tiles:]:
+            computed.update(_compute_tiles(missing[cold_tiles:], date, step, fetch=False))
+        for tile, (value, expires_at) in computed.items():
+            if expires_at is not None:
+                tile_cache.put((date, step, tile), value, expires_at)
+            else:
+                pending += 1
+            found[tile] = value
+
+    tis = sorted({ti for ti, _ in tiles})
+    tjs = sorted({tj for _, tj in tiles})
+    full = {
+        name: np.concatenate([
+            np.concatenate([found[(ti, tj)][name] for tj in tjs], axis=1) for ti in tis
+        ], axis=0)
+        for name in found[tiles[0]]
+    }
+    i0, i1 = _index_range(bbox[0], bbox[1], step)
+    j0, j1 = _index_range(bbox[2], bbox[3], step)
+    rows = slice(i0 - tis[0] * TILE_POINTS, i1 - tis[0] * TILE_POINTS + 1)
+    cols = slice(j0 - tjs[0] * TILE_POINTS, j1 - tjs[0] * TILE_POINTS + 1)
+    scores = full["score"][rows, cols]
+    sea = full["has_sst"][rows, cols] if full["has_sst"].any() else np.ones(scores.shape[:2], dtype=bool)
+
+    flat = scores.reshape(-1, scores.shape[-1])
+    start, window_score = best_windows(flat, width)
+    best = flat.argmax(axis=-1)
+    masked = lambda a: np.where(sea, a.reshape(sea.shape).astype(float), np.nan)
+    return {
+        "date": date,
+        "step": step,
+        "lats": np.array([_coord(i, step) for i in range(i0, i1 + 1)]),
+        "lons": np.array([_coord(j, step) for j in range(j0, j1 + 1)]),
+        "hours": DAY_HOURS,
+        "moon_age": int(astronomy.get_table().moon_ages(date)[0]),
+        "score": scores,
+        "sea": sea,
+        "use_historical": full["use_historical"][rows, cols],
+        "depth": full["depth"][rows, cols],
+        "honmei": full["honmei"][rows, cols],
+        "best_hour": masked(DAY_HOURS[best]),
+        "best_score": masked(flat.max(axis=-1)),
+        "window_start": masked(DAY_HOURS[start]),
+        "window_score": masked(window_score),
+        "width": min(width, len(DAY_HOURS)),
+        "pending": pending,
+    }
+
+# 時合い (width 時間平均) の高い順に海上の地点を並べる
+def top_spots(grid, top=5, areas=AREA_OPTIONS):
+    window_score = np.nan_to_num(grid["window_score"], nan=-1.0)
+    order = np.lexsort((-np.nan_to_num(grid["best_score"], nan=-1.0).ravel(), -window_score.ravel()))
+    spots = []
+    for flat in order[:top]:
+        i, j = np.unravel_index(flat, window_score.shape)
+        if not grid["sea"][i, j]:
+            break
+        lat, lon = float(grid["lats"][i]), float(grid["lons"][j])
+        start_h = int(grid["window_start"][i, j])
+        depth = int(grid["depth"][i, j])
+        spots.append({
+            "lat": lat,
+            "lon": lon,
+            "near": _nearest_area(lat, lon, areas),
+            "start_h": start_h,
+            "end_h": start_h + grid["width"] - 1,
+            "window_score": float(grid["window_score"][i, j]),
+            "max_score": int(grid["best_score"][i, j]),
+            "best_hour": int(grid["best_hour"][i, j]),
+            "depth": depth,
+            "sinker": get_sinker_weight(grid["moon_age"], depth)[1],
+            "honmei": grid["honmei"][i, j],
+        })
+    return spots
+
+# ヒートマップに重ねる既存エリアの位置
+def area_pins(areas=AREA_OPTIONS):
+    return [(a["lat"], a["lon"]) for a in areas.values()]
+
+# JSON にできる形 (陸地は null)
+def grid_report(grid, top=5):
+    as_list = lambda a: [[None if v != v else v for v in row] for row in np.asarray(a, dtype=float).round(3).tolist()]
+    return {
+        "date": grid["date"].isoformat(),
+        "step": grid["step"],
+        "moon_age": grid["moon_age"],
+        "tide_name": TIDE_CLASSES[int(tide_class(grid["moon_age"]))][0],
+        "lats": grid["lats"].tolist(),
+        "lons": grid["lons"].tolist(),
+        "best_hour": as_list(grid["best_hour"]),
+        "best_score": as_list(grid["best_score"]),
+        "window_score": as_list(grid["window_score"]),
+        "depth": [[d if sea else None for d, sea in zip(*row)] for row in zip(grid["depth"].tolist(), grid["sea"].tolist())],
+        "top": top_spots(grid, top),
+        "pending": grid["pending"],
+    }
+
+
+def _bbox(text):
+    values = [float(v) for v in text.split(",")]
+    if len(values) != 4:
+        raise argparse.ArgumentTypeError("南端,北端,西端,東端 の4つを指定してください")
+    return tuple(values)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="魔釣 海域マップ (格子点のスコアを JSON / PNG で出力)")
+    parser.add_argument("--region", choices=list(GRID_REGIONS), default=next(iter(GRID_REGIONS)))
+    parser.add_argument("--bbox", type=_bbox, help="範囲 南端,北端,西端,東端 (指定すると --region より優先)")
+    parser.add_argument("--date", type=datetime.date.fromisoformat, help="対象日 YYYY-MM-DD (省略時は明日)")
+    parser.add_argument("--step", type=float, default=DEFAULT_STEP, help="格子間隔 (度)")
+    parser.add_argument("--output", "-o", help="JSON の出力先 (省略時は標準出力)")
+    parser.add_argument("--png", help="ヒートマップ画像の出力先")
+    args = parser.parse_args(argv)
+
+    date = args.date or datetime.date.today() + datetime.timedelta(days=1)
+    # 1回きりの出力なので全タイルを取りきる
+    grid = score_grid(args.bbox or GRID_REGIONS[args.region], date, args.step, cold_tiles=None, background=False)
+    if args.png:
+        import charts
+        with open(args.png, "wb") as fp:
+            fp.write(charts.render_heatmap_png(grid, f"{date} (Moon:{grid['moon_age']})", area_pins()))
+    report = grid_report(grid)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, ensure_ascii=False)
+    elif not args.png:
+        json.dump(report, sys.stdout, ensure_ascii=False)
+        sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
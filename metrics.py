@@ -0,0 +1,223 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- 計測 (段階ごとの所要時間・上流の応答・キャッシュ) ---
+# 出力は構造化ログ (JSON) と Prometheus のテキスト形式
+PREFIX = "matsuri_"
+# 所要時間ヒストグラムの境界 (秒)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WRITE_INTERVAL = 15.0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, n=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    # fn() は (名前, 種類 "counter"/"gauge", ラベル dict, 値) を返す. 出力のたびに呼ぶ
+    def add_collector(self, fn):
+        with self._lock:
+            self._collectors.append(fn)
+
+    def _collect(self):
+        samples = []
+        for fn in list(self._collectors):
+            try:
+                samples.extend(fn())
+            except Exception as e:
+                logger.warning("metrics collector failed: %s", e)
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self._counters.items()
+            ]
+            histograms = [
+                {"name": name, "labels": dict(labels), "count": h["count"], "sum": h["sum"],
+                 "buckets": dict(zip(map(str, self.buckets), h["buckets"]))}
+                for (name, labels), h in self._histograms.items()
+            ]
+        gauges = [{"name": name, "type": kind, "labels": labels, "value": value} for name, kind, labels, value in self._collect()]
+        return {"counters": counters, "histograms": histograms, "collected": gauges}
+
+    # 同じ名前の系列 (カウンタとコレクタの両方から来るものも) は1つの族にまとめ, TYPE 行は族ごとに1回だけ出す
+    def render(self):
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [(k, {**h, "buckets": list(h["buckets"])}) for k, h in self._histograms.items()]
+        families = {}
+
+        def family(name, kind):
+            return families.setdefault(name, (kind, []))[1]
+
+        for (name, labels), value in counters:
+            family(name, "counter").append((labels, [f"{PREFIX}{name}{_labels(labels)} {_number(value)}"]))
+        for (name, labels), h in histograms:
+            lines = [
+                f"{PREFIX}{name}_bucket{_labels(labels, {'le': _number(float(bound))})} {n}"
+                for bound, n in zip(self.buckets, h["buckets"])
+            ]
+            lines.append(f"{PREFIX}{name}_bucket{_labels(labels, {'le': '+Inf'})} {h['count']}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {_number(h['sum'])}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {h['count']}")
+            family(name, "histogram").append((labels, lines))
+        for name, kind, labels, value in self._collect():
+            labels = tuple(sorted((k, str(v)) for k, v in labels.items()))
+            family(name, kind).append((labels, [f"{PREFIX}{name}{_labels(labels)} {_number(value)}"]))
+
+        out = []
+        for name, (kind, samples) in sorted(families.items()):
+            out.append(f"# TYPE {PREFIX}{name} {kind}")
+            for _, lines in sorted(samples, key=lambda s: s[0]):
+                out.extend(lines)
+        return "\n".join(out) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+registry = Registry()
+
+
+def inc(name, n=1, **labels):
+    registry.inc(name, n, **labels)
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+def add_collector(fn):
+    registry.add_collector(fn)
+
+# 構造化ログ (1行1 JSON). ロガーが INFO 以上で有効なときだけ組み立てる
+def log_event(event, **fields):
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, ensure_ascii=False, default=str))
+
+# 段階ごとの所要時間. 例外で抜けた場合はエラーとしても数える
+@contextlib.contextmanager
+def timer(stage, **labels):
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        elapsed = time.perf_counter() - started
+        observe("stage_seconds", elapsed, stage=stage, **labels)
+        if not ok:
+            inc("stage_errors_total", stage=stage, **labels)
+        log_event("stage", stage=stage, seconds=round(elapsed, 6), ok=ok, **labels)
+
+
+# --- 出力 (テキストファイル / HTTP) ---
+# node_exporter の textfile collector などで読めるよう, 書き換えは置き換えで行う
+def write_textfile(path, reg=None):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fp:
+        fp.write((reg or registry).render())
+    os.replace(tmp, path)
+
+# http.server は起動時に読み込まない (アプリの起動を遅くしないため)
+def start_http_server(port, host="127.0.0.1", reg=None):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    reg = reg or registry
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body, ctype = reg.render().encode(), "text/plain; version=0.0.4; charset=utf-8"
+            elif path == "/metrics.json":
+                body, ctype = json.dumps(reg.snapshot(), ensure_ascii=False).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="matsuri-metrics", daemon=True).start()
+    return server
+
+def start_textfile_writer(path, interval=WRITE_INTERVAL):
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                write_textfile(path)
+            except OSError as e:
+                logger.warning("metrics file write failed: %s", e)
+
+    threading.Thread(target=run, name="matsuri-metrics-file", daemon=True).start()
+    return stop
+
+# MATSURI_METRICS_PORT で HTTP (/metrics, /metrics.json), MATSURI_METRICS_FILE でテキストファイルに出す
+def from_env():
+    started = {}
+    port = os.environ.get("MATSURI_METRICS_PORT")
+    if port:
+        host = os.environ.get("MATSURI_METRICS_HOST", "127.0.0.1")
+        try:
+            started["server"] = start_http_server(int(port), host)
+        except OSError as e:
+            logger.warning("metrics server not started on %s:%s: %s", host, port, e)
+    path = os.environ.get("MATSURI_METRICS_FILE")
+    if path:
+        started["writer"] = start_textfile_writer(path, float(os.environ.get("MATSURI_METRICS_INTERVAL", WRITE_INTERVAL)))
+    return started
@@ -0,0 +1,56 @@
+import datetime
+
+from series import JST
+
+# --- 上流モデルの更新予定 (キャッシュの期限をモデルの実行に合わせる) ---
+# Open-Meteo の値はモデルの実行 (run) が公開されたときにしか変わらない
+# 固定 TTL で取り直すと同じ値を何度も取るので, 次の run が公開されるまでを新鮮とみなす
+HOUR = 3600
+DAY = 24 * HOUR
+# 種類ごとの (実行の周期, 実行から公開までの遅れ) 秒. 実行は UTC 0時から周期ごと
+RUNS = {
+    # 水温・波浪 (MeteoFrance / ECMWF WAM) は 00/12 UTC の実行が数時間後に届く
+    "marine": (12 * HOUR, 6 * HOUR),
+    # 日本付近の天気は JMA MSM (3時間ごと) が主
+    "forecast": (3 * HOUR, 2 * HOUR),
+}
+# 公開が予定より遅れることがある. 公開予定からこの秒数以内に取ったデータは, この時点で取り直す (従来の TTL)
+GRACE = HOUR
+# 種類が分からない URL の新鮮な期間
+DEFAULT_TTL = HOUR
+# 値のある日の範囲 (今日から). 応答に値のある日が1日も無いときの目安
+HORIZON_DAYS = {"marine": 8, "forecast": 16}
+# 日の区切り (API の start_date / end_date と同じ)
+TIMEZONES = {"marine": datetime.timezone.utc, "forecast": JST}
+
+
+# now の時点で最後に公開された run の公開時刻
+def last_update(kind, now):
+    period, delay = RUNS[kind]
+    return (now - delay) // period * period + delay
+
+def next_update(kind, now):
+    return last_update(kind, now) + RUNS[kind][0]
+
+# fetched_at に取ったデータが新鮮でなくなる時刻
+# lead_days は値の無い日 (予報範囲外) が範囲に入るまでの日数. 範囲は1日に1日ずつ延びるので, その手前までは取り直さない
+def expires_at(kind, fetched_at, lead_days=0):
+    if kind not in RUNS:
+        return fetched_at + DEFAULT_TTL
+    if lead_days > 1:
+        return next_update(kind, fetched_at + (lead_days - 1) * DAY)
+    published = last_update(kind, fetched_at)
+    if fetched_at < published + GRACE:
+        return published + GRACE
+    return next_update(kind, fetched_at)
+
+# 値の無い日 day が範囲に入るまでの日数. last_day は同じ応答で値のあった最後の日 (無ければ None)
+def lead_days(kind, day, last_day, fetched_at):
+    if last_day is None:
+        today = datetime.datetime.fromtimestamp(fetched_at, TIMEZONES[kind]).date()
+        last_day = today + datetime.timedelta(days=HORIZON_DAYS[kind] - 1)
+    return (day - last_day).days
+
+# いずれかの種類で, 今取ったデータが古くなる最初の時刻 (先読みの次の実行時刻)
+def next_change(now):
+    return min(expires_at(kind, now) for kind in RUNS)
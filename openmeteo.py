@@ -0,0 +1,592 @@
+import datetime
+import gzip
+import http.client
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import ssl
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import cache
+import metrics
+import model_runs
+
+logger = logging.getLogger(__name__)
+
+# --- Open-Meteo エンドポイント ---
+# ベンチマーク・負荷試験ではローカルのスタブに向ける
+MARINE_URL = os.environ.get("MATSURI_MARINE_URL", "https://marine-api.open-meteo.com/v1/marine")
+FORECAST_URL = os.environ.get("MATSURI_FORECAST_URL", "https://api.open-meteo.com/v1/forecast")
+ARCHIVE_URL = os.environ.get("MATSURI_ARCHIVE_URL", "https://archive-api.open-meteo.com/v1/archive")
+
+# 予報APIが返せる最大日数
+MAX_FORECAST_DAYS = 16
+# 明日から数える期間 (ベスト日) は今日の分を除いた日数まで
+MAX_RANGE_DAYS = MAX_FORECAST_DAYS - 1
+
+
+# 複数地点はカンマ区切りで1リクエストにまとめる
+def _coords(values):
+    if isinstance(values, (list, tuple)):
+        return ",".join(str(v) for v in values)
+    return values
+
+# 水温は GMT の日単位で first_day〜last_day を取る
+def marine_days_url(first_day, last_day, lat, lon):
+    params = {
+        "latitude": _coords(lat),
+        "longitude": _coords(lon),
+        "hourly": "sea_surface_temperature",
+        "start_date": first_day.strftime("%Y-%m-%d"),
+        "end_date": last_day.strftime("%Y-%m-%d"),
+    }
+    return f"{MARINE_URL}?{urllib.parse.urlencode(params)}"
+
+# 水温は前日分から取得する (前日比の算出用, 時刻は GMT)
+def marine_url(start_date, end_date, lat, lon):
+    return marine_days_url(start_date - datetime.timedelta(days=1), end_date, lat, lon)
+
+def forecast_url(start_date, end_date, lat, lon):
+    params = {
+        "latitude": _coords(lat),
+        "longitude": _coords(lon),
+        "hourly": "cloud_cover,wind_speed_10m,rain",
+        "start_date": start_date.strftime("%Y-%m-%d"),
+        "end_date": end_date.strftime("%Y-%m-%d"),
+        "timezone": "Asia/Tokyo",
+    }
+    return f"{FORECAST_URL}?{urllib.parse.urlencode(params)}"
+
+# 過去の天気 (バックテスト用). 予報と同じ項目を日本時間で取る
+def archive_url(start_date, end_date, lat, lon):
+    params = {
+        "latitude": _coords(lat),
+        "longitude": _coords(lon),
+        "hourly": "cloud_cover,wind_speed_10m,rain",
+        "start_date": start_date.strftime("%Y-%m-%d"),
+        "end_date": end_date.strftime("%Y-%m-%d"),
+        "timezone": "Asia/Tokyo",
+    }
+    return f"{ARCHIVE_URL}?{urllib.parse.urlencode(params)}"
+
+# 期間とエリア群に対する (marine, forecast) のURL組. UI と先読みで同じキーになる
+def window_urls(start_date, days, areas):
+    end_date = start_date + datetime.timedelta(days=days - 1)
+    lats = [a["lat"] for a in areas.values()]
+    lons = [a["lon"] for a in areas.values()]
+    return marine_url(start_date, end_date, lats, lons), forecast_url(start_date, end_date, lats, lons)
+
+# 複数地点のレスポンス (配列) を地点ごとに分ける, 失敗時は全地点 None
+def split_locations(data, n):
+    if data is None:
+        return [None] * n
+    if isinstance(data, dict):
+        data = [data]
+    if len(data) != n:
+        raise ValueError(f"expected {n} locations, got {len(data)}")
+    return list(data)
+
+# --- HTTP 取得 (接続プール・タイムアウト・リトライ) ---
+USER_AGENT = "Mozilla/5.0 (App; CPU iPhone OS 15_0)"
+CONNECT_TIMEOUT = 3.0
+READ_TIMEOUT = 10.0
+MAX_RETRIES = 2
+BACKOFF = 0.5
+BACKOFF_MAX = 4.0
+POOL_SIZE = 8
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    def __init__(self, url, message):
+        super().__init__(f"{message} ({url})")
+        self.url = url
+
+class FetchTimeout(FetchError):
+    pass
+
+class UpstreamError(FetchError):
+    def __init__(self, url, status, reason=""):
+        super().__init__(url, f"HTTP {status} {reason}".strip())
+        self.status = status
+
+class ResponseError(FetchError):
+    pass
+
+
+def _ssl_context():
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+# ホストごとに keep-alive 接続を使い回す
+class ConnectionPool:
+    def __init__(self, maxsize=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        self.maxsize = maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.ssl_context = _ssl_context()
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _new_conn(self, scheme, netloc):
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(netloc, timeout=self.connect_timeout, context=self.ssl_context)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def _get(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._new_conn(*key), False
+
+    def _put(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        conn, reused = self._get(key)
+        try:
+            try:
+                conn.request("GET", path, headers=headers)
+                res = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                # 相手が閉じた keep-alive 接続は一度だけ張り直す
+                if not reused:
+                    raise
+                conn.close()
+                conn = self._new_conn(*key)
+                conn.request("GET", path, headers=headers)
+                res = conn.getresponse()
+            body = res.read()
+        except BaseException:
+            conn.close()
+            raise
+        if res.will_close:
+            conn.close()
+        else:
+            self._put(key, conn)
+        return res.status, res.headers, body
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+_pool = ConnectionPool()
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="openmeteo")
+
+
+def _decode(url, status, headers, body):
+    try:
+        if headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        data = json.loads(body.decode())
+    except (OSError, ValueError) as e:
+        if status != 200:
+            raise UpstreamError(url, status) from e
+        raise ResponseError(url, f"invalid response: {e}") from e
+    if status != 200:
+        reason = data.get("reason", "") if isinstance(data, dict) else ""
+        raise UpstreamError(url, status, reason)
+    return data
+
+def _retry_wait(attempt, headers=None):
+    retry_after = headers.get("Retry-After") if headers else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_MAX)
+    return min(BACKOFF * 2 ** attempt, BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+# 上流1回ごとの所要時間と結果 (HTTP ステータス / timeout / connection_error)
+def _observe(url, outcome, started):
+    host = urllib.parse.urlsplit(url).netloc
+    elapsed = time.perf_counter() - started
+    metrics.observe("upstream_request_seconds", elapsed, host=host)
+    metrics.inc("upstream_requests_total", host=host, outcome=outcome)
+    metrics.log_event("upstream", host=host, outcome=outcome, seconds=round(elapsed, 6))
+
+# budget (RequestBudget) を渡すと, リトライを含めて上流に投げるたびに使う
+def fetch_json(url, retries=MAX_RETRIES, pool=None, budget=None, background=False):
+    pool = pool or _pool
+    headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "gzip", "Connection": "keep-alive"}
+    for attempt in range(retries + 1):
+        last = attempt == retries
+        if budget is not None:
+            budget.acquire(url, background)
+        started = time.perf_counter()
+        try:
+            status, res_headers, body = pool.request(url, headers)
+        except (socket.timeout, TimeoutError) as e:
+            _observe(url, "timeout", started)
+            if last: raise FetchTimeout(url, "timed out") from e
+            wait = _retry_wait(attempt)
+        except (OSError, http.client.HTTPException) as e:
+            _observe(url, "connection_error", started)
+            if last: raise FetchError(url, f"connection failed: {e}") from e
+            wait = _retry_wait(attempt)
+        else:
+            _observe(url, str(status), started)
+            if status not in RETRY_STATUS or last:
+                return _decode(url, status, res_headers, body)
+            wait = _retry_wait(attempt, res_headers)
+        metrics.inc("upstream_retries_total", host=urllib.parse.urlsplit(url).netloc)
+        logger.warning("retrying %s in %.2fs (attempt %d/%d)", url, wait, attempt + 1, retries)
+        time.sleep(wait)
+
+# --- 同一URLの同時取得をまとめる (single-flight) ---
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    # 最初の呼び出しだけ fn を実行し, 同時に来た呼び出しはその結果を待つ
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+
+# --- サーキットブレーカー (ホスト単位) ---
+class CircuitOpen(FetchError):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, threshold=5, cooldown=60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    # 遮断中は上流に投げずに失敗させる. 冷却後は1件だけ試しに通す (half-open)
+    def call(self, url, fn):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            state = self._hosts.setdefault(host, {"failures": 0, "opened_at": None, "trial": False})
+            if state["opened_at"] is not None:
+                if state["trial"] or time.monotonic() - state["opened_at"] < self.cooldown:
+                    metrics.inc("upstream_circuit_rejections_total", host=host)
+                    raise CircuitOpen(url, f"circuit open for {host}")
+                state["trial"] = True
+        try:
+            result = fn()
+        except BudgetExceeded:
+            # 予算で止めた分は上流の成否が分からないので数えない
+            with self._lock:
+                state["trial"] = False
+            raise
+        except FetchError as e:
+            # 4xx はリクエスト側の問題なので上流の障害として数えない
+            self._record(host, ok=isinstance(e, UpstreamError) and e.status not in RETRY_STATUS)
+            raise
+        self._record(host, ok=True)
+        return result
+
+    def _record(self, host, ok):
+        with self._lock:
+            state = self._hosts[host]
+            state["trial"] = False
+            if ok:
+                state["failures"] = 0
+                state["opened_at"] = None
+                return
+            state["failures"] += 1
+            if state["failures"] >= self.threshold:
+                if state["opened_at"] is None:
+                    logger.warning("circuit opened for %s after %d failures", host, state["failures"])
+                state["opened_at"] = time.monotonic()
+
+    def is_open(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            state = self._hosts.get(host)
+            return bool(state and state["opened_at"] is not None)
+
+
+# --- 呼び出しの予算 (Open-Meteo の分・時・日ごとの上限の手前で裏の取得を止める) ---
+# 多地点・多項目・長期間のリクエストは複数回と数えられる (地点数 x 項目数/10 x 日数/14)
+# 上限はプロセスごと. レプリカを増やすときは MATSURI_BUDGET で頭数に分ける ("600/60,5000/3600,10000/86400")
+BUDGET_LIMITS = {60: 600, 3600: 5000, 86400: 10000}
+# 裏の取り直し・先読みは上限のこの割合までで止め, 残りを利用者の取得に残す
+BACKGROUND_SHARE = 0.8
+
+
+class BudgetExceeded(FetchError):
+    pass
+
+# 1リクエストが何回分と数えられるか
+def call_cost(url):
+    params = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    locations = len(params.get("latitude", [""])[0].split(","))
+    variables = sum(len(params[name][0].split(",")) for name in ("hourly", "daily") if name in params)
+    if "start_date" in params and "end_date" in params:
+        days = (datetime.date.fromisoformat(params["end_date"][0]) - datetime.date.fromisoformat(params["start_date"][0])).days + 1
+    else:
+        days = int(params.get("forecast_days", ["7"])[0])
+    return locations * max(1.0, variables / 10) * max(1.0, days / 14)
+
+class RequestBudget:
+    # limits は {窓の秒数: 回数}. 空なら数えるだけで止めない
+    def __init__(self, limits=BUDGET_LIMITS, background_share=BACKGROUND_SHARE):
+        self.limits = dict(limits)
+        self.background_share = background_share
+        self._windows = {window: [deque(), 0.0] for window in self.limits}
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        for window, entry in self._windows.items():
+            calls = entry[0]
+            while calls and calls[0][0] <= now - window:
+                entry[1] -= calls.popleft()[1]
+
+    def _over(self, cost, share):
+        return any(used + cost > self.limits[window] * share for window, (_, used) in self._windows.items())
+
+    # 予算を使う. 裏の取得は上限の background_share を超えるなら BudgetExceeded (次回に回す)
+    # 利用者の取得は止めない (数えるだけ. 上限を超えたら上流の 429 とリトライに任せる)
+    def acquire(self, url, background=False):
+        cost = call_cost(url)
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            over = self._over(cost, self.background_share if background else 1.0)
+            if not (background and over):
+                for entry in self._windows.values():
+                    entry[0].append((now, cost))
+                    entry[1] += cost
+        if over:
+            metrics.inc("upstream_budget_total", outcome="deferred" if background else "over_limit")
+            if background:
+                raise BudgetExceeded(url, "request budget reserved for users")
+        metrics.inc("upstream_budget_spent_total", cost)
+        return cost
+
+    # 窓ごとの (使った回数, 上限)
+    def usage(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            return {window: (used, self.limits[window]) for window, (_, used) in self._windows.items()}
+
+    def samples(self):
+        return [
+            sample
+            for window, (used, limit) in self.usage().items()
+            for sample in (
+                ("upstream_budget_used", "gauge", {"window": str(window)}, used),
+                ("upstream_budget_limit", "gauge", {"window": str(window)}, limit),
+            )
+        ]
+
+# MATSURI_BUDGET は "回数/秒数" のカンマ区切り. "0" で止めない
+def budget_from_env():
+    value = os.environ.get("MATSURI_BUDGET")
+    if value is None:
+        return RequestBudget()
+    if value.strip() in ("", "0"):
+        return RequestBudget({})
+    limits = {}
+    try:
+        for part in value.split(","):
+            calls, sep, window = part.partition("/")
+            if not sep or int(window) <= 0 or not float(calls) > 0:
+                raise ValueError(part)
+            limits[int(window)] = float(calls)
+    except ValueError:
+        # 書き間違いで起動できなくならないよう, 既定の予算で続ける
+        logger.warning("invalid MATSURI_BUDGET %r (expected e.g. \"600/60,5000/3600\"), using defaults", value)
+        return RequestBudget()
+    return RequestBudget(limits)
+
+
+_flight = SingleFlight()
+_breaker = CircuitBreaker()
+_budget = budget_from_env()
+
+# --- 永続キャッシュ経由の取得 (stale-while-revalidate) ---
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+
+def get_disk_cache():
+    global _disk_cache
+    with _disk_cache_lock:
+        if _disk_cache is None:
+            # 開けない (権限・壊れたファイルなど) ときは永続キャッシュ無しで続ける
+            try:
+                _disk_cache = cache.from_env() or False
+            except (sqlite3.Error, OSError) as e:
+                logger.warning("disk cache unavailable, continuing without it: %s", e)
+                _disk_cache = False
+    return _disk_cache or None
+
+# None を渡すと永続キャッシュを使わない
+def set_disk_cache(disk):
+    global _disk_cache
+    with _disk_cache_lock:
+        _disk_cache = disk or False
+
+# 永続キャッシュの件数・容量とヒット/ミス/追い出しを出力時に集める
+def _cache_samples():
+    disk = _disk_cache or None
+    if disk is None:
+        return []
+    stats = disk.stats()
+    labels = {"cache": "disk"}
+    return [
+        ("cache_hits_total", "counter", {**labels, "state": "fresh"}, stats["hits"]),
+        ("cache_hits_total", "counter", {**labels, "state": "stale"}, stats["stale_hits"]),
+        ("cache_misses_total", "counter", labels, stats["misses"]),
+        ("cache_sets_total", "counter", labels, stats["sets"]),
+        ("cache_evictions_total", "counter", labels, stats["evictions"]),
+        ("cache_entries", "gauge", labels, stats["entries"]),
+        ("cache_bytes", "gauge", labels, stats["bytes"]),
+    ]
+
+def _budget_samples():
+    return _budget.samples()
+
+def _breaker_samples():
+    with _breaker._lock:
+        hosts = {host: state["opened_at"] is not None for host, state in _breaker._hosts.items()}
+    return [("upstream_circuit_open", "gauge", {"host": host}, int(is_open)) for host, is_open in hosts.items()]
+
+metrics.add_collector(_cache_samples)
+metrics.add_collector(_breaker_samples)
+metrics.add_collector(_budget_samples)
+
+# URL の種類 (model_runs.RUNS のキー). 分からなければ None
+def url_kind(url):
+    if url.startswith(MARINE_URL):
+        return "marine"
+    if url.startswith(FORECAST_URL):
+        return "forecast"
+    return None
+
+# URL 単位の値も種類ごとのモデル更新に合わせて期限を付ける
+def _store(url, value, disk):
+    if disk is None:
+        return
+    now = time.time()
+    try:
+        disk.set(url, value, now, model_runs.expires_at(url_kind(url), now))
+    except sqlite3.Error as e:
+        logger.warning("disk cache write failed: %s", e)
+
+# 同じURLの取得は1本にまとめ, 予算とブレーカーを通して上流へ投げる
+# background は裏の取り直し・先読み (予算の残りが少なければ BudgetExceeded)
+def _fetch_and_store(url, disk, background=False):
+    def run():
+        value = _breaker.call(url, lambda: fetch_json(url, budget=_budget, background=background))
+        _store(url, value, disk)
+        return value
+    return _flight.do(url, run)
+
+def _revalidate(url, disk):
+    if _flight.in_flight(url):
+        return
+
+    def run():
+        try:
+            _fetch_and_store(url, disk, background=True)
+        except BudgetExceeded as e:
+            logger.info("revalidation deferred: %s", e)
+        except FetchError as e:
+            logger.warning("revalidation failed: %s", e)
+
+    _executor.submit(run)
+
+# 上流が落ちているときは期限切れでも最後に取れたデータを返す
+def _last_known_good(url, disk, error):
+    if disk is not None:
+        try:
+            value, age = disk.peek(url)
+        except sqlite3.Error:
+            value = None
+        if value is not None:
+            metrics.inc("upstream_fallbacks_total", kind="last_known_good")
+            logger.warning("serving last known good data (%.0fs old): %s", age, error)
+            return value
+    raise error
+
+# 新鮮ならキャッシュ, 古ければキャッシュを返しつつ裏で再取得, 無ければ取得して保存
+def get_json(url, disk=None):
+    disk = disk or get_disk_cache()
+    state = cache.MISS
+    if disk is not None:
+        try:
+            value, state = disk.get(url)
+        except sqlite3.Error as e:
+            logger.warning("disk cache read failed: %s", e)
+    if state == cache.FRESH:
+        return value
+    if state == cache.STALE:
+        _revalidate(url, disk)
+        return value
+
+    try:
+        return _fetch_and_store(url, disk)
+    except FetchError as e:
+        return _last_known_good(url, disk, e)
+
+# URL 単位の永続キャッシュを通さずに取得する (同時取得のまとめ・予算・ブレーカーは通す)
+def fetch_live(url, background=False):
+    return _fetch_and_store(url, None, background)
+
+# 複数URLを並列に取得する, 失敗したURLは例外オブジェクトを返す
+# cached=False なら URL 単位のキャッシュを使わない (日ごとのシャードに分けて持つ場合)
+def fetch_all(urls, cached=True, background=False):
+    futures = [
+        _executor.submit(get_json, url) if cached else _executor.submit(fetch_live, url, background) for url in urls
+    ]
+    results = []
+    for f in futures:
+        try:
+            results.append(f.result())
+        except FetchError as e:
+            metrics.inc("upstream_errors_total", kind=type(e).__name__)
+            if isinstance(e, BudgetExceeded) and background:
+                logger.info("fetch deferred: %s", e)
+            else:
+                logger.warning("fetch failed: %s", e)
+            results.append(e)
+    return results
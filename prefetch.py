@@ -0,0 +1,137 @@
+import datetime
+import logging
+import os
+import threading
+import time
+
+import metrics
+import model_runs
+import openmeteo
+import shards
+
+logger = logging.getLogger(__name__)
+
+# --- 先読み (バックグラウンドでキャッシュを温める) ---
+# 上流モデルの次の公開に合わせて起き, 期限の切れたシャードだけ取り直す (interval は最長の間隔)
+DAYS = 7
+RANGE_DAYS = 14
+INTERVAL = 900
+# 公開直後に一斉に取りに行かないよう少し遅らせる
+WAKE_DELAY = 60
+
+
+class Warmer:
+    # areas はUIと同じエリア辞書を全部渡す (UI と同じ地点の組で取る)
+    def __init__(self, areas, days=DAYS, range_days=RANGE_DAYS, interval=INTERVAL):
+        self.areas = areas
+        # 予報の取れる範囲を超える日は上流がエラーを返すので切り詰める
+        self.days = min(days, openmeteo.MAX_FORECAST_DAYS)
+        self.range_days = min(range_days, openmeteo.MAX_RANGE_DAYS)
+        self.interval = interval
+        self.last_success = {name: None for name in areas}
+        self.last_error = {name: None for name in areas}
+        self._stop = threading.Event()
+        self._thread = None
+        self._collecting = False
+
+    # 今日から days 日分の1日予報と, 明日からの range_days 日ランキング
+    def windows(self, today=None):
+        today = today or datetime.date.today()
+        windows = [(today + datetime.timedelta(days=k), 1) for k in range(self.days)]
+        if self.range_days:
+            windows.append((today + datetime.timedelta(days=1), self.range_days))
+        return windows
+
+    # 全期間に要る日を種類ごとに1つの区間にまとめる (期間どうしの重なりは1回だけ取る)
+    def queries(self, today=None):
+        lats = [a["lat"] for a in self.areas.values()]
+        lons = [a["lon"] for a in self.areas.values()]
+        spans = {}
+        for start_date, days in self.windows(today):
+            for kind, first, last, _, _ in shards.window_queries(start_date, days, lats, lons):
+                lo, hi = spans.get(kind, (first, last))
+                spans[kind] = (min(lo, first), max(hi, last))
+        return [(kind, first, last, lats, lons) for kind, (first, last) in spans.items()]
+
+    # 取ったシャードを置いておけるか (永続キャッシュが無ければプロセス内の LRU に全部収まるか)
+    def _can_keep(self, queries):
+        if openmeteo.get_disk_cache() is not None:
+            return True
+        needed = sum(len(lats) * ((last - first).days + 1) for _, first, last, lats, _ in queries)
+        return needed <= shards.shard_cache.max_entries
+
+    # 期限の切れたシャードだけ取り直す (他プロセスの先読みが済んだ日は飛ばす)
+    # 結果を置いておけないときは上流を叩いても捨てるだけなので温めない
+    def refresh_once(self, today=None):
+        queries = self.queries(today)
+        if not self._can_keep(queries):
+            logger.info("prefetch skipped: no disk cache and the shard cache is too small")
+            return False
+        failed, deferred = shards.refresh(queries)
+        now = time.time()
+        # 取れなかった job に入っている地点. 次回に回しただけの地点はエラーにはしない
+        failed_at = {loc for job, _ in failed for loc in zip(job[3], job[4])}
+        deferred_at = {loc for job in deferred for loc in zip(job[3], job[4])}
+        errors = "; ".join(str(e) for _, e in failed)
+        for name, area in self.areas.items():
+            loc = (area["lat"], area["lon"])
+            if loc in failed_at:
+                self.last_error[name] = (now, errors)
+            elif loc not in deferred_at:
+                self.last_success[name] = now
+        for _, e in failed:
+            logger.warning("prefetch failed: %s", e)
+        return not failed and not deferred
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            # 想定外の例外でスレッドが止まると以後ずっと温めなくなるので, 記録して次の回に進む
+            try:
+                with metrics.timer("prefetch"):
+                    self.refresh_once()
+                logger.info("prefetch done in %.1fs", time.monotonic() - started)
+            except Exception:
+                logger.exception("prefetch pass failed")
+            self._stop.wait(min(self.interval, max(model_runs.next_change(time.time()) - time.time(), 0) + WAKE_DELAY))
+
+    def start(self):
+        if not self._collecting:
+            self._collecting = True
+            metrics.add_collector(self.samples)
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="matsuri-prefetch", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        return {
+            name: {"last_success": self.last_success[name], "last_error": self.last_error[name]}
+            for name in self.areas
+        }
+
+    # エリアごとの最後の成功・失敗の時刻 (UNIX 秒). まだ無いエリアは出さない
+    def samples(self):
+        out = []
+        for name in self.areas:
+            if self.last_success[name] is not None:
+                out.append(("prefetch_last_success_seconds", "gauge", {"area": name}, self.last_success[name]))
+            if self.last_error[name] is not None:
+                out.append(("prefetch_last_error_seconds", "gauge", {"area": name}, self.last_error[name][0]))
+        return out
+
+    # MATSURI_PREFETCH=0 で無効
+    @classmethod
+    def from_env(cls, areas):
+        if os.environ.get("MATSURI_PREFETCH", "1") == "0":
+            return None
+        return cls(
+            areas,
+            days=int(os.environ.get("MATSURI_PREFETCH_DAYS", DAYS)),
+            range_days=int(os.environ.get("MATSURI_PREFETCH_RANGE_DAYS", RANGE_DAYS)),
+            interval=float(os.environ.get("MATSURI_PREFETCH_INTERVAL", INTERVAL)),
+        )
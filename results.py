@@ -0,0 +1,63 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# --- 計算結果のメモ化 (プロセス全体で共有する LRU) ---
+# key は (モード, エリア, 日付, 水深, 上流データのバージョン) など. 同じ入力なら再計算しない
+MAX_RESULTS = 256
+
+
+# 上流データのバージョン文字列. データが更新されればキーが変わる
+# HourlySeries は持っている version を使う (中身を直列化し直さない)
+def data_version(*values):
+    blob = json.dumps(values, separators=(",", ":"), sort_keys=True, default=lambda o: getattr(o, "version", str(o))).encode()
+    return hashlib.sha1(blob).hexdigest()[:16]
+
+
+class ResultCache:
+    # name は計測のラベル (cache="...")
+    def __init__(self, max_entries=MAX_RESULTS, name="result"):
+        self.max_entries = max_entries
+        self.name = name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # 無ければ compute() の結果を保存して返す. 返した値は呼び出し側で書き換えない
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def samples(self):
+        labels = {"cache": self.name}
+        with self._lock:
+            return [
+                ("cache_hits_total", "counter", labels, self.hits),
+                ("cache_misses_total", "counter", labels, self.misses),
+                ("cache_evictions_total", "counter", labels, self.evictions),
+                ("cache_entries", "gauge", labels, len(self._entries)),
+            ]
+
+
+result_cache = ResultCache()
+metrics.add_collector(result_cache.samples)
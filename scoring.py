@@ -0,0 +1,283 @@
+import functools
+import itertools
+import math
+
+import numpy as np
+
+import astronomy
+
+# --- 判定ロジック (Streamlit 非依存) ---
+STANDARD_SINKERS = [30, 45, 60, 80, 100, 120, 150, 180, 200]
+
+
+# 正午(日本時間)の月齢. 潮回りの判定に使うので整数で返す
+def get_moon_age(date):
+    return int(astronomy.moon_age(date))
+
+# --- 潮回りとオモリ (表引き) ---
+# 月齢 (15日周期) の区分ごとの潮名と, 水深に掛けるオモリ倍率
+TIDE_CLASSES = [("大潮(激)", 2.0, 2.5), ("中潮(速)", 1.5, 2.0), ("小潮(緩)", 1.0, 1.5)]
+_TIDE_NAMES = np.array([c[0] for c in TIDE_CLASSES], dtype=object)
+_TIDE_MULTS = np.array([c[1:] for c in TIDE_CLASSES])
+# 隣り合う標準オモリの中間値. ちょうど中間なら軽い方になる (min と同じ)
+_SINKER_MIDS = (np.array(STANDARD_SINKERS[:-1]) + np.array(STANDARD_SINKERS[1:])) / 2
+_SINKER_LABELS = np.array(
+    [[f"{a}g" if a == b else f"{a}g〜{b}g" for b in STANDARD_SINKERS] for a in STANDARD_SINKERS], dtype=object
+)
+
+
+def tide_class(moon_age):
+    age_norm = np.asarray(moon_age) % 15
+    return np.where((age_norm <= 2) | (age_norm >= 13), 0,
+                    np.where(((3 <= age_norm) & (age_norm <= 5)) | ((10 <= age_norm) & (age_norm <= 12)), 1, 2))
+
+# 月齢×水深の配列をまとめて (潮名, オモリ表記) にする
+def sinker_weights(moon_age, depth):
+    cls = tide_class(moon_age)
+    depth = np.asarray(depth)
+    i_min = np.searchsorted(_SINKER_MIDS, depth * _TIDE_MULTS[cls, 0])
+    i_max = np.searchsorted(_SINKER_MIDS, depth * _TIDE_MULTS[cls, 1])
+    i_min = np.minimum(i_min, i_max)
+    labels = np.asarray(_SINKER_LABELS[i_min, i_max], dtype=object)
+    return np.broadcast_to(np.asarray(_TIDE_NAMES[cls], dtype=object), labels.shape), labels
+
+@functools.lru_cache(maxsize=4096)
+def get_sinker_weight(moon_age, depth):
+    names, labels = sinker_weights(moon_age, depth)
+    return names.item(), labels.item()
+
+def estimate_tide(moon_age, hour):
+    base_high = 8.5; delay = 0.8
+    high_tide = (base_high + (moon_age % 15) * delay) % 12
+    diff = abs(hour - high_tide)
+    if diff > 6: diff = 12 - diff
+    level = math.cos(diff * (math.pi / 6))
+    is_slack = (diff < 1.0 or abs(diff - 6.0) < 1.0)
+    return level, is_slack
+
+# 抑えパターン (本命のカラー・形状 → 抑え)
+OSAE_COLORS = {
+    "チャート": "オレ金", "ソリッドレッド": "チャート", "赤ゼブラ": "オレンジ", "ミドキン": "オレ金",
+    "オレ金": "ピンク", "マジョーラゼブラ": "ピンク", "ピンク": "赤オレ", "コーラ": "赤黒", "赤黒": "コーラ",
+    "黒/海苔": "コーラ", "赤オレ": "マジョーラゼブラ", "オレンジ": "赤オレ", "オレンジゼブラ": "赤黒", "グリーン": "ミドキン",
+}
+OSAE_SHAPES = {"ロングカーリー": "ショート", "ワイドカーリー": "カーリー", "強波動": "ショート", "ショート": "極細", "ストレート": "ショート"}
+
+
+def suggest_strategy(h, sun_h, sc, t_diff, month, temp, cloud_cover, rain, depth):
+    c1 = "赤オレ" if h % 2 == 0 else "オレンジ"
+    s1 = "極細"
+    speed = "普通"
+    hook = "M"
+
+    is_nori_season = month in [12, 1, 2, 3, 4]
+
+    # --- ネクタイ選定 ---
+    if rain >= 0.5:
+        c1 = "チャート" if h % 2 == 0 else "ソリッドレッド"
+    elif h <= sun_h:
+        c1 = "チャート" if h % 2 == 0 else "赤ゼブラ"
+    elif t_diff <= -0.1:
+        c1 = "コーラ" if h % 2 == 0 else "赤黒"
+    elif month in [3, 4, 5]:
+        c1 = "ミドキン" if h % 2 == 0 else "グリーン"
+    elif is_nori_season and (temp < 13.0 or sc < 45):
+        c1 = "黒/海苔" if h % 2 == 0 else "コーラ"
+    elif cloud_cover > 70:
+        c1 = "チャート" if h % 2 == 0 else "赤ゼブラ"
+    elif depth >= 60:
+        c1 = "オレンジゼブラ" if h % 2 == 0 else "赤黒"
+    elif depth <= 30:
+        c1 = "オレ金" if h % 2 == 0 else "グリーン"
+    elif h <= sun_h + 2:
+        c1 = "オレ金" if h % 2 == 0 else "マジョーラゼブラ"
+
+    # --- 形状選定 ---
+    if rain >= 0.5:
+        s1 = "ワイドカーリー"
+    elif month in [6, 7, 8] and sc >= 40:
+        s1 = "ロングカーリー"
+    elif depth >= 60:
+        s1 = "強波動" if sc >= 40 else "カーリー"
+    elif depth <= 30:
+        s1 = "ショート" if sc >= 40 else "極細"
+    elif sc >= 50:
+        s1 = "強波動"
+    elif sc >= 30:
+        s1 = "ショート"
+    elif sc >= 20:
+        s1 = "ストレート"
+    else:
+        s1 = "極細"
+
+    # --- 巻き速度 ---
+    if temp >= 18.0 and sc >= 40:
+        speed = "早巻"
+    elif temp <= 12.0 or sc <= 20:
+        speed = "激遅"
+    elif sc >= 30:
+        speed = "普通"
+    else:
+        speed = "遅め"
+
+    # --- フックサイズ ---
+    if month in [12, 1, 2] and (temp < 10.0 or sc < 30):
+        hook = "3S"
+    elif month in [3, 4]:
+        hook = "SS"
+    elif speed == "激遅" or sc < 40:
+        hook = "S"
+    elif temp >= 22.0 and sc >= 50:
+        hook = "L"
+    else:
+        hook = "M"
+
+    # --- ワーム判定 ---
+    worm_option = ""
+    if sc <= 10:
+        worm_option = "+ワーム"
+
+    # --- 抑えパターン ---
+    c2 = OSAE_COLORS.get(c1, "グリーン")
+    s2 = OSAE_SHAPES.get(s1, "カーリー")
+
+    return f"{c1}×{s1}", f"{c2}×{s2}", speed, hook, worm_option
+
+# --- 戦略の決定表 (一括評価) ---
+# suggest_strategy の分岐に効く境界だけで入力を区分し, 区分の組み合わせごとの結果を前計算する
+# 月 (1〜12) の区分: 12〜2月 / 3・4月 / 5月 / 6〜8月 / 9〜11月
+MONTH_GROUPS = np.array([0, 0, 0, 1, 1, 2, 3, 3, 3, 4, 4, 4, 0])
+# 各区分の代表値 (表を作るときに suggest_strategy へ渡す)
+_MONTH_REPS = [1, 3, 5, 6, 9]
+_TEMP_REPS = [9.0, 11.0, 12.5, 15.0, 20.0, 25.0]
+_SCORE_REPS = [10, 15, 20, 25, 35, 40, 45, 50]
+_DEPTH_REPS = [30, 45, 60]
+
+
+def _strategy_bins(h, sun_h, sc, t_diff, month, temp, cloud_cover, rain, depth):
+    return (
+        (h % 2 != 0).astype(np.intp),
+        (h > sun_h).astype(np.intp) + (h > sun_h + 2),
+        (rain >= 0.5).astype(np.intp),
+        (t_diff <= -0.1).astype(np.intp),
+        MONTH_GROUPS[month],
+        (temp >= 10.0).astype(np.intp) + (temp > 12.0) + (temp >= 13.0) + (temp >= 18.0) + (temp >= 22.0),
+        (sc > 10).astype(np.intp) + (sc >= 20) + (sc > 20) + (sc >= 30) + (sc >= 40) + (sc >= 45) + (sc >= 50),
+        (cloud_cover > 70).astype(np.intp),
+        (depth > 30).astype(np.intp) + (depth >= 60),
+    )
+
+# 初回の一括評価で作る (import を軽く保つ)
+@functools.lru_cache(maxsize=None)
+def _strategy_table():
+    outcomes, index = [], {}
+    table = np.empty((2, 3, 2, 2, len(_MONTH_REPS), len(_TEMP_REPS), len(_SCORE_REPS), 2, len(_DEPTH_REPS)), dtype=np.int16)
+    for key in itertools.product(*(range(n) for n in table.shape)):
+        parity, sun_pos, rain, cold, month, temp, sc, cloud, depth = key
+        h = 10 + parity
+        result = suggest_strategy(
+            h, h - (0, 2, 3)[sun_pos], _SCORE_REPS[sc], -0.2 if cold else 0.0, _MONTH_REPS[month],
+            _TEMP_REPS[temp], 80 if cloud else 0, 1.0 if rain else 0.0, _DEPTH_REPS[depth],
+        )
+        if result not in index:
+            index[result] = len(outcomes)
+            outcomes.append(result)
+        table[key] = index[result]
+    return table, np.array(outcomes, dtype=object)
+
+# suggest_strategy と同じ結果を配列でまとめて返す
+# 戻り値: (本命, 抑え, 巻き速度, フック, ワーム) それぞれ入力と同じ形の配列
+def suggest_strategies(h, sun_h, sc, t_diff, month, temp, cloud_cover, rain, depth):
+    table, outcomes = _strategy_table()
+    args = np.broadcast_arrays(*(np.asarray(a) for a in (h, sun_h, sc, t_diff, month, temp, cloud_cover, rain, depth)))
+    res = outcomes[table[_strategy_bins(*args)]]
+    return tuple(res[..., i] for i in range(res.shape[-1]))
+
+# --- 表示ラベル ---
+def weather_label(rain, cloud):
+    if rain >= 0.5: return "☔"
+    elif cloud >= 60: return "☁️"
+    elif cloud <= 20: return "☀️"
+    return "⛅"
+
+def wind_label(wind):
+    if wind >= 10.0: return "爆風"
+    elif wind >= 7.0: return "強風"
+    elif wind >= 5.0: return "やや強"
+    elif wind >= 2.0: return "最適"
+    return "静穏"
+
+def low_temp_label(temp):
+    if temp <= 10.0: return "激渋"
+    elif temp <= 12.0: return "低水温"
+    return ""
+
+# --- 時系列の取り出し ---
+# None / 範囲外は NaN として扱う. series は地点×時刻の2次元でもよい (最後の軸が時刻)
+def take_hours(series, idx):
+    arr = np.asarray(series if series is not None else [], dtype=float)
+    idx = np.asarray(idx)
+    out = np.full(arr.shape[:-1] + idx.shape, np.nan)
+    ok = (idx >= 0) & (idx < arr.shape[-1])
+    out[..., ok] = arr[..., idx[ok]]
+    return out
+
+# 各時刻の水温 (ct) と1時間前の水温 (pt) を返す
+# 欠測の ct は窓内で最初に取れた水温、それも無ければ 15.0 で埋める
+def sst_at_hours(series, idx):
+    cur = take_hours(series, idx)
+    prev = take_hours(series, np.asarray(idx) - 1)
+    valid = ~np.isnan(cur)
+    pos = valid.argmax(axis=-1)[..., None]
+    first = np.where(valid.any(axis=-1, keepdims=True), np.take_along_axis(cur, pos, axis=-1), 15.0)
+    ct = np.where(valid, cur, first)
+    pt = np.where(np.isnan(prev), ct, prev)
+    return ct, pt
+
+# --- 時合いスコア (一括計算) ---
+def estimate_tide_array(moon_age, hours):
+    base_high = 8.5; delay = 0.8
+    high_tide = (base_high + (np.asarray(moon_age) % 15) * delay) % 12
+    diff = np.abs(np.asarray(hours) - high_tide)
+    diff = np.where(diff > 6, 12 - diff, diff)
+    level = np.cos(diff * (math.pi / 6))
+    is_slack = (diff < 1.0) | (np.abs(diff - 6.0) < 1.0)
+    return level, is_slack
+
+# 最後の軸を時間軸として、エリア×日×時間をまとめてスコア化する
+# 戻り値: (スコア int, 転流フラグ bool, 潮位 float)
+def score_hours(hours, temps, tdiffs, clouds, winds, rains, moon_age, sun_h, day_trend_score=0, use_historical=False):
+    hours, temps, tdiffs, clouds, winds, rains = np.broadcast_arrays(
+        np.asarray(hours), np.asarray(temps, dtype=float), np.asarray(tdiffs, dtype=float),
+        np.nan_to_num(np.asarray(clouds, dtype=float)), np.nan_to_num(np.asarray(winds, dtype=float)),
+        np.nan_to_num(np.asarray(rains, dtype=float)),
+    )
+    moon_age = np.asarray(moon_age)[..., None] if np.ndim(moon_age) else moon_age
+    sun_h = np.asarray(sun_h)[..., None] if np.ndim(sun_h) else sun_h
+    day_trend_score = np.asarray(day_trend_score)[..., None] if np.ndim(day_trend_score) else day_trend_score
+    use_historical = np.asarray(use_historical)[..., None] if np.ndim(use_historical) else use_historical
+
+    level, slack = estimate_tide_array(moon_age, hours)
+    level, slack = np.broadcast_to(level, hours.shape), np.broadcast_to(slack, hours.shape)
+
+    sc = np.zeros(hours.shape, dtype=np.int64)
+    sun_d = np.abs(hours - sun_h)
+    sc += np.where(sun_d == 0, 40, np.where(sun_d == 1, 20, 0))
+
+    # 先頭の時刻は前の潮位が無いので潮変わり判定をしない
+    moving = np.zeros(hours.shape, dtype=bool)
+    moving[..., 1:] = np.abs(level[..., 1:] - level[..., :-1]) > 0.3
+    sc += np.where(slack, 50, np.where(moving, 30, 0))
+
+    sst = np.where(tdiffs >= 0.1, 20, np.where(tdiffs <= -0.1, -20, 0))
+    sc += np.where(use_historical, 0, sst)
+    sc += np.asarray(day_trend_score, dtype=np.int64)
+
+    sc += np.where(rains >= 0.5, 10, np.where(clouds >= 60, 10, np.where(clouds <= 20, -5, 0)))
+
+    sc += np.where(winds >= 7.0, -10, np.where(winds >= 5.0, 5, np.where(winds >= 2.0, 20, -20)))
+    sc = np.where(winds >= 10.0, 0, sc)
+
+    sc = np.where(temps <= 10.0, np.trunc(sc * 0.2), np.where(temps <= 12.0, np.trunc(sc * 0.5), sc)).astype(np.int64)
+    sc = np.clip(sc, 0, 100)
+    return sc, slack, level
@@ -0,0 +1,129 @@
+import datetime
+import hashlib
+
+import numpy as np
+
+# --- 予報の時系列 (上流の JSON を float32 の配列と時刻の索引にして持つ) ---
+# 値の list (None 混じり) は抱えず, 項目ごとの float32 (欠測は NaN) を1枚の配列にまとめる
+# 時刻は先頭の時刻 (タイムゾーン付き) と1時間刻みの位置で表す. GMT の水温と日本時間の天気も時刻で揃う
+JST = datetime.timezone(datetime.timedelta(hours=9))
+HOUR = datetime.timedelta(hours=1)
+# 上流の値は小数3桁まで. float32 にしたときの誤差 (20.4 → 20.399999...) はこの桁で戻す
+DECIMALS = 3
+
+
+def local_midnight(date):
+    return datetime.datetime.combine(date, datetime.time(), JST)
+
+def utc_midnight(date):
+    return datetime.datetime.combine(date, datetime.time(), datetime.timezone.utc)
+
+# float32 の値を元の小数 (float64) に戻す. NaN はそのまま
+def restore(arr):
+    return np.round(np.asarray(arr, dtype=float), DECIMALS)
+
+
+class HourlySeries:
+    __slots__ = ("start", "names", "values", "daily", "version")
+
+    # columns は {項目名: 値の並び}. 長さが揃わない項目は末尾を NaN で埋める
+    def __init__(self, start, columns, daily=None):
+        if start.tzinfo is None:
+            raise ValueError("start must be timezone-aware")
+        arrays = [np.asarray(v if v is not None else [], dtype=np.float32) for v in columns.values()]
+        values = np.full((len(arrays), max((len(a) for a in arrays), default=0)), np.nan, dtype=np.float32)
+        for i, a in enumerate(arrays):
+            values[i, :len(a)] = a
+        # キャッシュで共有するので書き換えられないようにしておく
+        values.flags.writeable = False
+        self.start = start.astimezone(JST)
+        self.names = tuple(columns)
+        self.values = values
+        self.daily = {name: tuple(v) for name, v in (daily or {}).items()}
+        self.version = self._digest()
+
+    def _digest(self):
+        h = hashlib.sha1(self.start.isoformat().encode())
+        h.update(repr((self.names, sorted(self.daily.items()))).encode())
+        h.update(self.values.tobytes())
+        return h.hexdigest()[:16]
+
+    def __len__(self):
+        return self.values.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    # t (タイムゾーン付き) が先頭から何時間目か. 先頭より前なら負
+    def offset(self, t):
+        return (t - self.start) // HOUR
+
+    # start から n 時間が全部取得範囲に入っているか
+    def covers(self, start, n):
+        i = self.offset(start)
+        return 0 <= i and i + n <= len(self)
+
+    def column(self, name):
+        return self.values[self.names.index(name)] if name in self.names else None
+
+    # start から n 時間分 (float32). 範囲内ならコピーしない view, はみ出す分は NaN で埋めたコピー
+    def window(self, name, start, n):
+        col = self.column(name)
+        i = self.offset(start)
+        if col is not None and self.covers(start, n):
+            return col[i:i + n]
+        out = np.full(n, np.nan, dtype=np.float32)
+        lo, hi = max(i, 0), min(i + n, len(self))
+        if col is not None and lo < hi:
+            out[lo - i:hi - i] = col[lo:hi]
+        return out
+
+    # start から idx 時間後 (整数の配列) の値を元の小数で. 範囲外・欠測は NaN
+    def take(self, name, start, idx):
+        col = self.column(name)
+        idx = self.offset(start) + np.asarray(idx)
+        out = np.full(idx.shape, np.nan)
+        if col is not None:
+            ok = (idx >= 0) & (idx < len(col))
+            out[ok] = col[idx[ok]]
+        return restore(out)
+
+    # 日ごとの値 (日の出など). その日が無ければ None
+    def daily_value(self, name, date):
+        times, values = self.daily.get("time", ()), self.daily.get(name, ())
+        key = date.isoformat()
+        if key not in times:
+            return None
+        k = times.index(key)
+        return values[k] if k < len(values) else None
+
+    def __getstate__(self):
+        return self.start, self.names, self.values, self.daily, self.version
+
+    def __setstate__(self, state):
+        self.start, self.names, values, self.daily, self.version = state
+        values.flags.writeable = False
+        self.values = values
+
+    def __repr__(self):
+        return f"HourlySeries({self.start.isoformat()}, {len(self)}h, {', '.join(self.names)})"
+
+
+# Open-Meteo の1地点分のレスポンスから作る. 先頭の時刻は hourly.time と utc_offset_seconds から
+# (marine は GMT, forecast は timezone=Asia/Tokyo). 取得失敗 (None) は None のまま
+def from_openmeteo(data, start=None):
+    if data is None:
+        return None
+    hourly = dict(data.get("hourly") or {})
+    times = hourly.pop("time", None)
+    if start is None:
+        if not times:
+            raise ValueError("hourly.time is missing")
+        tz = datetime.timezone(datetime.timedelta(seconds=data.get("utc_offset_seconds", 0)))
+        start = datetime.datetime.fromisoformat(times[0]).replace(tzinfo=tz)
+    return HourlySeries(start, hourly, data.get("daily"))
+
+# レスポンスの dict でも HourlySeries でも受け付ける
+def as_series(data):
+    return data if data is None or isinstance(data, HourlySeries) else from_openmeteo(data)
@@ -0,0 +1,410 @@
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import cache
+import metrics
+import model_runs
+import openmeteo
+from series import HourlySeries, from_openmeteo, local_midnight, restore, utc_midnight
+
+logger = logging.getLogger(__name__)
+
+# --- 日ごとの分割キャッシュ (地点 x 日 のシャードから期間を組み立てる) ---
+# 期間の URL ごとに丸ごと持つと, 1日ずらしただけで重なる日まで取り直しになる
+# 1シャード = 1地点1日分 (24時間). 無い日・古い日だけを上流に取りに行く
+# 日の区切りは API の start_date / end_date と同じ (marine は GMT, forecast は日本時間)
+# 新鮮な期限はシャードごとに持つ (上流モデルの次の公開まで. 予報範囲外の日は範囲に入る手前まで)
+KINDS = {
+    "marine": (openmeteo.marine_days_url, utc_midnight),
+    "forecast": (openmeteo.forecast_url, local_midnight),
+}
+MAX_SHARDS = 20000
+# 続いた日はまとめて1リクエストにする (予報 API の上限まで)
+MAX_RUN_DAYS = openmeteo.MAX_FORECAST_DAYS
+
+
+def shard_key(kind, lat, lon, day):
+    return f"shard:{kind}:{lat},{lon}:{day.isoformat()}"
+
+def _days(first, last):
+    return [first + datetime.timedelta(days=k) for k in range((last - first).days + 1)]
+
+# 日付の並び (昇順) を連続した区間 [(最初の日, 最後の日)] に分ける
+def _runs(days):
+    runs = []
+    for d in days:
+        if runs and d == runs[-1][1] + datetime.timedelta(days=1) and (d - runs[-1][0]).days < MAX_RUN_DAYS:
+            runs[-1][1] = d
+        else:
+            runs.append([d, d])
+    return [tuple(r) for r in runs]
+
+
+# シャードは (取得時刻, 項目名, float32 の (項目, 24) 配列, 日ごとの値, 新鮮な期限) のタプル
+# 値が全部欠けた日 (水温の予報範囲外. 予報は平年値で補う) は範囲に入るまで取り直さない
+def _split(kind, series, days, now):
+    midnight = KINDS[kind][1]
+    rows = []
+    for d in days:
+        values = np.array([series.window(name, midnight(d), 24) for name in series.names], dtype=np.float32)
+        rows.append((d, values.reshape(len(series.names), 24)))
+    last_day = max((d for d, values in rows if not np.isnan(values).all()), default=None)
+    shards = []
+    for d, values in rows:
+        lead = model_runs.lead_days(kind, d, last_day, now) if np.isnan(values).all() else 0
+        daily = {name: series.daily_value(name, d) for name in series.daily if name != "time"}
+        shards.append((now, series.names, values, daily, model_runs.expires_at(kind, now, lead)))
+    return shards
+
+def _payload(shard):
+    fetched_at, names, values, daily, expires_at = shard
+    return {
+        "fetched_at": fetched_at,
+        "expires_at": expires_at,
+        "hourly": {name: [None if v != v else v for v in restore(row).tolist()] for name, row in zip(names, values)},
+        "daily": daily,
+    }
+
+def _from_payload(payload):
+    names = tuple(payload["hourly"])
+    values = np.array([payload["hourly"][name] for name in names], dtype=np.float32).reshape(len(names), 24)
+    # 期限を持たない以前の版のシャードは取得から1時間
+    expires_at = payload.get("expires_at", payload["fetched_at"] + cache.FRESH_TTL)
+    return payload["fetched_at"], names, values, payload["daily"], expires_at
+
+# シャードを日付順に並べて1本の HourlySeries にする. 欠けた日は NaN, 全日無ければ None
+def _assemble(kind, days, shards):
+    if all(s is None for s in shards):
+        return None
+    names, daily_names = [], []
+    for s in shards:
+        if s is not None:
+            names += [n for n in s[1] if n not in names]
+            daily_names += [n for n in s[3] if n not in daily_names]
+    values = np.full((len(names), 24 * len(days)), np.nan, dtype=np.float32)
+    for k, s in enumerate(shards):
+        if s is not None:
+            for name, row in zip(s[1], s[2]):
+                values[names.index(name), 24 * k:24 * k + 24] = row
+    daily = {name: [s[3].get(name) if s is not None else None for s in shards] for name in daily_names}
+    if daily:
+        daily["time"] = [d.isoformat() for d in days]
+    return HourlySeries(KINDS[kind][1](days[0]), dict(zip(names, values)), daily)
+
+
+class ShardCache:
+    # プロセス内の LRU. 永続キャッシュ (あれば) にも書き, プロセス間・再起動後も使う
+    # 期限を過ぎてから stale_ttl 秒までは古いシャードとして返す (裏で取り直す)
+    def __init__(self, max_entries=MAX_SHARDS, stale_ttl=cache.STALE_TTL):
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {cache.FRESH: 0, cache.STALE: 0, cache.MISS: 0}
+        self.evictions = 0
+
+    def _put(self, key, shard):
+        with self._lock:
+            self._entries[key] = shard
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _memory(self, key):
+        with self._lock:
+            shard = self._entries.get(key)
+            if shard is not None:
+                self._entries.move_to_end(key)
+            return shard
+
+    def _disk(self, key, disk, peek=False):
+        try:
+            payload = disk.peek(key)[0] if peek else disk.get(key)[0]
+        except sqlite3.Error as e:
+            logger.warning("disk cache read failed: %s", e)
+            return None
+        if payload is None:
+            return None
+        shard = _from_payload(payload)
+        self._put(key, shard)
+        return shard
+
+    # (シャード, 状態, 経過秒数) を返す. 状態は cache.FRESH / STALE / MISS
+    # 手元のシャードが新鮮でなければ, 他のプロセス (先読みなど) が永続キャッシュに書いた新しい方を使う
+    def get(self, key, disk=None, now=None):
+        now = now or time.time()
+        shard = self._memory(key)
+        if disk is not None and (shard is None or now > shard[4]):
+            newer = self._disk(key, disk)
+            if newer is not None and (shard is None or newer[0] > shard[0]):
+                shard = newer
+        age = now - shard[0] if shard is not None else None
+        if shard is None or now > shard[4] + self.stale_ttl:
+            state, shard = cache.MISS, None
+        else:
+            state = cache.FRESH if now <= shard[4] else cache.STALE
+        with self._lock:
+            self.counts[state] += 1
+        return shard, state, age
+
+    # 手元 (プロセス内) のシャードが全部新鮮なら, そのうち最も早い期限. 1つでも無い・古ければ None
+    def fresh_until(self, keys, now=None):
+        now = now or time.time()
+        until = None
+        with self._lock:
+            for key in keys:
+                shard = self._entries.get(key)
+                if shard is None or now > shard[4]:
+                    return None
+                until = shard[4] if until is None else min(until, shard[4])
+        return until
+
+    # 手元 (プロセス内) のシャードを取得した時刻のうち最も古いもの (pick=max なら最も新しいもの). 1つでも無ければ None
+    def fetched_at(self, keys, pick=min):
+        found = None
+        with self._lock:
+            for key in keys:
+                shard = self._entries.get(key)
+                if shard is None:
+                    return None
+                found = shard[0] if found is None else pick(found, shard[0])
+        return found
+
+    # 期限を無視して返す. 上流障害時のフォールバック用
+    def peek(self, key, disk=None):
+        shard = self._memory(key)
+        if shard is None and disk is not None:
+            shard = self._disk(key, disk, peek=True)
+        return shard
+
+    def put_many(self, items, disk=None):
+        for key, shard in items:
+            self._put(key, shard)
+        if disk is not None and items:
+            try:
+                disk.set_many([(key, _payload(shard), shard[4]) for key, shard in items])
+            except sqlite3.Error as e:
+                logger.warning("disk cache write failed: %s", e)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def samples(self):
+        labels = {"cache": "shard"}
+        with self._lock:
+            return [
+                ("cache_hits_total", "counter", {**labels, "state": "fresh"}, self.counts[cache.FRESH]),
+                ("cache_hits_total", "counter", {**labels, "state": "stale"}, self.counts[cache.STALE]),
+                ("cache_misses_total", "counter", labels, self.counts[cache.MISS]),
+                ("cache_evictions_total", "counter", labels, self.evictions),
+                ("cache_entries", "gauge", labels, len(self._entries)),
+            ]
+
+
+shard_cache = ShardCache()
+metrics.add_collector(shard_cache.samples)
+
+# 古いシャードの裏での取り直し (同じ URL は1本だけ)
+_refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="shards")
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+# --- 取得 ---
+# job は (種類, 最初の日, 最後の日, 緯度の並び, 経度の並び). 1 job = 上流1リクエスト
+def _job_url(job):
+    kind, first, last, lats, lons = job
+    return KINDS[kind][0](first, last, lats, lons)
+
+# レスポンスを地点 x 日のシャードに分けて保存し, {キー: シャード} を返す
+def _store(job, data, disk, now):
+    kind, first, last, lats, lons = job
+    days = _days(first, last)
+    items = []
+    for lat, lon, loc in zip(lats, lons, openmeteo.split_locations(data, len(lats))):
+        shards = _split(kind, from_openmeteo(loc), days, now)
+        items += [(shard_key(kind, lat, lon, d), s) for d, s in zip(days, shards)]
+    shard_cache.put_many(items, disk)
+    return dict(items)
+
+def _revalidate(job, disk):
+    url = _job_url(job)
+    with _refreshing_lock:
+        if url in _refreshing:
+            return
+        _refreshing.add(url)
+
+    def run():
+        try:
+            _store(job, openmeteo.fetch_live(url, background=True), disk, time.time())
+        except openmeteo.BudgetExceeded as e:
+            logger.info("shard revalidation deferred: %s", e)
+        except (openmeteo.FetchError, ValueError) as e:
+            logger.warning("shard revalidation failed: %s", e)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(url)
+
+    _refresher.submit(run)
+
+# query ごとに全地点 x 全日のシャードを引く. found は {キー: (シャード, 状態, 経過秒数)}
+def _plan(queries, disk, now):
+    plans = []
+    for kind, first, last, lats, lons in queries:
+        days = _days(first, last)
+        found = {
+            key: shard_cache.get(key, disk, now)
+            for lat, lon in zip(lats, lons) for key in (shard_key(kind, lat, lon, d) for d in days)
+        }
+        plans.append((kind, days, lats, lons, found))
+    return plans
+
+# 上流が受け付ける最後の日 (今日から予報APIの最大日数). これより先の日を頼むと期間ごと 400 になる
+def _last_day(kind, now):
+    today = datetime.datetime.fromtimestamp(now, model_runs.TIMEZONES[kind]).date()
+    return today + datetime.timedelta(days=openmeteo.MAX_FORECAST_DAYS - 1)
+
+# 上流に頼めない日の新鮮でないシャードを, 値の無いシャード (予報は平年値で補う) で置き換えて {キー: シャード} を返す
+# 期限は範囲に入る手前まで. 上流にも予算にも触れない
+def _placeholders(plans, disk, now):
+    items = []
+    for kind, days, lats, lons, found in plans:
+        last = _last_day(kind, now)
+        for d in days:
+            if d <= last:
+                continue
+            expires_at = model_runs.expires_at(kind, now, model_runs.lead_days(kind, d, None, now))
+            for lat, lon in zip(lats, lons):
+                key = shard_key(kind, lat, lon, d)
+                if found[key][1] != cache.FRESH:
+                    items.append((key, (now, (), np.empty((0, 24), dtype=np.float32), {}, expires_at)))
+    shard_cache.put_many(items, disk)
+    return dict(items)
+
+# pick(その日の全地点の (シャード, 状態, 経過秒数)) が真の日を, 全地点まとめて連続区間の job にする
+# 上流に頼めない日は job にしない
+def _jobs(plans, pick, now):
+    jobs = []
+    for kind, days, lats, lons, found in plans:
+        last = _last_day(kind, now)
+        wanted = [
+            d for d in days
+            if d <= last and pick([found[shard_key(kind, lat, lon, d)] for lat, lon in zip(lats, lons)])
+        ]
+        jobs += [(kind, a, b, lats, lons) for a, b in _runs(wanted)]
+    return jobs
+
+# job を並列に取得して保存する. 取れたシャードの {キー: シャード} と失敗した (job, 例外) を返す
+def _fetch_jobs(jobs, disk, now, background=False):
+    fetched, failed = {}, []
+    urls = [_job_url(job) for job in jobs]
+    for job, data in zip(jobs, openmeteo.fetch_all(urls, cached=False, background=background)):
+        try:
+            if isinstance(data, openmeteo.FetchError):
+                raise data
+            fetched.update(_store(job, data, disk, now))
+        except (openmeteo.FetchError, ValueError) as e:
+            if not isinstance(e, openmeteo.FetchError):
+                logger.warning("invalid shard response: %s", e)
+            failed.append((job, e))
+    return fetched, failed
+
+# queries は (種類, 最初の日, 最後の日, 緯度の並び, 経度の並び) の並び
+# query ごとに (地点ごとの HourlySeries (全日取れなければ None), 全シャードが揃ったか) を返す
+# 無い日は取得し, 古い日は手元の値を返しつつ裏で取り直す. 上流が落ちていれば期限切れのシャードで補う
+# 上流に頼めない先の日は取りに行かず, 値の無いシャード (平年値で補う) にする
+# background=True なら裏の取得と同じく予算の残りが少ないときは取りに行かない (手元の古いシャードで補い, 揃わない)
+def fetch(queries, disk=None, now=None, background=False):
+    disk = disk or openmeteo.get_disk_cache()
+    now = now or time.time()
+    plans = _plan(queries, disk, now)
+    missing = lambda found: any(state == cache.MISS for _, state, _ in found)
+    stale = lambda found: not missing(found) and any(state == cache.STALE for _, state, _ in found)
+    for job in _jobs(plans, stale, now):
+        _revalidate(job, disk)
+    fetched, failed = _fetch_jobs(_jobs(plans, missing, now), disk, now, background)
+    fetched.update(_placeholders(plans, disk, now))
+    for (kind, first, last, lats, lons), _ in failed:
+        for lat, lon in zip(lats, lons):
+            for d in _days(first, last):
+                key = shard_key(kind, lat, lon, d)
+                shard = shard_cache.peek(key, disk)
+                if shard is not None:
+                    metrics.inc("upstream_fallbacks_total", kind="last_known_good")
+                    fetched[key] = shard
+
+    results = []
+    for kind, days, lats, lons, found in plans:
+        series, complete = [], True
+        for lat, lon in zip(lats, lons):
+            keys = [shard_key(kind, lat, lon, d) for d in days]
+            shards = [fetched[key] if key in fetched else found[key][0] for key in keys]
+            complete = complete and all(s is not None for s in shards)
+            series.append(_assemble(kind, days, shards))
+        results.append((series, complete))
+    return results
+
+# 期限を過ぎた (または無い) シャードを取り直す (先読み用)
+# 新しい run がまだ公開されていない日は取っても同じ値なので取らない. 予算が足りなければ次回に回す
+# (失敗した (job, 例外) の並び, 予算で次回に回した job の並び) を返す. どちらにも無い地点は取り直したか新鮮なまま
+def refresh(queries, disk=None, now=None):
+    disk = disk or openmeteo.get_disk_cache()
+    now = now or time.time()
+    plans = _plan(queries, disk, now)
+    _placeholders(plans, disk, now)
+    jobs = _jobs(plans, lambda found: any(state != cache.FRESH for _, state, _ in found), now)
+    _, failed = _fetch_jobs(jobs, disk, now, background=True)
+    deferred = [job for job, e in failed if isinstance(e, openmeteo.BudgetExceeded)]
+    if deferred:
+        logger.info("refresh deferred for %d requests (request budget)", len(deferred))
+    return [(job, e) for job, e in failed if not isinstance(e, openmeteo.BudgetExceeded)], deferred
+
+
+# --- 期間の組み立て ---
+# start_date から days 日分の予報に要る (marine, forecast) の query. 水温は前日分から
+def window_queries(start_date, days, lats, lons):
+    end_date = start_date + datetime.timedelta(days=days - 1)
+    return [
+        ("marine", start_date - datetime.timedelta(days=1), end_date, lats, lons),
+        ("forecast", start_date, end_date, lats, lons),
+    ]
+
+def _area_coords(areas):
+    return [a["lat"] for a in areas.values()], [a["lon"] for a in areas.values()]
+
+# queries の全シャードが手元で全部新鮮なら, その最も早い期限. でなければ None
+def fresh_until(queries, now=None):
+    keys = [
+        shard_key(kind, lat, lon, d)
+        for kind, first, last, lats, lons in queries
+        for lat, lon in zip(lats, lons) for d in _days(first, last)
+    ]
+    return shard_cache.fresh_until(keys, now)
+
+# 全エリアの期間のシャードが全部新鮮ならその最も早い期限 (UI のキャッシュのキーにする). でなければ None
+def areas_fresh_until(start_date, days, areas, now=None):
+    return fresh_until(window_queries(start_date, days, *_area_coords(areas)), now)
+
+# エリアの期間のシャードを取得した時刻 (手元にあるうち最も古いもの, pick=max なら最も新しいもの). 揃っていなければ None
+def area_fetched_at(start_date, days, loc, pick=min):
+    keys = [
+        shard_key(kind, loc["lat"], loc["lon"], d)
+        for kind, first, last, _, _ in window_queries(start_date, days, [loc["lat"]], [loc["lon"]])
+        for d in _days(first, last)
+    ]
+    return shard_cache.fetched_at(keys, pick)
+
+# 全エリアの (sd, wd). 足りない日だけを marine / forecast 各1リクエスト (日が飛べば区間ごと) で取る
+# 失敗した側は None (平年値・日の出7時で補う)
+def fetch_areas(start_date, days, areas):
+    (sds, _), (wds, _) = fetch(window_queries(start_date, days, *_area_coords(areas)))
+    return dict(zip(areas, zip(sds, wds)))
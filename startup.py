@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- 起動時間の計測 ---
+# MATSURI_PROFILE_STARTUP=1 で有効. プロセス内で最初に import された時刻を起点にする
+ENABLED = os.environ.get("MATSURI_PROFILE_STARTUP") == "1"
+_T0 = time.perf_counter()
+
+
+# プロセス起動からの経過秒 (Linux の /proc が読めない環境では None)
+def process_uptime():
+    try:
+        with open("/proc/self/stat") as fp:
+            start_ticks = int(fp.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as fp:
+            uptime = float(fp.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupProfile:
+    def __init__(self):
+        self.marks = {}
+        self.runs = 0
+        self._run_t0 = None
+        self._run_marks = {}
+        self._reported = False
+
+    def start_run(self):
+        self.runs += 1
+        self._run_t0 = time.perf_counter()
+        self._run_marks = {}
+
+    # 段階ごとの時刻. プロセスで最初の1回 (コールドスタート) と今回の実行の両方を記録する
+    def mark(self, label):
+        now = time.perf_counter()
+        if label not in self.marks:
+            self.marks[label] = {"since_import_s": now - _T0, "process_uptime_s": process_uptime(), "modules": len(sys.modules)}
+        if self._run_t0 is not None:
+            self._run_marks[label] = now - self._run_t0
+
+    def report(self):
+        return {"cold": self.marks, "run": self._run_marks, "runs": self.runs}
+
+    # 最初の実行だけ JSON でログに出す
+    def log_once(self):
+        if not self._reported:
+            self._reported = True
+            logger.info("startup %s", json.dumps(self.report(), ensure_ascii=False))
+
+
+profile = StartupProfile()
+
+
+# --- import 時間の内訳 (python -X importtime を集計する) ---
+def import_times(module="app", top=20):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        parts = line[len("import time:"):].split("|") if line.startswith("import time:") else []
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            # 先頭の空白1つは区切り. それ以上のインデントは入れ子の import
+            rows.append((parts[2][1:], int(parts[1]) / 1000))
+    total = sum(ms for name, ms in rows if not name.startswith(" "))
+    heaviest = sorted(((name.strip(), ms) for name, ms in rows), key=lambda r: -r[1])[:top]
+    return {"module": module, "total_ms": total, "heaviest": heaviest}
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="起動時の import 時間を調べる")
+    parser.add_argument("module", nargs="?", default="app")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    result = import_times(args.module, args.top)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+    print(f"import {result['module']}: {result['total_ms']:.1f} ms")
+    for name, ms in result["heaviest"]:
+        print(f"  {ms:9.1f} ms  {name}")
+
+if __name__ == "__main__":
+    main()